@@ -4,15 +4,23 @@ Flask web application for the Document Generation Agent
 """
 
 import asyncio
+import json
 import logging
+import math
 import os
 import sys
-import threading
-import time
 import traceback
 
 from dotenv import load_dotenv
-from flask import Flask, jsonify, render_template, request, session
+from flask import (
+    Flask,
+    Response,
+    jsonify,
+    render_template,
+    request,
+    session,
+    stream_with_context,
+)
 
 # Load environment variables
 load_dotenv("secrets.env")
@@ -21,15 +29,14 @@ load_dotenv("variables.env")
 # Add the code directory to the path so we can import the docgen_agent
 sys.path.append(os.path.join(os.path.dirname(__file__), "code"))
 
-# Try OpenAI first, fallback to NVIDIA
-try:
-    from docgen_agent_openai import write_report
+from docgen_agent.batch import MAX_BATCH_SIZE
+from docgen_agent.job_store import JobStore
+from docgen_agent import metrics
+from docgen_agent.jobs import CANCELLED, COMPLETED, FAILED, JobQueue, QueueFullError
+from docgen_agent.ratelimit import RATE_LIMIT_API_KEYS, create_rate_limiter
+from docgen_agent.workers import create_worker_pool
 
-    print("Using OpenAI for AI model")
-except ImportError:
-    from docgen_agent import write_report
-
-    print("Using NVIDIA for AI model")
+print("Using NVIDIA for AI model")
 
 app = Flask(__name__)
 app.secret_key = os.urandom(24)
@@ -38,10 +45,41 @@ app.secret_key = os.urandom(24)
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Simple rate limiting
-request_lock = threading.Lock()
-last_request_time = 0
-MIN_REQUEST_INTERVAL = 10  # Minimum seconds between requests
+# Per-client rate limiting, see docgen_agent.ratelimit for the settings
+rate_limiter = create_rate_limiter()
+SSE_KEEPALIVE_SECONDS = 15  # Idle time before an event stream gets a keep-alive
+
+# Reports are generated in the background so no request waits on a full run,
+# and jobs are recorded in data/jobs.sqlite so they survive a restart
+job_queue = JobQueue(pool=create_worker_pool(), store=JobStore())
+metrics.Callback(
+    "docgen_jobs",
+    "Jobs waiting for a slot (queued) and being generated (running).",
+    lambda: {(status,): count for status, count in job_queue.stats().items()},
+    ("status",),
+)
+metrics.Callback(
+    "docgen_job_slots",
+    "How many jobs can run at the same time.",
+    lambda: job_queue.max_workers,
+)
+
+
+_jobs_recovered = False
+
+
+@app.before_request
+def recover_jobs():
+    """Queue the unfinished jobs again when this process first serves a request.
+
+    This is how a WSGI server's workers take part in recovery; running this
+    file recovers them at startup. The job store hands each job to one
+    process only, so every serving process may try.
+    """
+    global _jobs_recovered
+    if not _jobs_recovered:
+        _jobs_recovered = True
+        job_queue.recover()
 
 
 def create_html_template():
@@ -279,6 +317,7 @@ The report structure should include:
                 <div class="spinner"></div>
                 <p>🤖 AI Agent is researching and writing your report...</p>
                 <p><small>This may take a few minutes as the agent searches the web and generates content.</small></p>
+                <p><small id="progress"></small></p>
             </div>
             
             <div id="result" class="result" style="display: none;">
@@ -311,6 +350,40 @@ The report structure should include:
     </div>
 
     <script>
+        // Parse the Server-Sent Events of a streaming response
+        async function* readEvents(response) {
+            const reader = response.body.getReader();
+            const decoder = new TextDecoder();
+            let buffer = '';
+            
+            while (true) {
+                const { value, done } = await reader.read();
+                if (done) {
+                    return;
+                }
+                buffer += decoder.decode(value, { stream: true });
+                
+                let boundary;
+                while ((boundary = buffer.indexOf('\\n\\n')) !== -1) {
+                    const frame = buffer.slice(0, boundary);
+                    buffer = buffer.slice(boundary + 2);
+                    
+                    let name = 'message';
+                    let data = '';
+                    for (const line of frame.split('\\n')) {
+                        if (line.startsWith('event: ')) {
+                            name = line.slice(7);
+                        } else if (line.startsWith('data: ')) {
+                            data += line.slice(6);
+                        }
+                    }
+                    if (data) {
+                        yield { name, data: JSON.parse(data) };
+                    }
+                }
+            }
+        }
+        
         document.getElementById('reportForm').addEventListener('submit', async function(e) {
             e.preventDefault();
             
@@ -318,18 +391,22 @@ The report structure should include:
             const reportStructure = document.getElementById('report_structure').value;
             const generateBtn = document.getElementById('generateBtn');
             const loading = document.getElementById('loading');
+            const progress = document.getElementById('progress');
             const result = document.getElementById('result');
+            const reportContent = document.getElementById('reportContent');
             const error = document.getElementById('error');
             
             // Show loading, hide results and errors
             loading.style.display = 'block';
             result.style.display = 'none';
             error.style.display = 'none';
+            progress.textContent = '';
+            reportContent.textContent = '';
             generateBtn.disabled = true;
             generateBtn.textContent = '⏳ Generating...';
             
             try {
-                const response = await fetch('/generate', {
+                const response = await fetch('/generate/stream', {
                     method: 'POST',
                     headers: {
                         'Content-Type': 'application/json',
@@ -340,17 +417,40 @@ The report structure should include:
                     })
                 });
                 
-                const data = await response.json();
+                if (!response.ok) {
+                    const data = await response.json();
+                    throw new Error(data.error || 'An error occurred while generating the report.');
+                }
+                
+                // Render the report section by section as the agent writes it
+                let title = '';
+                let sections = [];
+                const render = () => {
+                    reportContent.textContent = [`# ${title}`, ...sections.filter(Boolean)].join('\\n\\n');
+                };
                 
-                if (response.ok && data.success) {
-                    document.getElementById('reportContent').textContent = data.report;
-                    result.style.display = 'block';
-                } else {
-                    error.textContent = data.error || 'An error occurred while generating the report.';
-                    error.style.display = 'block';
+                for await (const { name, data } of readEvents(response)) {
+                    if (name === 'node_started') {
+                        progress.textContent = `Current step: ${data.node}`;
+                    } else if (name === 'plan') {
+                        title = data.title;
+                        sections = data.sections.map(() => '');
+                        render();
+                        result.style.display = 'block';
+                    } else if (name === 'section') {
+                        sections[data.index] = data.content;
+                        render();
+                    } else if (name === 'report') {
+                        reportContent.textContent = data.report;
+                        result.style.display = 'block';
+                    } else if (name === 'error') {
+                        throw new Error(data.error);
+                    } else if (name === 'cancelled') {
+                        throw new Error('The report was cancelled.');
+                    }
                 }
             } catch (err) {
-                error.textContent = 'Network error: ' + err.message;
+                error.textContent = 'Error: ' + err.message;
                 error.style.display = 'block';
             } finally {
                 loading.style.display = 'none';
@@ -372,57 +472,349 @@ def index():
     return render_template("index.html")
 
 
+def client_key():
+    """Identify the client by its API key if it is a known one, else by address."""
+    api_key = request.headers.get("X-API-Key")
+    if api_key in RATE_LIMIT_API_KEYS:
+        return f"key:{api_key}"
+    return f"ip:{request.remote_addr}"
+
+
+def check_rate_limit(cost=1):
+    """Return an error response if the client has used up its requests.
+
+    A request for several reports costs one token per report.
+    """
+    wait_time = rate_limiter.acquire(client_key(), cost)
+    if wait_time:
+        return (
+            jsonify(
+                {
+                    "error": f"Rate limit exceeded. Please wait {wait_time:.1f} seconds before making another request."
+                }
+            ),
+            429,
+            {"Retry-After": str(math.ceil(wait_time))},
+        )
+
+    return None
+
+
+def parse_report_request(data):
+    """Validate one report request, returning it or an error message."""
+    if not isinstance(data, dict):
+        return None, "Request must be a JSON object"
+
+    topic = data.get("topic", "")
+    report_structure = data.get("report_structure", "")
+    force_refresh = data.get("force_refresh", False)
+
+    if not isinstance(topic, str) or not topic.strip():
+        return None, "Topic is required, as a string"
+
+    if not isinstance(report_structure, str) or not report_structure.strip():
+        return None, "Report structure is required, as a string"
+
+    if not isinstance(force_refresh, bool):
+        return None, "force_refresh must be true or false"
+
+    topic = topic.strip()
+    report_structure = report_structure.strip()
+
+    return {
+        "topic": topic,
+        "report_structure": report_structure,
+        "force_refresh": force_refresh,
+    }, None
+
+
+def read_report_request():
+    """Read the report request, or an error response, from the body."""
+    report_request, error = parse_report_request(request.get_json())
+    if error:
+        return None, (jsonify({"error": error}), 400)
+
+    return report_request, None
+
+
+def format_sse(event):
+    """Format a job event as a Server-Sent Events frame."""
+    data = {key: value for key, value in event.items() if key != "event"}
+    return f"event: {event['event']}\ndata: {json.dumps(data)}\n\n"
+
+
+def stream_job_events(job, cancel_on_disconnect=False):
+    """Stream the progress of a job as Server-Sent Events.
+
+    With cancel_on_disconnect, the job is cancelled if the client goes away
+    before it finishes.
+    """
+
+    def generate():
+        try:
+            yield format_sse({"event": "job", **job.to_dict()})
+            cursor = 0
+            while True:
+                events = job.wait_for_events(cursor, timeout=SSE_KEEPALIVE_SECONDS)
+                if not events:
+                    # Keep proxies from closing an idle connection, and notice
+                    # clients that have gone away
+                    yield ": keep-alive\n\n"
+                    continue
+
+                cursor += len(events)
+                for event in events:
+                    yield format_sse(event)
+                    if event["event"] in ("report", "error", "cancelled"):
+                        return
+        finally:
+            if cancel_on_disconnect and not job.done:
+                logger.info(f"Client disconnected, cancelling job {job.id}")
+                job_queue.cancel(job.id)
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @app.route("/generate", methods=["POST"])
 def generate_report():
     """Generate a report based on the form data."""
-    global last_request_time
-
-    # Rate limiting
-    with request_lock:
-        current_time = time.time()
-        time_since_last = current_time - last_request_time
-
-        if time_since_last < MIN_REQUEST_INTERVAL:
-            wait_time = MIN_REQUEST_INTERVAL - time_since_last
-            return (
-                jsonify(
-                    {
-                        "error": f"Rate limit exceeded. Please wait {wait_time:.1f} seconds before making another request."
-                    }
-                ),
-                429,
-            )
-
-        last_request_time = current_time
+    rate_limited = check_rate_limit()
+    if rate_limited:
+        return rate_limited
 
     try:
-        data = request.get_json()
-        topic = data.get("topic", "").strip()
-        report_structure = data.get("report_structure", "").strip()
+        report_request, error = read_report_request()
+        if error:
+            return error
+
+        logger.info(f"Generating report for topic: {report_request['topic']}")
+
+        # Queue the document generation agent
+        job = job_queue.submit(**report_request)
+
+        return (
+            jsonify(
+                {
+                    "success": True,
+                    "job_id": job.id,
+                    "status": job.status,
+                    "status_url": f"/jobs/{job.id}",
+                    "result_url": f"/jobs/{job.id}/result",
+                }
+            ),
+            202,
+            {"Location": f"/jobs/{job.id}"},
+        )
+
+    except QueueFullError as e:
+        logger.warning(f"Rejecting report request: {str(e)}")
+        return (
+            jsonify({"error": "Server is busy. Please try again later."}),
+            503,
+            {"Retry-After": str(math.ceil(e.retry_after))},
+        )
+
+    except Exception as e:
+        logger.error(f"Error generating report: {str(e)}")
+        logger.error(traceback.format_exc())
+        return jsonify({"error": f"Error generating report: {str(e)}"}), 500
 
-        if not topic:
-            return jsonify({"error": "Topic is required"}), 400
 
-        if not report_structure:
-            return jsonify({"error": "Report structure is required"}), 400
+@app.route("/generate/stream", methods=["POST"])
+def generate_report_stream():
+    """Generate a report, streaming its progress as Server-Sent Events."""
+    rate_limited = check_rate_limit()
+    if rate_limited:
+        return rate_limited
 
-        logger.info(f"Generating report for topic: {topic}")
+    try:
+        report_request, error = read_report_request()
+        if error:
+            return error
 
-        # Call the document generation agent
-        result = write_report(topic=topic, report_structure=report_structure)
+        logger.info(f"Streaming report for topic: {report_request['topic']}")
+        job = job_queue.submit(**report_request)
 
-        if result and "report" in result:
-            return jsonify(
-                {"success": True, "report": result["report"], "topic": topic}
-            )
-        else:
-            return jsonify({"error": "Failed to generate report"}), 500
+    except QueueFullError as e:
+        logger.warning(f"Rejecting report request: {str(e)}")
+        return (
+            jsonify({"error": "Server is busy. Please try again later."}),
+            503,
+            {"Retry-After": str(math.ceil(e.retry_after))},
+        )
 
     except Exception as e:
         logger.error(f"Error generating report: {str(e)}")
         logger.error(traceback.format_exc())
         return jsonify({"error": f"Error generating report: {str(e)}"}), 500
 
+    return stream_job_events(job, cancel_on_disconnect=True)
+
+
+@app.route("/batch", methods=["POST"])
+def generate_batch():
+    """Generate many reports, streaming each result as a JSON line."""
+    data = request.get_json()
+    if not isinstance(data, dict):
+        return jsonify({"error": "Request must be a JSON object"}), 400
+
+    reports = data.get("reports")
+    if not isinstance(reports, list) or not reports:
+        return jsonify({"error": "A list of reports is required"}), 400
+
+    # A batch is admitted whole, so it must fit in the job queue
+    max_batch_size = min(MAX_BATCH_SIZE, job_queue.capacity)
+    if len(reports) > max_batch_size:
+        return (
+            jsonify({"error": f"A batch can have at most {max_batch_size} reports"}),
+            400,
+        )
+
+    report_requests = []
+    for index, data in enumerate(reports):
+        report_request, error = parse_report_request(data)
+        if error:
+            return jsonify({"error": f"Report {index}: {error}"}), 400
+        report_requests.append(report_request)
+
+    rate_limited = check_rate_limit(len(report_requests))
+    if rate_limited:
+        return rate_limited
+
+    # Each report is a job, admitted and recorded like any other
+    try:
+        jobs = job_queue.submit_many(report_requests)
+    except QueueFullError as e:
+        logger.warning(f"Rejecting batch of {len(report_requests)} reports: {str(e)}")
+        return (
+            jsonify({"error": "Server is busy. Please try again later."}),
+            503,
+            {"Retry-After": str(math.ceil(e.retry_after))},
+        )
+
+    logger.info(f"Generating a batch of {len(jobs)} reports")
+    indexes = {job.id: index for index, job in enumerate(jobs)}
+
+    def generate():
+        try:
+            for job in job_queue.as_completed(jobs):
+                yield json.dumps(batch_result(indexes[job.id], job)) + "\n"
+        finally:
+            # A client that stops reading cancels the reports still running
+            for job in jobs:
+                if not job.done:
+                    job_queue.cancel(job.id)
+
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+
+def batch_result(index, job):
+    """The result line of a finished batch job."""
+    result = {
+        "index": index,
+        "job_id": job.id,
+        "topic": job.topic,
+        "status": job.status,
+        "usage": job.usage,
+    }
+    if job.status == COMPLETED:
+        plan = next((e for e in job.events if e["event"] == "plan"), {})
+        result["title"] = plan.get("title")
+        result["report"] = job.report
+    else:
+        result["error"] = job.error or f"Report {job.status}"
+    return result
+
+
+@app.route("/jobs/<job_id>")
+def job_status(job_id):
+    """Report the status of a report generation job."""
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+
+    return jsonify(job.to_dict())
+
+
+@app.route("/jobs/<job_id>", methods=["DELETE"])
+def cancel_job(job_id):
+    """Cancel a report generation job."""
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    if job.done:
+        return jsonify({"error": f"Job already {job.status}"}), 409
+
+    cancelled = job_queue.cancel(job_id)
+    if cancelled is None:
+        # Finished meanwhile, or run by another process that still holds it
+        job = job_queue.get(job_id) or job
+        if job.done:
+            return jsonify({"error": f"Job already {job.status}"}), 409
+        return jsonify({"error": "Job is run by another process"}), 409
+
+    logger.info(f"Cancelling job {job_id}")
+    # A job only in the job store is cancelled at once
+    return jsonify(cancelled.to_dict()), 200 if cancelled.done else 202
+
+
+@app.route("/jobs/<job_id>/events")
+def job_events(job_id):
+    """Stream the progress of a job as Server-Sent Events."""
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+
+    return stream_job_events(job)
+
+
+@app.route("/jobs/<job_id>/trace")
+def job_trace(job_id):
+    """Return the trace of a job's run in the Chrome trace event format."""
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+
+    if job.trace is None:
+        return jsonify({"error": "No trace is available for this job"}), 404
+
+    return jsonify({"traceEvents": job.trace, "displayTimeUnit": "ms"})
+
+
+@app.route("/jobs/<job_id>/result")
+def job_result(job_id):
+    """Return the finished report of a job."""
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+
+    if job.status == COMPLETED:
+        return jsonify(
+            {
+                "success": True,
+                "report": job.report,
+                "topic": job.topic,
+                "job_id": job.id,
+                "usage": job.usage,
+            }
+        )
+    if job.status == FAILED:
+        return jsonify({"error": f"Error generating report: {job.error}"}), 500
+    if job.status == CANCELLED:
+        return jsonify({"error": "The report was cancelled."}), 410
+
+    return jsonify(job.to_dict()), 202
+
+
+@app.route("/metrics")
+def metrics_endpoint():
+    """Export metrics in the Prometheus text format."""
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
 
 @app.route("/health")
 def health():
@@ -444,5 +836,11 @@ if __name__ == "__main__":
     # Create the HTML template
     create_html_template()
 
+    # The reloader serves requests from a child process that it starts with
+    # WERKZEUG_RUN_MAIN set, which recovers the jobs; the watcher does not
+    if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        _jobs_recovered = True
+        job_queue.recover()
+
     logger.info("Starting Flask app on http://localhost:5001")
     app.run(debug=True, host="0.0.0.0", port=5001)
@@ -0,0 +1,260 @@
+"""Whole report runs against a fake chat model and a fake Tavily.
+
+Runs async_write_report with every LLM of the report graphs replaced by a
+FakeChatModel (fake_llm.py), which plans the sections, calls the search
+tool and writes with a simulated latency and token throughput, and with
+searches sent over HTTP to a FakeTavily (fake_tavily.py). Everything in
+between is the real workflow: the graphs, the LLM and search limits, the
+query planner, the research corpus and the token budgets.
+
+Two sweeps are run: one report with 1, 5 and 20 sections (--sections), and
+1, 5, 20 and 50 concurrent reports of --concurrent-sections sections each
+(--concurrency). Each scenario runs in a fresh process, so its caches and
+limits start empty and its peak RSS is its own. For each scenario it
+reports:
+  - seconds: the wall-clock time until every report was written;
+  - report_seconds: the median and slowest time of a single report;
+  - critical_path: how the slowest report's time splits into LLM calls
+    (including the wait for a free slot), searches and everything else,
+    following the chain of work that finished last, and the LLM calls and
+    searches on that chain;
+  - peak_rss_mb: the largest resident set size of the process;
+  - llm_calls, prompt_tokens, completion_tokens and searches, summed over
+    the reports.
+
+Prompt tokens are counted with the tokenizer if tiktoken can load it, else
+estimated at 4 characters per token; "exact" says which.
+
+Usage:
+    python benchmarks/bench_end_to_end.py [--sections N,N,...]
+        [--concurrency N,N,...] [--concurrent-sections N] [--tool-rounds N]
+        [--queries N] [--completion-tokens N] [--ttft SECONDS]
+        [--ttft-sigma X] [--tokens-per-second X] [--search-latency SECONDS]
+        [--content-words N] [--raw-content-words N]
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import resource
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any
+
+# Caches stay out of the way in a scratch directory, and nothing is sent out
+os.environ["DOCGEN_DATA_DIR"] = tempfile.mkdtemp(prefix="bench-end-to-end-")
+os.environ["LANGSMITH_TRACING"] = "false"
+os.environ.setdefault("NVIDIA_API_KEY", "fake")
+os.environ.setdefault("TAVILY_API_KEY", "fake")
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "code"))
+
+from fake_llm import FakeChatModel  # noqa: E402
+from fake_tavily import FakeTavily  # noqa: E402
+from tavily import AsyncTavilyClient  # noqa: E402
+
+from docgen_agent import (  # noqa: E402
+    agent,
+    async_write_report,
+    author,
+    researcher,
+    tokens,
+    tools,
+)
+
+
+def _install(model: FakeChatModel) -> None:
+    """Replace the LLMs of the report graphs with model."""
+    with_tools = model.bind_tools([tools.search_tavily])
+    agent.llm = model
+    researcher.llm = model
+    researcher.llm_with_tools = with_tools
+    author.llm = model
+    author.llm_with_tools = with_tools
+
+
+def _critical_path(events: list[dict[str, Any]]) -> dict[str, Any]:
+    """Split a run's time over the chain of its spans that finished last.
+
+    From the end of each span, the chain steps back to the child that
+    finished last, then to the child that finished last before that one
+    started, and so on; the time not covered by such children is the span's
+    own.
+    """
+    spans = {}
+    children: dict[int | None, list[dict]] = {}
+    for event in events:
+        if event["ph"] != "X":
+            continue
+        span = {
+            "category": event["cat"],
+            "start": event["ts"] / 1e6,
+            "end": (event["ts"] + event["dur"]) / 1e6,
+        }
+        spans[event["args"]["span_id"]] = span
+        children.setdefault(event["args"]["parent_id"], []).append(span)
+    for span_id, span in spans.items():
+        span["children"] = sorted(
+            children.get(span_id, []), key=lambda child: child["end"]
+        )
+
+    seconds = {"llm": 0.0, "search": 0.0, "other": 0.0}
+    counts = {"llm": 0, "search": 0}
+
+    def walk(span: dict) -> None:
+        category = span["category"] if span["category"] in counts else "other"
+        if category in counts:
+            counts[category] += 1
+        own = span["end"] - span["start"]
+        until = span["end"]
+        for child in reversed(span["children"]):
+            if child["end"] <= until:
+                own -= child["end"] - child["start"]
+                until = child["start"]
+                walk(child)
+        seconds[category] += own
+
+    roots = children.get(None, [])
+    for root in roots:
+        walk(root)
+    return {
+        "seconds": round(sum(root["end"] - root["start"] for root in roots), 3),
+        **{f"{name}_seconds": round(value, 3) for name, value in seconds.items()},
+        "llm_calls": counts["llm"],
+        "searches": counts["search"],
+    }
+
+
+def _peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return round(peak / (1024**2 if sys.platform == "darwin" else 1024), 1)
+
+
+async def _report(index: int) -> tuple[dict[str, Any] | None, float]:
+    start = time.perf_counter()
+    result = await async_write_report(
+        f"Benchmark topic {index}", "An introduction, a body and a conclusion.", True
+    )
+    return result, time.perf_counter() - start
+
+
+def _scenario(
+    name: str,
+    sections: int,
+    reports: int,
+    model_options: dict[str, Any],
+    tavily_options: dict[str, Any],
+    search_latency: float,
+) -> dict[str, Any]:
+    """Write reports at once in this process, and measure the run."""
+    fake = FakeTavily(**tavily_options).start()
+    fake.configure(latency=search_latency)
+    tools.tavily_client = AsyncTavilyClient(api_key="fake", api_base_url=fake.url)
+    tools.INCLUDE_RAW_CONTENT = tavily_options["raw_content_words"] > 0
+    _install(FakeChatModel(sections=sections, cache=False, **model_options))
+
+    async def run() -> list[tuple[dict[str, Any] | None, float]]:
+        return await asyncio.gather(*[_report(i) for i in range(reports)])
+
+    start = time.perf_counter()
+    outcomes = asyncio.run(run())
+    seconds = time.perf_counter() - start
+    fake.stop()
+
+    written = [(result, took) for result, took in outcomes if result is not None]
+    slowest, _ = max(written, key=lambda outcome: outcome[1])
+    totals = [result["usage"]["total"] for result, _ in written]
+    return {
+        "scenario": name,
+        "sections": sections,
+        "reports": reports,
+        "written": len(written),
+        "seconds": round(seconds, 3),
+        "report_seconds": {
+            "median": round(statistics.median(took for _, took in written), 3),
+            "max": round(max(took for _, took in written), 3),
+        },
+        "critical_path": _critical_path(slowest["trace"]),
+        "peak_rss_mb": _peak_rss_mb(),
+        "llm_calls": sum(total["calls"] for total in totals),
+        "prompt_tokens": sum(total["prompt_tokens"] for total in totals),
+        "completion_tokens": sum(total["completion_tokens"] for total in totals),
+        "searches": sum(result["usage"]["searches"]["calls"] for result, _ in written),
+        "tavily_requests": fake.requests,
+    }
+
+
+def _counts(value: str) -> list[int]:
+    return [int(count) for count in value.split(",")]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sections", type=_counts, default=[1, 5, 20])
+    parser.add_argument("--concurrency", type=_counts, default=[1, 5, 20, 50])
+    parser.add_argument("--concurrent-sections", type=int, default=5)
+    parser.add_argument("--tool-rounds", type=int, default=1)
+    parser.add_argument("--queries", type=int, default=2)
+    parser.add_argument("--completion-tokens", type=int, default=300)
+    parser.add_argument("--ttft", type=float, default=0.2)
+    parser.add_argument("--ttft-sigma", type=float, default=0.5)
+    parser.add_argument("--tokens-per-second", type=float, default=500.0)
+    parser.add_argument("--search-latency", type=float, default=0.1)
+    parser.add_argument("--content-words", type=int, default=60)
+    parser.add_argument("--raw-content-words", type=int, default=0)
+    args = parser.parse_args()
+
+    model_options = {
+        "tool_rounds": args.tool_rounds,
+        "queries_per_call": args.queries,
+        "completion_tokens": args.completion_tokens,
+        "ttft": args.ttft,
+        "ttft_sigma": args.ttft_sigma,
+        "tokens_per_second": args.tokens_per_second,
+    }
+    tavily_options = {
+        "content_words": args.content_words,
+        "raw_content_words": args.raw_content_words,
+    }
+    scenarios = [(f"sections_{count}", count, 1) for count in args.sections] + [
+        (f"concurrency_{count}", args.concurrent_sections, count)
+        for count in args.concurrency
+    ]
+
+    results = []
+    context = multiprocessing.get_context("spawn")
+    for name, sections, reports in scenarios:
+        with ProcessPoolExecutor(1, mp_context=context) as pool:
+            future = pool.submit(
+                _scenario,
+                name,
+                sections,
+                reports,
+                model_options,
+                tavily_options,
+                args.search_latency,
+            )
+            results.append(future.result())
+
+    print(
+        json.dumps(
+            {
+                "benchmark": "end_to_end",
+                "exact": tokens.exact(),
+                "model": model_options,
+                "search_latency": args.search_latency,
+                "tavily": tavily_options,
+                "scenarios": results,
+            },
+            indent=2,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
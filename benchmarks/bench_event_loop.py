@@ -0,0 +1,112 @@
+"""Per-request overhead of asyncio.run versus the shared background loop.
+
+Each simulated report makes a few HTTP calls to a local keep-alive server,
+the way the Tavily client does. With asyncio.run every report pays for a new
+event loop and a new connection pool (a pooled client cannot outlive the
+loop it was created on); on the shared loop one client and its connections
+serve every report.
+
+Usage:
+    python benchmarks/bench_event_loop.py [--requests N] [--calls-per-request N]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "code"))
+
+from docgen_agent.loop import BackgroundLoop  # noqa: E402
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        body = b'{"results": []}'
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+async def _report(client: httpx.AsyncClient, calls: int) -> None:
+    for _ in range(calls):
+        response = await client.get("/search")
+        response.raise_for_status()
+
+
+async def _report_with_new_client(base_url: str, calls: int) -> None:
+    async with httpx.AsyncClient(base_url=base_url) as client:
+        await _report(client, calls)
+
+
+async def _make_client(base_url: str) -> httpx.AsyncClient:
+    return httpx.AsyncClient(base_url=base_url)
+
+
+def _summarize(samples: list[float]) -> dict[str, float]:
+    samples_ms = sorted(sample * 1000 for sample in samples)
+    return {
+        "mean_ms": round(statistics.fmean(samples_ms), 3),
+        "p50_ms": round(samples_ms[len(samples_ms) // 2], 3),
+        "p95_ms": round(samples_ms[int(len(samples_ms) * 0.95)], 3),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--calls-per-request", type=int, default=5)
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+
+    # Before: a fresh event loop and connection pool per report
+    before = []
+    for _ in range(args.requests):
+        start = time.perf_counter()
+        asyncio.run(_report_with_new_client(base_url, args.calls_per_request))
+        before.append(time.perf_counter() - start)
+
+    # After: one long-lived loop and client shared by every report
+    background = BackgroundLoop(name="bench-loop")
+    client = background.run(_make_client(base_url))
+    after = []
+    for _ in range(args.requests):
+        start = time.perf_counter()
+        background.run(_report(client, args.calls_per_request))
+        after.append(time.perf_counter() - start)
+    background.run(client.aclose())
+    server.shutdown()
+
+    results = {
+        "benchmark": "event_loop",
+        "requests": args.requests,
+        "calls_per_request": args.calls_per_request,
+        "asyncio_run": _summarize(before),
+        "shared_loop": _summarize(after),
+    }
+    results["speedup"] = round(
+        results["asyncio_run"]["mean_ms"] / results["shared_loop"]["mean_ms"], 2
+    )
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
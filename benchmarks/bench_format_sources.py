@@ -0,0 +1,174 @@
+"""Formatting large Tavily responses: the old concatenating formatter versus sources.
+
+Builds synthetic search responses with raw content, in which the same pages
+come back under URL variants (tracking parameters, www., trailing slashes,
+http and https, fragments) the way overlapping queries return them. The old
+formatter deduplicated on the exact URL and grew its output with +=; the new
+one deduplicates on the canonical URL and joins one chunk per source.
+
+Also runs both on responses with plain URLs, where the two should produce
+the same text, and the new formatter only adds the cost of canonicalizing
+every URL.
+
+Usage:
+    python benchmarks/bench_format_sources.py [--responses N] [--pages N]
+        [--raw-chars N] [--repeat N]
+"""
+
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "code"))
+
+from docgen_agent.sources import format_sources  # noqa: E402
+
+_MAX_TOKENS_PER_SOURCE = 1000
+
+
+def _old_format_sources(search_response, max_tokens_per_source, include_raw_content):
+    """The formatter before sources.py, without its missing raw content warning."""
+    if isinstance(search_response, dict):
+        sources_list = search_response["results"]
+    else:
+        sources_list = []
+        for response in search_response:
+            sources_list.extend(response["results"])
+
+    unique_sources = {}
+    for source in sources_list:
+        if source["url"] not in unique_sources:
+            unique_sources[source["url"]] = source
+
+    formatted_text = "Sources:\n\n"
+    for source in unique_sources.values():
+        formatted_text += f"Source {source['title']}:\n===\n"
+        formatted_text += f"URL: {source['url']}\n===\n"
+        formatted_text += (
+            f"Most relevant content from source: {source['content']}\n===\n"
+        )
+        if include_raw_content:
+            char_limit = max_tokens_per_source * 4
+            raw_content = source.get("raw_content", "") or ""
+            if len(raw_content) > char_limit:
+                raw_content = raw_content[:char_limit] + "... [truncated]"
+            formatted_text += (
+                f"Full source content limited to {max_tokens_per_source} tokens:"
+                f" {raw_content}\n\n"
+            )
+    return formatted_text.strip()
+
+
+def _variant(url: str, rng: random.Random) -> str:
+    """One of the URLs a search may return for the page at url."""
+    scheme, rest = url.split("://")
+    if rng.random() < 0.5:
+        scheme = "http"
+    if rng.random() < 0.3:
+        rest = "www." + rest
+    if rng.random() < 0.3:
+        rest += "/"
+    if rng.random() < 0.4:
+        rest += f"?utm_source=news&utm_campaign={rng.randint(1, 9)}"
+    if rng.random() < 0.2:
+        rest += "#section-2"
+    return f"{scheme}://{rest}"
+
+
+def _responses(
+    count: int, pages: int, raw_chars: int, variants: bool, seed: int = 0
+) -> list[dict]:
+    rng = random.Random(seed)
+    urls = [f"https://example{i % 17}.com/articles/{i}" for i in range(pages)]
+    filler = "All work and no play makes a long page. " * (raw_chars // 40 + 1)
+    responses = []
+    for r in range(count):
+        results = []
+        for j in range(5):
+            page = rng.randrange(pages) if variants else (r * 5 + j) % pages
+            results.append(
+                {
+                    "title": f"Page {page}",
+                    "url": _variant(urls[page], rng) if variants else urls[page],
+                    "content": f"The most relevant part of page {page}. " * 5,
+                    "raw_content": filler[:raw_chars],
+                }
+            )
+        responses.append({"query": f"query {r}", "results": results})
+    return responses
+
+
+def _time(fn, repeat: int) -> tuple[dict[str, float], str]:
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        output = fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return {
+        "median_ms": round(statistics.median(samples), 3),
+        "min_ms": round(min(samples), 3),
+    }, output
+
+
+def _urls(output: str) -> list[str]:
+    return [line[5:] for line in output.splitlines() if line.startswith("URL: ")]
+
+
+def _compare(responses: list[dict], repeat: int) -> dict:
+    """Time both formatters on responses and compare their output."""
+    old_timing, old_output = _time(
+        lambda: _old_format_sources(responses, _MAX_TOKENS_PER_SOURCE, True), repeat
+    )
+    # Every page has the same filler; near duplicates are bench_near_duplicates'
+    new_timing, new_output = _time(
+        lambda: format_sources(responses, _MAX_TOKENS_PER_SOURCE, True, 2.0), repeat
+    )
+    return {
+        "old": {
+            **old_timing,
+            "sources": old_output.count("\nURL: "),
+            "output_chars": len(old_output),
+        },
+        "new": {
+            **new_timing,
+            "sources": new_output.count("\nURL: "),
+            "output_chars": len(new_output),
+        },
+        "speedup": round(old_timing["median_ms"] / new_timing["median_ms"], 2),
+        "output_reduction": round(1 - len(new_output) / len(old_output), 3),
+        "same_sources": _urls(old_output) == _urls(new_output),
+        "same_output": old_output == new_output,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--responses", type=int, default=200)
+    parser.add_argument("--pages", type=int, default=300)
+    parser.add_argument("--raw-chars", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    results = {
+        "benchmark": "format_sources",
+        "responses": args.responses,
+        "results": args.responses * 5,
+        "raw_chars": args.raw_chars,
+        # The same pages under the URL variants real searches return
+        "url_variants": _compare(
+            _responses(args.responses, args.pages, args.raw_chars, True), args.repeat
+        ),
+        # Every URL as returned before, where only the exact repeats are dropped
+        "plain_urls": _compare(
+            _responses(args.responses, args.pages, args.raw_chars, False), args.repeat
+        ),
+    }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""Tokens saved per report by dropping near-duplicate sources.
+
+Builds the search responses of a synthetic report: each section's searches
+return a mix of unique pages and syndicated copies of a few stories, which
+other domains republish with their own header, footer and small edits. The
+sources of each section are formatted with and without near-duplicate
+detection, and the tokens (estimated at 4 characters each) are compared.
+
+Also counts the unique pages that were wrongly dropped and the syndicated
+copies that were kept, and times the detection.
+
+Usage:
+    python benchmarks/bench_near_duplicates.py [--sections N] [--queries N]
+        [--results N] [--stories N] [--threshold X] [--seed N]
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "code"))
+
+from docgen_agent.sources import (  # noqa: E402
+    SOURCE_SIMILARITY,
+    format_sources,
+    unique_sources,
+)
+
+_MAX_TOKENS_PER_SOURCE = 1000
+_WORDS = (
+    "market model growth data research company energy policy report chip"
+    " battery climate network revenue quarter launch system study team cost"
+    " supply demand user cloud security design price region index sensor"
+).split()
+
+
+def _article(rng: random.Random, words: int) -> str:
+    sentences = []
+    while words > 0:
+        length = rng.randint(8, 20)
+        sentences.append(" ".join(rng.choices(_WORDS, k=length)).capitalize() + ".")
+        words -= length
+    return " ".join(sentences)
+
+
+def _syndicate(story: str, outlet: int, rng: random.Random) -> str:
+    """A copy of story as another outlet republishes it."""
+    words = story.split()
+    for _ in range(len(words) // 100):
+        words[rng.randrange(len(words))] = rng.choice(_WORDS)
+    header = f"Outlet {outlet} News | Home | World | Business | Subscribe."
+    footer = f"Copyright Outlet {outlet}. All rights reserved. Related stories."
+    return f"{header} {' '.join(words)} {footer}"
+
+
+def _report(
+    sections: int, queries: int, results: int, stories: int, rng: random.Random
+) -> list[list[dict]]:
+    """The search responses of each section of a report."""
+    story_texts = [_article(rng, 600) for _ in range(stories)]
+    outlets = iter(range(1_000_000))
+    pages = iter(range(1_000_000))
+    report = []
+    for _ in range(sections):
+        responses = []
+        for q in range(queries):
+            response = []
+            for _ in range(results):
+                outlet = next(outlets)
+                if rng.random() < 0.5:
+                    story = rng.randrange(stories)
+                    text = _syndicate(story_texts[story], outlet, rng)
+                    page = f"story-{story}"
+                else:
+                    text = _article(rng, 600)
+                    page = f"page-{next(pages)}"
+                response.append(
+                    {
+                        "title": page,
+                        "url": f"https://outlet{outlet}.com/{page}",
+                        "content": text[:400],
+                        "raw_content": text,
+                    }
+                )
+            responses.append({"query": f"query {q}", "results": response})
+        report.append(responses)
+    return report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sections", type=int, default=5)
+    parser.add_argument("--queries", type=int, default=3)
+    parser.add_argument("--results", type=int, default=5)
+    parser.add_argument("--stories", type=int, default=4)
+    parser.add_argument("--threshold", type=float, default=SOURCE_SIMILARITY)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    report = _report(
+        args.sections,
+        args.queries,
+        args.results,
+        args.stories,
+        random.Random(args.seed),
+    )
+    before = after = dropped_unique = kept_copies = 0
+    seconds = 0.0
+    for responses in report:
+        before += len(format_sources(responses, _MAX_TOKENS_PER_SOURCE, True, 2.0))
+        after += len(
+            format_sources(responses, _MAX_TOKENS_PER_SOURCE, True, args.threshold)
+        )
+        start = time.perf_counter()
+        kept = [source["title"] for source in unique_sources(responses, args.threshold)]
+        seconds += time.perf_counter() - start
+        pages = {
+            source["title"] for response in responses for source in response["results"]
+        }
+        dropped_unique += sum(
+            1 for page in pages if page.startswith("page-") and page not in kept
+        )
+        kept_copies += len(kept) - len(set(kept))
+
+    results = {
+        "benchmark": "near_duplicates",
+        "sections": args.sections,
+        "sources": args.sections * args.queries * args.results,
+        "threshold": args.threshold,
+        "tokens_per_report": {"before": before // 4, "after": after // 4},
+        "tokens_saved": (before - after) // 4,
+        "savings": round(1 - after / before, 3),
+        "unique_pages_dropped": dropped_unique,
+        "syndicated_copies_kept": kept_copies,
+        "detection_ms": round(seconds * 1000, 2),
+    }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""Prompt tokens of research with JSON tool messages versus a ResearchCorpus.
+
+Simulates the research loop of a section writer: the model searches for a
+few rounds, then writes. Before, each round's formatted results were
+JSON-encoded into a tool message that every later call read again; now the
+sources go into a ResearchCorpus that each call renders once into its
+system prompt, and the tool message is a short note. Searches of later
+rounds find some of the earlier pages again, as overlapping queries do.
+
+Reports the prompt tokens of the search results over all calls, the
+characters escaped by JSON encoding, and the median time to build the
+prompts once the token and sketch caches are warm.
+
+Usage:
+    python benchmarks/bench_research_corpus.py [--rounds N] [--queries N]
+        [--results N] [--overlap X] [--repeat N]
+"""
+
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "code"))
+
+from docgen_agent import tokens, tools  # noqa: E402
+from docgen_agent.corpus import ResearchCorpus  # noqa: E402
+from docgen_agent.sources import format_sources  # noqa: E402
+
+_WORDS = (
+    "market model growth data research company energy policy report chip"
+    " battery climate network revenue quarter launch system study team cost"
+    " supply demand user cloud security design price region index sensor"
+).split()
+
+
+def _text(rng: random.Random, words: int) -> str:
+    sentences = []
+    while words > 0:
+        length = rng.randint(8, 20)
+        sentences.append(" ".join(rng.choices(_WORDS, k=length)).capitalize() + ".")
+        words -= length
+    return " ".join(sentences)
+
+
+def _rounds(
+    rounds: int, queries: int, results: int, overlap: float, rng: random.Random
+) -> list[list[dict]]:
+    """The search responses of each round of tool calls."""
+    pages: list[dict] = []
+    all_rounds = []
+    for r in range(rounds):
+        responses = []
+        for q in range(queries):
+            found = []
+            for _ in range(results):
+                if pages and rng.random() < overlap:
+                    found.append(rng.choice(pages))
+                    continue
+                page = {
+                    "title": f"Page {len(pages)}",
+                    "url": f"https://example{len(pages) % 13}.com/{len(pages)}",
+                    "content": f'"{_text(rng, 80)}"\n{_text(rng, 40)}',
+                    "raw_content": None,
+                    "score": round(rng.random(), 2),
+                }
+                pages.append(page)
+                found.append(page)
+            responses.append({"query": f"query {r}-{q}", "results": found})
+        all_rounds.append(responses)
+    return all_rounds
+
+
+def _json_messages(rounds: list[list[dict]]) -> tuple[list[str], int]:
+    """The search results each call read before, and the characters escaped."""
+    messages: list[str] = []
+    escaped = 0
+    prompts = [""]
+    for responses in rounds:
+        text = format_sources(
+            responses,
+            tools.MAX_TOKENS_PER_SOURCE,
+            tools.INCLUDE_RAW_CONTENT,
+            max_tokens=tools.MAX_TOKENS_PER_SEARCH,
+        )
+        message = json.dumps(text)
+        escaped += len(message) - len(text) - 2
+        messages.append(message)
+        prompts.append("\n".join(messages))
+    return prompts, escaped
+
+
+def _corpus_prompts(rounds: list[list[dict]]) -> list[str]:
+    """The search results each call reads now: the corpus and the notes."""
+    corpus = ResearchCorpus()
+    notes: list[str] = []
+    prompts = [""]
+    for responses in rounds:
+        corpus, found = corpus.add_responses(responses)
+        notes.append(f"Found {len(found)} sources: {', '.join(found)}.")
+        prompts.append(tools.with_sources("", corpus) + "\n".join(notes))
+    return prompts
+
+
+def _time(fn, repeat: int) -> float:
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return round(statistics.median(samples), 3)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--queries", type=int, default=4)
+    parser.add_argument("--results", type=int, default=5)
+    parser.add_argument("--overlap", type=float, default=0.3)
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    rounds = _rounds(
+        args.rounds, args.queries, args.results, args.overlap, random.Random(0)
+    )
+    before, escaped = _json_messages(rounds)
+    after = _corpus_prompts(rounds)
+    before_ms = _time(lambda: _json_messages(rounds), args.repeat)
+    after_ms = _time(lambda: _corpus_prompts(rounds), args.repeat)
+
+    before_tokens = sum(tokens.count_tokens(prompt) for prompt in before)
+    after_tokens = sum(tokens.count_tokens(prompt) for prompt in after)
+    results = {
+        "benchmark": "research_corpus",
+        "exact": tokens.exact(),
+        "calls": len(before),
+        "search_results": args.rounds * args.queries * args.results,
+        "prompt_tokens": {"json_messages": before_tokens, "corpus": after_tokens},
+        "savings": round(1 - after_tokens / before_tokens, 3),
+        "escaped_chars": escaped,
+        "build_ms": {
+            "json_messages": before_ms,
+            "corpus": after_ms,
+        },
+    }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""Holding search results to a token budget, and what tokenization costs.
+
+Formats the sources of synthetic searches, with raw content, under the
+per-source and per-call budgets of docgen_agent.tools, and reports:
+  - the tokens of the text against the budget;
+  - how the budget was shared: tokens per source by relevance score;
+  - how many cuts fell after a sentence;
+  - the time to format with empty token caches, and again with the caches
+    warm, as when later sections find the same sources.
+
+Tokens are counted with the bundled tokenizer of TOKENIZER_MODEL if tiktoken
+can load it, else estimated at 4 characters per token; "exact" says which.
+
+Usage:
+    python benchmarks/bench_token_budgets.py [--searches N] [--results N]
+        [--max-tokens N] [--max-tokens-per-source N] [--repeat N]
+"""
+
+import argparse
+import json
+import os
+import random
+import re
+import statistics
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "code"))
+
+from docgen_agent import tokens  # noqa: E402
+from docgen_agent.sources import format_sources  # noqa: E402
+
+_SOURCE = re.compile(r"^Source (.+):\n===\n", re.MULTILINE)
+_WORDS = (
+    "market model growth data research company energy policy report chip"
+    " battery climate network revenue quarter launch system study team cost"
+    " supply demand user cloud security design price region index sensor"
+).split()
+
+
+def _text(rng: random.Random, words: int) -> str:
+    sentences = []
+    while words > 0:
+        length = rng.randint(8, 20)
+        sentences.append(" ".join(rng.choices(_WORDS, k=length)).capitalize() + ".")
+        words -= length
+    return " ".join(sentences)
+
+
+def _responses(searches: int, results: int, rng: random.Random) -> list[dict]:
+    return [
+        {
+            "query": f"query {s}",
+            "results": [
+                {
+                    "title": f"Page {s}-{r}",
+                    "url": f"https://example{s}.com/{r}",
+                    "content": _text(rng, 60),
+                    "raw_content": _text(rng, rng.randint(200, 3000)),
+                    "score": round(rng.random(), 2),
+                }
+                for r in range(results)
+            ],
+        }
+        for s in range(searches)
+    ]
+
+
+def _time(fn, repeat: int, cold: bool) -> float:
+    samples = []
+    for _ in range(repeat):
+        if cold:
+            tokens.clear_cache()
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return round(statistics.median(samples), 3)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--searches", type=int, default=3)
+    parser.add_argument("--results", type=int, default=5)
+    parser.add_argument("--max-tokens", type=int, default=8000)
+    parser.add_argument("--max-tokens-per-source", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    responses = _responses(args.searches, args.results, random.Random(0))
+
+    def run() -> str:
+        # Without near-duplicate detection, which would dominate the time
+        return format_sources(
+            responses,
+            args.max_tokens_per_source,
+            include_raw_content=True,
+            threshold=2.0,
+            max_tokens=args.max_tokens,
+        )
+
+    output = run()
+    scores = {
+        source["title"]: source["score"]
+        for response in responses
+        for source in response["results"]
+    }
+    # Every chunk starts with its source's title
+    parts = _SOURCE.split(output)[1:]
+    shares = sorted(
+        (
+            (scores[title], tokens.count_tokens(chunk))
+            for title, chunk in zip(parts[::2], parts[1::2])
+        ),
+        reverse=True,
+    )
+
+    results = {
+        "benchmark": "token_budgets",
+        "exact": tokens.exact(),
+        "sources": args.searches * args.results,
+        "sources_shown": output.count("URL: "),
+        "max_tokens": args.max_tokens,
+        "tokens": tokens.count_tokens(output),
+        "tokens_unlimited": tokens.count_tokens(
+            format_sources(responses, args.max_tokens_per_source, True, 2.0)
+        ),
+        "tokens_by_score": shares,
+        "cuts": output.count(" [truncated]"),
+        "cuts_after_sentence": output.count(". [truncated]"),
+        "cold_ms": _time(run, args.repeat, cold=True),
+        "warm_ms": _time(run, args.repeat, cold=False),
+    }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+"""A scripted chat model that stands in for the report graphs' LLMs.
+
+FakeChatModel answers the way the graphs expect, without a network:
+  - asked for a Report (with_structured_output), it plans `sections` sections,
+    all but the first and last needing research;
+  - with the search tool bound, it calls search_tavily with
+    `queries_per_call` queries for `tool_rounds` rounds, then answers;
+  - otherwise, it writes an answer of `completion_tokens` words.
+
+Each call waits a time to first token drawn from a lognormal distribution
+(median `ttft`, shape `ttft_sigma`) plus its output tokens at
+`tokens_per_second`, and reports its token usage like a real model: prompt
+tokens counted with docgen_agent.tokens, output tokens as generated.
+"""
+
+import asyncio
+import itertools
+import json
+import math
+import random
+import time
+import zlib
+from typing import Any, Sequence
+
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from langchain_core.utils.function_calling import convert_to_openai_tool
+from pydantic import PrivateAttr
+
+from docgen_agent import tokens
+
+_WORDS = (
+    "market model growth data research company energy policy report chip"
+    " battery climate network revenue quarter launch system study team cost"
+    " supply demand user cloud security design price region index sensor"
+    " storage grid solar wind vehicle software patent trade labor capital"
+).split()
+
+
+class FakeChatModel(BaseChatModel):
+    """Answer with scripted tool calls and text after a simulated latency."""
+
+    model: str = "fake"
+    sections: int = 5
+    # sections in the planned report
+    tool_rounds: int = 1
+    # rounds of search tool calls before the model answers
+    queries_per_call: int = 2
+    completion_tokens: int = 300
+    # words, about as many tokens, of a text answer
+    ttft: float = 0.2
+    # median seconds to the first token
+    ttft_sigma: float = 0.5
+    # shape of the lognormal distribution of the time to first token
+    tokens_per_second: float = 500.0
+    seed: int = 0
+
+    _random: random.Random = PrivateAttr()
+    _ids: Any = PrivateAttr(default_factory=itertools.count)
+
+    def model_post_init(self, context: Any) -> None:
+        self._random = random.Random(self.seed)
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat-model"
+
+    def bind_tools(self, tools: Sequence[Any], **kwargs: Any):
+        return self.bind(tools=[convert_to_openai_tool(tool) for tool in tools])
+
+    def _respond(
+        self, messages: list[BaseMessage], tools: list[dict] | None
+    ) -> tuple[AIMessage, float]:
+        """The scripted answer to a call, and how long it takes."""
+        names = [tool["function"]["name"] for tool in tools or []]
+        prompt = "\n".join(str(message.content) for message in messages)
+        tool_calls = []
+        content = ""
+        if "Report" in names:
+            tool_calls = [self._tool_call("Report", self._plan())]
+        elif names and self._rounds(messages) < self.tool_rounds:
+            rng = random.Random(zlib.crc32(prompt.encode()) + len(messages))
+            queries = [
+                " ".join(rng.sample(_WORDS, 4)) for _ in range(self.queries_per_call)
+            ]
+            tool_calls = [self._tool_call(names[0], {"queries": queries})]
+        else:
+            content = self._text(self.completion_tokens)
+
+        output = json.dumps([call["args"] for call in tool_calls]) + content
+        output_tokens = tokens.count_tokens(output)
+        input_tokens = tokens.count_tokens(prompt)
+        message = AIMessage(
+            content=content,
+            tool_calls=tool_calls,
+            id=f"fake-{next(self._ids)}",
+            usage_metadata={
+                "input_tokens": input_tokens,
+                "output_tokens": output_tokens,
+                "total_tokens": input_tokens + output_tokens,
+            },
+        )
+        ttft = self._random.lognormvariate(math.log(self.ttft), self.ttft_sigma)
+        return message, ttft + output_tokens / self.tokens_per_second
+
+    @staticmethod
+    def _rounds(messages: list[BaseMessage]) -> int:
+        """The tool calls the model made since it last answered.
+
+        Section writers start from the messages of the topic research, which
+        end with its answer.
+        """
+        rounds = 0
+        for message in reversed(messages):
+            if isinstance(message, AIMessage):
+                if not message.tool_calls:
+                    break
+                rounds += 1
+        return rounds
+
+    def _tool_call(self, name: str, args: dict[str, Any]) -> dict[str, Any]:
+        return {"name": name, "args": args, "id": f"call-{next(self._ids)}"}
+
+    def _plan(self) -> dict[str, Any]:
+        return {
+            "title": "A Fake Report",
+            "sections": [
+                {
+                    "name": f"Section {i + 1}",
+                    "description": self._text(20),
+                    "research": self.sections <= 2 or 0 < i < self.sections - 1,
+                    "content": "",
+                }
+                for i in range(self.sections)
+            ],
+        }
+
+    def _text(self, words: int) -> str:
+        return " ".join(self._random.choices(_WORDS, k=words)).capitalize() + "."
+
+    def _generate(
+        self,
+        messages: list[BaseMessage],
+        stop: list[str] | None = None,
+        run_manager: Any = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        message, seconds = self._respond(messages, kwargs.get("tools"))
+        time.sleep(seconds)
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _agenerate(
+        self,
+        messages: list[BaseMessage],
+        stop: list[str] | None = None,
+        run_manager: Any = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        message, seconds = self._respond(messages, kwargs.get("tools"))
+        await asyncio.sleep(seconds)
+        return ChatResult(generations=[ChatGeneration(message=message)])
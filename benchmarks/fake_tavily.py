@@ -0,0 +1,148 @@
+"""A local stand-in for the Tavily search API that injects latency and errors.
+
+FakeTavily serves POST /search on 127.0.0.1 with made-up results. Its fault
+settings can be changed while it runs, so one server can play a healthy,
+slow, flaky, rate limiting or failed Tavily in turn. The size of the results
+is set when it is created. Point a client at it with
+docgen_agent.tools.create_tavily_client("fake", fake.url).
+"""
+
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+_WORDS = (
+    "market model growth data research company energy policy report chip"
+    " battery climate network revenue quarter launch system study team cost"
+).split()
+
+
+def _content(seed: str, words: int = 60) -> str:
+    """Made-up text, different for every result so none are near duplicates."""
+    words = random.Random(seed).choices(_WORDS, k=words)
+    return " ".join(words).capitalize() + "."
+
+
+class FakeTavily:
+    """Serve fake search results, with the configured faults."""
+
+    def __init__(
+        self, seed: int = 0, content_words: int = 60, raw_content_words: int = 0
+    ):
+        self.content_words = content_words
+        # words in the content of each result
+        self.raw_content_words = raw_content_words
+        # words in the raw content of each result, when asked for; if 0, none
+        self.latency = 0.0
+        # seconds added to every response
+        self.error_rate = 0.0
+        # share of searches answered 500
+        self.rate_limit_rate = 0.0
+        # share of searches answered 429, with retry_after
+        self.retry_after = 1
+        self.hang_rate = 0.0
+        # share of searches that take hang_seconds to answer
+        self.hang_seconds = 5.0
+        self.down = False
+        # answer every search 503
+        self.failing = ""
+        # answer 500 to searches whose query contains this, if set
+        self.script: list[int] = []
+        # statuses to answer the next searches with, in order, before any fault
+        self.requests = 0
+        self.responses: dict[int, int] = {}
+        # counts by status
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        # Clients that timed out hang up before hanging searches answer
+        self._server.handle_error = lambda request, client_address: None
+        self.url = f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    def start(self) -> "FakeTavily":
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+
+    def configure(self, **faults: object) -> None:
+        """Set fault settings, resetting every other one and the counts."""
+        with self._lock:
+            self.latency = 0.0
+            self.error_rate = 0.0
+            self.rate_limit_rate = 0.0
+            self.hang_rate = 0.0
+            self.down = False
+            self.failing = ""
+            self.script = []
+            self.requests = 0
+            self.responses = {}
+            for name, value in faults.items():
+                setattr(self, name, value)
+
+    def _respond(self, request: dict) -> tuple[int, float, dict]:
+        """Pick the status, delay and body of the response to a search."""
+        with self._lock:
+            self.requests += 1
+            scripted = self.script.pop(0) if self.script else None
+            roll = self._random.random()
+            delay = self.latency
+            if self._random.random() < self.hang_rate:
+                delay += self.hang_seconds
+        if scripted is not None and scripted != 200:
+            return scripted, delay, {"detail": {"error": f"Scripted {scripted}"}}
+        if self.down:
+            return 503, delay, {"detail": {"error": "Service unavailable"}}
+        query = request.get("query", "")
+        if self.failing and self.failing in query:
+            return 500, delay, {"detail": {"error": "Internal error"}}
+        if roll < self.rate_limit_rate:
+            return 429, delay, {"detail": {"error": "Rate limit exceeded"}}
+        if roll < self.rate_limit_rate + self.error_rate:
+            return 500, delay, {"detail": {"error": "Internal error"}}
+        raw_content = request.get("include_raw_content") and self.raw_content_words
+        results = [
+            {
+                "url": f"https://example.com/{abs(hash(query)) % 1000}/{i}",
+                "title": f"{query} ({i})",
+                "content": _content(f"{query}/{i}", self.content_words),
+                "score": 1 - i / 10,
+                "raw_content": (
+                    _content(f"{query}/{i}/raw", self.raw_content_words)
+                    if raw_content
+                    else None
+                ),
+            }
+            for i in range(request.get("max_results", 5))
+        ]
+        return 200, delay, {"query": query, "results": results}
+
+    def _handler(self) -> type[BaseHTTPRequestHandler]:
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                request = json.loads(self.rfile.read(length) or b"{}")
+                status, delay, payload = fake._respond(request)
+                time.sleep(delay)
+                body = json.dumps(payload).encode()
+                self.send_response(status)
+                if status == 429:
+                    self.send_header("Retry-After", str(fake.retry_after))
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+                with fake._lock:
+                    fake.responses[status] = fake.responses.get(status, 0) + 1
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
@@ -1,20 +1,192 @@
 """Main entry point for the report generation workflow."""
 
 import asyncio
-from typing import Any
+from concurrent.futures import Future
+from typing import Any, AsyncIterator, Callable
 
+from . import limits, query_planner, tracing, usage
 from .agent import AgentState, graph
+from .loop import submit
+from .report_cache import get_report, report_key, set_report
+from .singleflight import SingleFlight
+
+# Identical report requests in flight at the same time share one run
+report_runs = SingleFlight("report")
 
 
 async def async_write_report(
+    topic: str, report_structure: str, force_refresh: bool = False
+) -> dict[str, Any] | None:
+    """Write a report.
+
+    Returns the topic, report_structure, title, sections (name and content),
+    the finished report and, unless it came from the cache, the LLM usage
+    and trace of the run, or None if the workflow produced no report.
+    """
+    result: dict[str, Any] = {"topic": topic, "report_structure": report_structure}
+    async for event in astream_report(topic, report_structure, force_refresh):
+        if event["event"] in ("usage", "trace"):
+            result[event["event"]] = event[event["event"]]
+        _record(result, event)
+    return result if "report" in result else None
+
+
+async def astream_report(
+    topic: str,
+    report_structure: str,
+    force_refresh: bool = False,
+    generate: Callable[[str, str], AsyncIterator[dict[str, Any]]] | None = None,
+) -> AsyncIterator[dict[str, Any]]:
+    """Write a report, yielding progress events as the graph runs.
+
+    Every event is a dict with an "event" key:
+      cache_hit - the report is served from the report cache.
+      coalesced - the report is shared with an identical run in flight.
+      node_started / node_finished - a graph node began or completed.
+      plan - the report outline is ready, with its title and section names.
+      section - a section has been written, with its index and content.
+      report - the finished document.
+      usage - after the report or a failure, the run's LLM tokens and cost,
+        in total and per node, section and model (see docgen_agent.usage).
+      trace - then the run's spans as Chrome trace events (see
+        docgen_agent.tracing).
+
+    Unless force_refresh is set, a recent report for the same request is
+    replayed from the cache as cache_hit, plan, section and report events.
+    Concurrent identical requests share a single run of the graph, which is
+    cancelled only when every one of them has stopped listening.
+
+    The graph runs in this process unless generate, such as the astream
+    method of a docgen_agent.workers.WorkerPool, runs it elsewhere.
+    """
+    cached = None
+    if not force_refresh:
+        # The cache reads SQLite, which would block the event loop
+        cached = await asyncio.to_thread(get_report, topic, report_structure)
+    async for event in astream_run(topic, report_structure, cached, generate):
+        yield event
+
+
+async def astream_run(
+    topic: str,
+    report_structure: str,
+    cached: dict[str, Any] | None,
+    generate: Callable[[str, str], AsyncIterator[dict[str, Any]]] | None = None,
+) -> AsyncIterator[dict[str, Any]]:
+    """Replay cached, a report found in the report cache, or else write it.
+
+    The events are those of astream_report. This is for callers that
+    looked the request up in the report cache themselves.
+    """
+    if cached:
+        yield {"event": "cache_hit"}
+        async for event in _replay(cached):
+            yield event
+        return
+
+    key = report_key(topic, report_structure)
+    if report_runs.in_flight(key):
+        yield {"event": "coalesced"}
+    generate = generate or _generate
+    async for event in report_runs.stream(
+        key, lambda: generate(topic, report_structure)
+    ):
+        yield event
+
+
+async def _generate(topic: str, report_structure: str) -> AsyncIterator[dict[str, Any]]:
+    """Run the report graph and cache the report it produces."""
+    finished: dict[str, Any] = {}
+    async for event in _astream_graph(topic, report_structure):
+        _record(finished, event)
+        if event["event"] == "report":
+            await asyncio.to_thread(set_report, topic, report_structure, finished)
+        yield event
+
+
+def _record(report: dict[str, Any], event: dict[str, Any]) -> None:
+    """Fold a plan, section or report event into a report dict."""
+    if event["event"] == "plan":
+        report["title"] = event["title"]
+        report["sections"] = [
+            {"name": name, "content": ""} for name in event["sections"]
+        ]
+    elif event["event"] == "section":
+        report["sections"][event["index"]]["content"] = event["content"]
+    elif event["event"] == "report":
+        report["report"] = event["report"]
+
+
+async def _replay(cached: dict[str, Any]) -> AsyncIterator[dict[str, Any]]:
+    """Yield the events of a finished report."""
+    yield {
+        "event": "plan",
+        "title": cached["title"],
+        "sections": [section["name"] for section in cached["sections"]],
+    }
+    for index, section in enumerate(cached["sections"]):
+        yield {"event": "section", "index": index, **section}
+    yield {"event": "report", "report": cached["report"]}
+
+
+async def _astream_graph(
     topic: str, report_structure: str
-) -> Any | dict[str, Any] | None:
-    """Write a report."""
+) -> AsyncIterator[dict[str, Any]]:
+    """Run the report graph, translating its stream into progress events."""
     state = AgentState(topic=topic, report_structure=report_structure)
-    result = await graph.ainvoke(state)
-    return result
+    try:
+        with (
+            tracing.trace(topic) as run,
+            usage.track() as ledger,
+            limits.fair_queue(),
+            query_planner.plan_queries(),
+        ):
+            async for mode, chunk in graph.astream(
+                state, stream_mode=["debug", "custom"]
+            ):
+                if mode == "custom":
+                    yield chunk
+                    continue
+
+                payload = chunk["payload"]
+                if chunk["type"] == "task":
+                    yield {"event": "node_started", "node": payload["name"]}
+                elif chunk["type"] == "task_result":
+                    yield {"event": "node_finished", "node": payload["name"]}
+                    writes = dict(payload["result"])
+                    if payload["name"] == "report_planner" and writes.get(
+                        "report_plan"
+                    ):
+                        plan = writes["report_plan"]
+                        yield {
+                            "event": "plan",
+                            "title": plan.title,
+                            "sections": [section.name for section in plan.sections],
+                        }
+                    if writes.get("report") is not None:
+                        yield {"event": "report", "report": writes["report"]}
+    except Exception:
+        # A failed run's usage and trace show what it cost and where it failed
+        yield {"event": "usage", "usage": ledger.to_dict()}
+        yield {"event": "trace", "trace": run.to_chrome()}
+        raise
+    yield {"event": "usage", "usage": ledger.to_dict()}
+    yield {"event": "trace", "trace": run.to_chrome()}
+
+
+def submit_report(
+    topic: str, report_structure: str, force_refresh: bool = False
+) -> Future:
+    """Start writing a report on the shared background event loop.
+
+    This is safe to call from any thread; the returned future resolves to
+    the same result as async_write_report.
+    """
+    return submit(async_write_report(topic, report_structure, force_refresh))
 
 
-def write_report(topic: str, report_structure: str) -> Any | dict[str, Any] | None:
+def write_report(
+    topic: str, report_structure: str, force_refresh: bool = False
+) -> dict[str, Any] | None:
     """Write a report."""
-    return asyncio.run(async_write_report(topic, report_structure))
+    return submit_report(topic, report_structure, force_refresh).result()
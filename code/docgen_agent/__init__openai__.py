@@ -1,20 +1,84 @@
 """Main entry point for the report generation workflow using OpenAI."""
 
-import asyncio
-from typing import Any
+from concurrent.futures import Future
+from typing import Any, AsyncIterator
 
-from .agent_openai import AgentState, graph
+from . import limits, query_planner, tokens, usage
+from .agent_openai import AgentState, graph, llm
+from .loop import submit
 
 
 async def async_write_report(
     topic: str, report_structure: str
 ) -> Any | dict[str, Any] | None:
-    """Write a report using OpenAI."""
+    """Write a report using OpenAI.
+
+    Returns the final graph state, with the LLM usage of the run as usage.
+    """
     state = AgentState(topic=topic, report_structure=report_structure)
-    result = await graph.ainvoke(state)
+    with (
+        usage.track() as ledger,
+        limits.fair_queue(),
+        query_planner.plan_queries(),
+        tokens.for_model(llm.model_name),
+    ):
+        result = await graph.ainvoke(state)
+    result["usage"] = ledger.to_dict()
     return result
 
 
+async def astream_report(
+    topic: str, report_structure: str
+) -> AsyncIterator[dict[str, Any]]:
+    """Write a report using OpenAI, yielding progress events as the graph runs.
+
+    Every event is a dict with an "event" key:
+      node_started / node_finished - a graph node began or completed.
+      plan - the report outline is ready, with its title and section names.
+      section - a section has been written, with its index and content.
+      report - the finished document.
+      usage - after the report, the run's LLM tokens and cost (see
+        docgen_agent.usage).
+    """
+    state = AgentState(topic=topic, report_structure=report_structure)
+    with (
+        usage.track() as ledger,
+        limits.fair_queue(),
+        query_planner.plan_queries(),
+        tokens.for_model(llm.model_name),
+    ):
+        async for mode, chunk in graph.astream(state, stream_mode=["debug", "custom"]):
+            if mode == "custom":
+                yield chunk
+                continue
+
+            payload = chunk["payload"]
+            if chunk["type"] == "task":
+                yield {"event": "node_started", "node": payload["name"]}
+            elif chunk["type"] == "task_result":
+                yield {"event": "node_finished", "node": payload["name"]}
+                writes = dict(payload["result"])
+                if payload["name"] == "report_planner" and writes.get("report_plan"):
+                    plan = writes["report_plan"]
+                    yield {
+                        "event": "plan",
+                        "title": plan.title,
+                        "sections": [section.name for section in plan.sections],
+                    }
+                if writes.get("report") is not None:
+                    yield {"event": "report", "report": writes["report"]}
+    yield {"event": "usage", "usage": ledger.to_dict()}
+
+
+def submit_report(topic: str, report_structure: str) -> Future:
+    """Start writing a report on the shared background event loop.
+
+    This is safe to call from any thread; the returned future resolves to
+    the same result as async_write_report.
+    """
+    return submit(async_write_report(topic, report_structure))
+
+
 def write_report(topic: str, report_structure: str) -> Any | dict[str, Any] | None:
     """Write a report using OpenAI."""
-    return asyncio.run(async_write_report(topic, report_structure))
+    return submit_report(topic, report_structure).result()
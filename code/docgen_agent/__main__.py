@@ -1,16 +1,22 @@
 """Main entry point for the report generation workflow.
 
-This code is a simple example of how to use the report generation workflow.
+Without arguments, this writes an example report. With --batch, it writes a
+report for every line of a JSONL file (each a JSON object with a topic and a
+report_structure) and prints the results as JSONL as each report finishes.
+With --trace, the trace of every run is written to a Chrome trace file, one
+process per report.
 """
 
+import argparse
+import json
 import logging
+import sys
 
 from . import write_report
+from .batch import BATCH_CONCURRENCY, iter_batch
 
-logging.basicConfig(level=logging.INFO)
-result = write_report(
-    topic="Discuss the advantages of using GPUs for AI training",
-    report_structure="""This report type focuses on comparative analysis.
+_EXAMPLE_TOPIC = "Discuss the advantages of using GPUs for AI training"
+_EXAMPLE_STRUCTURE = """This report type focuses on comparative analysis.
 
 The report structure should include:
 1. Introduction (no research needed)
@@ -30,7 +36,64 @@ The report structure should include:
 - Structured comparison table that:
 * Compares all offerings from the user-provided list across key dimensions
 * Highlights relative strengths and weaknesses
-- Final recommendations""",
-)
-if result:
-    print("\n\n" + result["report"] + "\n\n")
+- Final recommendations"""
+
+
+def read_batch(path: str) -> list[dict]:
+    """Read report requests from a JSONL file, or from stdin if path is -."""
+    lines = sys.stdin if path == "-" else open(path)
+    with lines:
+        requests = [json.loads(line) for line in lines if line.strip()]
+    for number, request in enumerate(requests, 1):
+        if not request.get("topic") or not request.get("report_structure"):
+            raise ValueError(f"Line {number} needs a topic and a report_structure.")
+    return requests
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog="python -m docgen_agent")
+    parser.add_argument(
+        "--batch",
+        metavar="TOPICS_JSONL",
+        help="write a report for each request in this JSONL file (- for stdin)",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=BATCH_CONCURRENCY,
+        help="how many reports of the batch to write at a time",
+    )
+    parser.add_argument(
+        "--trace",
+        metavar="TRACE_JSON",
+        help="write the trace of each run to this file, for chrome://tracing",
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    traces: list[dict] = []
+    if args.batch:
+        requests = read_batch(args.batch)
+        for result in iter_batch(requests, args.concurrency, traces=bool(args.trace)):
+            trace = result.pop("trace", None)
+            if trace:
+                traces.extend(_as_process(trace, result["index"] + 1))
+            print(json.dumps(result), flush=True)
+    else:
+        result = write_report(topic=_EXAMPLE_TOPIC, report_structure=_EXAMPLE_STRUCTURE)
+        if result:
+            traces.extend(result.get("trace", []))
+            print("\n\n" + result["report"] + "\n\n")
+
+    if args.trace:
+        with open(args.trace, "w") as f:
+            json.dump({"traceEvents": traces, "displayTimeUnit": "ms"}, f)
+
+
+def _as_process(trace: list[dict], pid: int) -> list[dict]:
+    """Move a run's trace events to their own process in the trace viewer."""
+    return [{**event, "pid": pid} for event in trace]
+
+
+if __name__ == "__main__":
+    main()
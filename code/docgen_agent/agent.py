@@ -9,11 +9,17 @@ from typing import Annotated, Any, Sequence, cast
 
 from langchain_core.runnables import RunnableConfig
 from langchain_nvidia_ai_endpoints import ChatNVIDIA
+from langgraph.config import get_stream_writer
 from langgraph.graph import END, START, StateGraph
 from langgraph.graph.message import add_messages
 from pydantic import BaseModel
 
-from . import author, researcher
+from . import author, researcher, tools, tracing
+from .corpus import ResearchCorpus
+from .instrument import instrument_node
+from .limits import ainvoke_llm
+from .llm_cache import llm_cache
+from .loop import gather
 from .prompts import report_planner_instructions
 
 _LOGGER = logging.getLogger(__name__)
@@ -21,7 +27,7 @@ _MAX_LLM_RETRIES = 3
 _QUERIES_PER_SECTION = 5
 _THROTTLE_LLM_CALLS = os.getenv("THROTTLE_LLM_CALLS", "0")
 
-llm = ChatNVIDIA(model="meta/llama-3.3-70b-instruct", temperature=0)
+llm = ChatNVIDIA(model="meta/llama-3.3-70b-instruct", temperature=0, cache=llm_cache)
 
 
 class Report(BaseModel):
@@ -35,6 +41,7 @@ class AgentState(BaseModel):
     report_plan: Report | None = None
     report: str | None = None
     messages: Annotated[Sequence[Any], add_messages] = []
+    corpus: ResearchCorpus = ResearchCorpus()
 
 
 async def topic_research(state: AgentState, config: RunnableConfig):
@@ -45,11 +52,15 @@ async def topic_research(state: AgentState, config: RunnableConfig):
         topic=state.topic,
         number_of_queries=_QUERIES_PER_SECTION,
         messages=state.messages,
+        corpus=state.corpus,
     )
 
     research = await researcher.graph.ainvoke(researcher_state, config)
 
-    return {"messages": research.get("messages", [])}
+    return {
+        "messages": research.get("messages", []),
+        "corpus": research.get("corpus", state.corpus),
+    }
 
 
 async def report_planner(state: AgentState, config: RunnableConfig):
@@ -58,13 +69,16 @@ async def report_planner(state: AgentState, config: RunnableConfig):
 
     model = llm.with_structured_output(Report)  # type: ignore
 
-    system_prompt = report_planner_instructions.format(
-        topic=state.topic,
-        report_structure=state.report_structure,
+    system_prompt = tools.with_sources(
+        report_planner_instructions.format(
+            topic=state.topic,
+            report_structure=state.report_structure,
+        ),
+        state.corpus,
     )
     for count in range(_MAX_LLM_RETRIES):
         messages = [{"role": "system", "content": system_prompt}] + list(state.messages)
-        response = await model.ainvoke(messages, config)
+        response = await ainvoke_llm(model, messages, config, retry=count > 0)
         if response:
             response = cast(Report, response)
             state.report_plan = response
@@ -83,6 +97,22 @@ async def section_author_orchestrator(state: AgentState, config: RunnableConfig)
 
     _LOGGER.info("Orchestrating the section authoring process.")
 
+    # Streamed runs get each section as soon as its author is done
+    write_event = get_stream_writer()
+
+    async def announce(index, writer):
+        with tracing.span("section", "section", index):
+            section = await writer
+        write_event(
+            {
+                "event": "section",
+                "index": section["index"],
+                "name": section["section"].name,
+                "content": section["section"].content,
+            }
+        )
+        return section
+
     writers = []
     for idx, section in enumerate(state.report_plan.sections):
         _LOGGER.info("Creating author agent for section: %s", section.name)
@@ -92,8 +122,11 @@ async def section_author_orchestrator(state: AgentState, config: RunnableConfig)
             section=section,
             topic=state.topic,
             messages=state.messages,
+            corpus=state.corpus,
+        )
+        writers.append(
+            announce(idx, author.graph.ainvoke(section_writer_state, config))
         )
-        writers.append(author.graph.ainvoke(section_writer_state, config))
 
     all_sections = []
     if _THROTTLE_LLM_CALLS == "1":
@@ -104,7 +137,7 @@ async def section_author_orchestrator(state: AgentState, config: RunnableConfig)
             await asyncio.sleep(30)
     else:
         # Without throttling, write all sections at once
-        all_sections = await asyncio.gather(*writers)
+        all_sections = await gather(*writers)
     all_sections = cast(list[dict[str, Any]], all_sections)
 
     for section in all_sections:
@@ -134,10 +167,21 @@ async def report_author(state: AgentState, config: RunnableConfig):
 
 workflow = StateGraph(AgentState)
 
-workflow.add_node("topic_research", topic_research)
-workflow.add_node("report_planner", report_planner)
-workflow.add_node("section_author_orchestrator", section_author_orchestrator)
-workflow.add_node("report_author", report_author)
+workflow.add_node(
+    "topic_research", instrument_node("agent", "topic_research", topic_research)
+)
+workflow.add_node(
+    "report_planner", instrument_node("agent", "report_planner", report_planner)
+)
+workflow.add_node(
+    "section_author_orchestrator",
+    instrument_node(
+        "agent", "section_author_orchestrator", section_author_orchestrator
+    ),
+)
+workflow.add_node(
+    "report_author", instrument_node("agent", "report_author", report_author)
+)
 
 workflow.add_edge(START, "topic_research")
 workflow.add_edge("topic_research", "report_planner")
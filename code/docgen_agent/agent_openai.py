@@ -9,11 +9,16 @@ from typing import Annotated, Any, Sequence, cast
 
 from langchain_core.runnables import RunnableConfig
 from langchain_openai import ChatOpenAI
+from langgraph.config import get_stream_writer
 from langgraph.graph import END, START, StateGraph
 from langgraph.graph.message import add_messages
 from pydantic import BaseModel
 
 from . import author, researcher
+from .instrument import instrument_node
+from .limits import ainvoke_llm
+from .llm_cache import llm_cache
+from .loop import gather
 from .prompts import report_planner_instructions
 
 _LOGGER = logging.getLogger(__name__)
@@ -26,6 +31,7 @@ llm = ChatOpenAI(
     model="gpt-4o-mini",  # Using GPT-4o-mini for cost efficiency
     temperature=0,
     api_key=os.getenv("OPENAI_API_KEY"),
+    cache=llm_cache,
 )
 
 
@@ -69,7 +75,7 @@ async def report_planner(state: AgentState, config: RunnableConfig):
     )
     for count in range(_MAX_LLM_RETRIES):
         messages = [{"role": "system", "content": system_prompt}] + list(state.messages)
-        response = await model.ainvoke(messages, config)
+        response = await ainvoke_llm(model, messages, config, retry=count > 0)
         if response:
             response = cast(Report, response)
             state.report_plan = response
@@ -88,6 +94,21 @@ async def section_author_orchestrator(state: AgentState, config: RunnableConfig)
 
     _LOGGER.info("Orchestrating the section authoring process.")
 
+    # Streamed runs get each section as soon as its author is done
+    write_event = get_stream_writer()
+
+    async def announce(writer):
+        section = await writer
+        write_event(
+            {
+                "event": "section",
+                "index": section["index"],
+                "name": section["section"].name,
+                "content": section["section"].content,
+            }
+        )
+        return section
+
     writers = []
     for idx, section in enumerate(state.report_plan.sections):
         _LOGGER.info("Creating author agent for section: %s", section.name)
@@ -98,7 +119,7 @@ async def section_author_orchestrator(state: AgentState, config: RunnableConfig)
             topic=state.topic,
             messages=state.messages,
         )
-        writers.append(author.graph.ainvoke(section_writer_state, config))
+        writers.append(announce(author.graph.ainvoke(section_writer_state, config)))
 
     all_sections = []
     if _THROTTLE_LLM_CALLS == "1":
@@ -108,11 +129,18 @@ async def section_author_orchestrator(state: AgentState, config: RunnableConfig)
             all_sections.append(section_result)
     else:
         # Write all sections in parallel
-        all_sections = await asyncio.gather(*writers)
+        all_sections = await gather(*writers)
+    all_sections = cast(list[dict[str, Any]], all_sections)
 
-    _LOGGER.info("Finished section: %s", section.name)
+    for section in all_sections:
+        index = section["index"]
+        state.report_plan.sections[index].content = section["section"].content
+        _LOGGER.info("Finished section: %s", state.report_plan.sections[index].name)
 
-    return {"messages": all_sections[-1].get("messages", [])}
+    return {
+        "messages": all_sections[-1].get("messages", []),
+        "report_plan": state.report_plan,
+    }
 
 
 async def report_author(state: AgentState, config: RunnableConfig):
@@ -143,7 +171,7 @@ async def report_author(state: AgentState, config: RunnableConfig):
         },
     ]
 
-    response = await model.ainvoke(messages, config)
+    response = await ainvoke_llm(model, messages, config)
     state.report = response
 
     return state
@@ -153,10 +181,21 @@ async def report_author(state: AgentState, config: RunnableConfig):
 workflow = StateGraph(AgentState)
 
 # Add nodes
-workflow.add_node("topic_research", topic_research)
-workflow.add_node("report_planner", report_planner)
-workflow.add_node("section_author_orchestrator", section_author_orchestrator)
-workflow.add_node("report_author", report_author)
+workflow.add_node(
+    "topic_research", instrument_node("agent", "topic_research", topic_research)
+)
+workflow.add_node(
+    "report_planner", instrument_node("agent", "report_planner", report_planner)
+)
+workflow.add_node(
+    "section_author_orchestrator",
+    instrument_node(
+        "agent", "section_author_orchestrator", section_author_orchestrator
+    ),
+)
+workflow.add_node(
+    "report_author", instrument_node("agent", "report_author", report_author)
+)
 
 # Add edges
 workflow.add_edge(START, "topic_research")
@@ -1,6 +1,5 @@
 """Authoring workflow for writing sections of a report."""
 
-import json
 import logging
 from typing import Annotated, Any, Sequence
 
@@ -11,12 +10,16 @@ from langgraph.graph.message import add_messages
 from pydantic import BaseModel
 
 from . import tools
+from .corpus import ResearchCorpus
+from .instrument import instrument_node
+from .limits import ainvoke_llm
+from .llm_cache import llm_cache
 from .prompts import section_research_prompt, section_writing_prompt
 
 _LOGGER = logging.getLogger(__name__)
 _MAX_LLM_RETRIES = 3
 
-llm = ChatNVIDIA(model="meta/llama-3.3-70b-instruct", temperature=0)
+llm = ChatNVIDIA(model="meta/llama-3.3-70b-instruct", temperature=0, cache=llm_cache)
 llm_with_tools = llm.bind_tools([tools.search_tavily])
 
 
@@ -32,25 +35,31 @@ class SectionWriterState(BaseModel):
     section: Section
     topic: str  # Overall report topic for context
     messages: Annotated[Sequence[Any], add_messages] = []
+    corpus: ResearchCorpus = ResearchCorpus()
 
 
 async def tool_node(state: SectionWriterState):
     """Execute tool calls for research."""
     _LOGGER.info("Executing tool calls for section: %s", state.section.name)
     outputs = []
+    corpus = state.corpus
     for tool_call in state.messages[-1].tool_calls:
         _LOGGER.info("Executing tool call: %s", tool_call["name"])
-        tool = getattr(tools, tool_call["name"])
-        tool_result = await tool.ainvoke(tool_call["args"])
+        if tool_call["name"] == tools.search_tavily.name:
+            # The sources go in the state, the model is told which were found
+            corpus, content = await tools.search_corpus(corpus, tool_call["args"])
+        else:
+            tool = getattr(tools, tool_call["name"])
+            content = str(await tool.ainvoke(tool_call["args"]))
         outputs.append(
             {
                 "role": "tool",
-                "content": json.dumps(tool_result),
+                "content": content,
                 "name": tool_call["name"],
                 "tool_call_id": tool_call["id"],
             }
         )
-    return {"messages": outputs}
+    return {"messages": outputs, "corpus": corpus}
 
 
 async def research_model(
@@ -59,15 +68,18 @@ async def research_model(
 ) -> dict[str, Any]:
     """Call model for research queries if section needs research."""
     _LOGGER.info("Researching section: %s", state.section.name)
-    system_prompt = section_research_prompt.format(
-        section_name=state.section.name,
-        section_description=state.section.description,
-        overall_topic=state.topic,
+    system_prompt = tools.with_sources(
+        section_research_prompt.format(
+            section_name=state.section.name,
+            section_description=state.section.description,
+            overall_topic=state.topic,
+        ),
+        state.corpus,
     )
 
     for count in range(_MAX_LLM_RETRIES):
         messages = [{"role": "system", "content": system_prompt}] + list(state.messages)
-        response = await llm_with_tools.ainvoke(messages, config)
+        response = await ainvoke_llm(llm_with_tools, messages, config, retry=count > 0)
 
         if response:
             return {"messages": [response]}
@@ -85,15 +97,18 @@ async def writing_model(
 ) -> dict[str, Any]:
     """Call model to write the section content."""
     _LOGGER.info("Writing section: %s", state.section.name)
-    system_prompt = section_writing_prompt.format(
-        section_name=state.section.name,
-        section_description=state.section.description,
-        overall_topic=state.topic,
+    system_prompt = tools.with_sources(
+        section_writing_prompt.format(
+            section_name=state.section.name,
+            section_description=state.section.description,
+            overall_topic=state.topic,
+        ),
+        state.corpus,
     )
 
     for count in range(_MAX_LLM_RETRIES):
         messages = [{"role": "system", "content": system_prompt}] + list(state.messages)
-        response = await llm.ainvoke(messages, config)
+        response = await ainvoke_llm(llm, messages, config, retry=count > 0)
 
         if response:
             # Update the section content with the written content
@@ -124,9 +139,9 @@ def has_tool_calls(state: SectionWriterState) -> bool:
 
 workflow = StateGraph(SectionWriterState)
 
-workflow.add_node("agent", research_model)
-workflow.add_node("tools", tool_node)
-workflow.add_node("writer", writing_model)
+workflow.add_node("agent", instrument_node("author", "agent", research_model))
+workflow.add_node("tools", instrument_node("author", "tools", tool_node))
+workflow.add_node("writer", instrument_node("author", "writer", writing_model))
 
 workflow.add_conditional_edges(
     START,
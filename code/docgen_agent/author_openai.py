@@ -14,6 +14,9 @@ from langgraph.graph.message import add_messages
 from pydantic import BaseModel
 
 from . import tools
+from .instrument import instrument_node
+from .limits import ainvoke_llm
+from .llm_cache import llm_cache
 from .prompts import section_writer_instructions
 
 _LOGGER = logging.getLogger(__name__)
@@ -26,6 +29,7 @@ llm = ChatOpenAI(
     model="gpt-4o-mini",  # Using GPT-4o-mini for cost efficiency
     temperature=0,
     api_key=os.getenv("OPENAI_API_KEY"),
+    cache=llm_cache,
 )
 
 
@@ -58,7 +62,7 @@ async def research_section(state: SectionWriterState, config: RunnableConfig):
     search_results = []
     for query in research_queries:
         try:
-            result = await tools.search_tavily([query])
+            result = await tools.search_tavily.ainvoke({"queries": [query]})
             search_results.append(result)
         except Exception as e:
             _LOGGER.warning(f"Search failed for query '{query}': {e}")
@@ -89,7 +93,7 @@ async def writing_model(state: SectionWriterState, config: RunnableConfig):
 
     for count in range(_MAX_LLM_RETRIES):
         messages = [{"role": "system", "content": system_prompt}] + list(state.messages)
-        response = await model.ainvoke(messages, config)
+        response = await ainvoke_llm(model, messages, config, retry=count > 0)
         if response:
             response = cast(str, response)
             state.section.content = response
@@ -105,8 +109,8 @@ async def writing_model(state: SectionWriterState, config: RunnableConfig):
 workflow = StateGraph(SectionWriterState)
 
 # Add nodes
-workflow.add_node("research", research_section)
-workflow.add_node("writer", writing_model)
+workflow.add_node("research", instrument_node("author", "research", research_section))
+workflow.add_node("writer", instrument_node("author", "writer", writing_model))
 
 # Add edges
 workflow.add_edge(START, "research")
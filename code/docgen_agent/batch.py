@@ -0,0 +1,102 @@
+"""Write many reports in one go, yielding each as soon as it is finished.
+
+A batch runs on the shared event loop. Up to BATCH_CONCURRENCY of its
+reports are written at a time, and every report shares the global caps on
+concurrent LLM and Tavily calls (see docgen_agent.limits) with the rest of
+the process.
+"""
+
+import asyncio
+import logging
+import os
+import queue
+from typing import Any, AsyncIterator, Callable, Iterator
+
+from . import _record, astream_report
+from .loop import submit
+
+_LOGGER = logging.getLogger(__name__)
+
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "4"))
+MAX_BATCH_SIZE = int(os.getenv("MAX_BATCH_SIZE", "100"))
+
+
+async def astream_batch(
+    requests: list[dict[str, Any]],
+    concurrency: int = BATCH_CONCURRENCY,
+    generate: Callable[[str, str], AsyncIterator[dict[str, Any]]] | None = None,
+    traces: bool = False,
+) -> AsyncIterator[dict[str, Any]]:
+    """Write a report for each request, yielding results in completion order.
+
+    Each request has a topic, a report_structure and optionally
+    force_refresh. Each result has the index and topic of its request, a
+    status of completed or failed, either the title and report or the error,
+    and the LLM usage of the run, if there was one. With traces, results
+    also have the trace of their run. generate is passed on to astream_report.
+    """
+    slots = asyncio.Semaphore(concurrency)
+
+    async def run(index: int, request: dict[str, Any]) -> dict[str, Any]:
+        result: dict[str, Any] = {"index": index, "topic": request["topic"]}
+        async with slots:
+            report: dict[str, Any] = {}
+            try:
+                async for event in astream_report(
+                    request["topic"],
+                    request["report_structure"],
+                    request.get("force_refresh", False),
+                    generate=generate,
+                ):
+                    if event["event"] == "usage":
+                        result["usage"] = event["usage"]
+                    elif traces and event["event"] == "trace":
+                        result["trace"] = event["trace"]
+                    _record(report, event)
+                if "report" not in report:
+                    raise RuntimeError("Failed to generate report")
+            except Exception as e:
+                _LOGGER.exception("Batch report %d failed", index)
+                return {**result, "status": "failed", "error": str(e)}
+        return {
+            **result,
+            "status": "completed",
+            "title": report.get("title"),
+            "report": report["report"],
+        }
+
+    tasks = [asyncio.ensure_future(run(i, r)) for i, r in enumerate(requests)]
+    try:
+        for finished in asyncio.as_completed(tasks):
+            yield await finished
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+def iter_batch(
+    requests: list[dict[str, Any]],
+    concurrency: int = BATCH_CONCURRENCY,
+    generate: Callable[[str, str], AsyncIterator[dict[str, Any]]] | None = None,
+    traces: bool = False,
+) -> Iterator[dict[str, Any]]:
+    """Run astream_batch on the shared event loop from synchronous code.
+
+    Closing the iterator early cancels the reports that are still running.
+    """
+    results: queue.Queue = queue.Queue()
+
+    async def pump() -> None:
+        try:
+            async for result in astream_batch(requests, concurrency, generate, traces):
+                results.put(result)
+        finally:
+            results.put(None)
+
+    future = submit(pump())
+    try:
+        while (result := results.get()) is not None:
+            yield result
+        future.result()
+    finally:
+        future.cancel()
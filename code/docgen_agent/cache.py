@@ -0,0 +1,239 @@
+"""A two-tier key-value cache: an in-memory LRU in front of a SQLite file.
+
+Values must be JSON serializable. They are stored zlib-compressed on disk,
+expire after a per-entry TTL and are evicted least recently used first once
+the memory tier or the database grows past its size limit.
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any
+
+from .metrics import Callback
+
+_LOGGER = logging.getLogger(__name__)
+
+DATA_DIR = os.getenv(
+    "DOCGEN_DATA_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "data"),
+)
+_PURGE_EVERY = 64  # writes between sweeps for expired and oversized entries
+
+
+@dataclass
+class CacheEntry:
+    value: Any
+    expires_at: float
+
+    @property
+    def expired(self) -> bool:
+        return time.time() >= self.expires_at
+
+
+class TieredCache:
+    """Cache values in memory and, unless max_disk_bytes is 0, in SQLite.
+
+    Expired entries are kept for another stale_seconds so that lookup() can
+    still serve them while a fresh value is fetched.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        max_memory_items: int = 128,
+        max_disk_bytes: int = 256 * 1024 * 1024,
+        stale_seconds: float = 0,
+        path: str | None = None,
+    ):
+        self.name = name
+        self.max_memory_items = max_memory_items
+        self.max_disk_bytes = max_disk_bytes
+        self.stale_seconds = stale_seconds
+        self.path = path or os.path.join(DATA_DIR, f"{name}.sqlite")
+        self.hits = 0
+        self.misses = 0
+        self._memory: OrderedDict[str, CacheEntry] = OrderedDict()
+        self._db: sqlite3.Connection | None = None
+        self._writes = 0
+        self._lock = threading.Lock()
+        _caches.append(self)
+
+    def _connect(self) -> sqlite3.Connection | None:
+        if self.max_disk_bytes <= 0:
+            return None
+        if self._db is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                " key TEXT PRIMARY KEY,"
+                " value BLOB NOT NULL,"
+                " size INTEGER NOT NULL,"
+                " expires_at REAL NOT NULL,"
+                " accessed_at REAL NOT NULL)"
+            )
+            self._db.execute(
+                "CREATE INDEX IF NOT EXISTS entries_accessed_at"
+                " ON entries (accessed_at)"
+            )
+        return self._db
+
+    def lookup(self, key: str) -> CacheEntry | None:
+        """Return the entry for key, even if it is expired but still servable.
+
+        An entry is counted as a hit, fresh or not.
+        """
+        entry = self._lookup(key)
+        if entry is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return entry
+
+    def _lookup(self, key: str) -> CacheEntry | None:
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is None:
+                try:
+                    entry = self._load(key)
+                except sqlite3.Error:
+                    _LOGGER.warning(
+                        "Failed to read from %s cache", self.name, exc_info=True
+                    )
+                if entry is not None:
+                    self._remember(key, entry)
+            else:
+                self._memory.move_to_end(key)
+
+            if entry is None:
+                return None
+            if time.time() >= entry.expires_at + self.stale_seconds:
+                self._memory.pop(key, None)
+                return None
+            return entry
+
+    def get(self, key: str) -> Any | None:
+        """Return the cached value for key if it has not expired."""
+        entry = self._lookup(key)
+        if entry is None or entry.expired:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry.value
+
+    def set(self, key: str, value: Any, ttl: float) -> None:
+        """Cache value under key for ttl seconds."""
+        entry = CacheEntry(value=value, expires_at=time.time() + ttl)
+        with self._lock:
+            self._remember(key, entry)
+            db = self._connect()
+            if db is None:
+                return
+            blob = zlib.compress(json.dumps(value).encode())
+            try:
+                with db:
+                    db.execute(
+                        "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)",
+                        (key, blob, len(blob), entry.expires_at, time.time()),
+                    )
+                self._writes += 1
+                if self._writes % _PURGE_EVERY == 0:
+                    self._purge(db)
+            except sqlite3.Error:
+                _LOGGER.warning("Failed to write to %s cache", self.name, exc_info=True)
+
+    def delete(self, key: str) -> None:
+        """Drop key from both tiers."""
+        with self._lock:
+            self._memory.pop(key, None)
+            db = self._connect()
+            if db is not None:
+                with db:
+                    db.execute("DELETE FROM entries WHERE key = ?", (key,))
+
+    def clear(self) -> None:
+        """Drop every entry from both tiers."""
+        with self._lock:
+            self._memory.clear()
+            db = self._connect()
+            if db is not None:
+                with db:
+                    db.execute("DELETE FROM entries")
+
+    def stats(self) -> dict[str, Any]:
+        """Hit and miss counts of this cache."""
+        return {
+            "name": self.name,
+            "hits": self.hits,
+            "misses": self.misses,
+            "memory_items": len(self._memory),
+        }
+
+    def _remember(self, key: str, entry: CacheEntry) -> None:
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_items:
+            self._memory.popitem(last=False)
+
+    def _load(self, key: str) -> CacheEntry | None:
+        db = self._connect()
+        if db is None:
+            return None
+        row = db.execute(
+            "SELECT value, expires_at FROM entries WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        with db:
+            db.execute(
+                "UPDATE entries SET accessed_at = ? WHERE key = ?", (time.time(), key)
+            )
+        return CacheEntry(value=json.loads(zlib.decompress(row[0])), expires_at=row[1])
+
+    def _purge(self, db: sqlite3.Connection) -> None:
+        """Delete expired entries, then the least recently used ones over size."""
+        with db:
+            db.execute(
+                "DELETE FROM entries WHERE expires_at < ?",
+                (time.time() - self.stale_seconds,),
+            )
+            (total,) = db.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM entries"
+            ).fetchone()
+            if total <= self.max_disk_bytes:
+                return
+            _LOGGER.info("Evicting from %s cache (%d bytes)", self.name, total)
+            excess = total - self.max_disk_bytes
+            for key, size in db.execute(
+                "SELECT key, size FROM entries ORDER BY accessed_at"
+            ).fetchall():
+                if excess <= 0:
+                    break
+                db.execute("DELETE FROM entries WHERE key = ?", (key,))
+                excess -= size
+
+
+_caches: list[TieredCache] = []
+
+Callback(
+    "docgen_cache_hits_total",
+    "Cache lookups that found a fresh value.",
+    lambda: {(cache.name,): cache.hits for cache in _caches},
+    ("cache",),
+    kind="counter",
+)
+Callback(
+    "docgen_cache_misses_total",
+    "Cache lookups that found no fresh value.",
+    lambda: {(cache.name,): cache.misses for cache in _caches},
+    ("cache",),
+    kind="counter",
+)
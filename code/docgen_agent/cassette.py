@@ -0,0 +1,224 @@
+"""Record Tavily searches and chat model calls to a cassette, or replay them.
+
+With CASSETTE_MODE=record, every Tavily search and chat model call is run
+as usual and its response is appended to CASSETTE_PATH (a JSON lines file,
+by default data/cassette.jsonl). The entry is keyed on a hash of the
+request, and also holds how long the call took. Chat model calls are keyed
+on their messages without the ids, timings and usage that differ from one
+run to the next. With CASSETTE_MODE=replay,
+the same calls are served from the cassette instead, so the report graphs
+run offline and deterministically. A call that is not on the cassette fails
+with CassetteMissError rather than going to the network. CASSETTE_LATENCY
+scales the recorded latencies that a replay waits out: 0 (the default)
+does not wait, and 1 waits as long as the recording did.
+
+A request made several times is replayed in the order it was recorded,
+and the last response is repeated after that. The search, LLM and report
+caches are bypassed while a cassette is in use, so that recording captures
+every call and replaying does not depend on what was cached.
+
+The API clients are still created in replay mode, so the API key variables
+must be set, though any value will do.
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from typing import Any, Awaitable, Callable, Sequence
+
+from langchain_core.caches import BaseCache
+from langchain_core.load import dumpd, load
+from langchain_core.outputs import Generation
+
+from .cache import DATA_DIR
+
+_LOGGER = logging.getLogger(__name__)
+
+CASSETTE_MODE = os.getenv("CASSETTE_MODE", "")
+CASSETTE_PATH = os.getenv("CASSETTE_PATH", os.path.join(DATA_DIR, "cassette.jsonl"))
+CASSETTE_LATENCY = float(os.getenv("CASSETTE_LATENCY", "0"))
+
+
+# Fields of a serialized message that differ from one run of the same calls
+# to the next: message and tool call ids, timings and token usage
+_RUN_SPECIFIC_FIELDS = ("id", "tool_call_id", "response_metadata", "usage_metadata")
+
+
+class CassetteMissError(LookupError):
+    """A call being replayed was not recorded on the cassette."""
+
+
+class Cassette:
+    """Responses to Tavily and chat model calls, keyed on their requests."""
+
+    def __init__(self, path: str, mode: str, latency: float = CASSETTE_LATENCY):
+        if mode not in ("record", "replay"):
+            raise ValueError(f"CASSETTE_MODE must be record or replay, not {mode!r}")
+        self.path = path
+        self.mode = mode
+        self.latency = latency
+        # key -> the recorded responses, with their latencies, in order
+        self.entries: dict[str, list[tuple[Any, float]]] = defaultdict(list)
+        # key -> how many of its responses have been replayed
+        self.replayed: dict[str, int] = defaultdict(int)
+        self._lock = threading.Lock()
+        if mode == "replay":
+            self._load()
+        else:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    @staticmethod
+    def key(kind: str, request: Any) -> str:
+        encoded = json.dumps([kind, request], sort_keys=True, default=str)
+        return hashlib.sha256(encoded.encode()).hexdigest()
+
+    def _load(self) -> None:
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    self.entries[entry["key"]].append(
+                        (entry["response"], entry["seconds"])
+                    )
+        _LOGGER.info("Replaying %d requests from %s", len(self.entries), self.path)
+
+    def record(self, kind: str, key: str, response: Any, seconds: float) -> None:
+        """Append the response to a call to the cassette."""
+        line = json.dumps(
+            {
+                "key": key,
+                "kind": kind,
+                "seconds": round(seconds, 4),
+                "response": response,
+            }
+        )
+        with self._lock:
+            self.entries[key].append((response, seconds))
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+
+    def replay(self, kind: str, key: str) -> tuple[Any, float]:
+        """The next recorded response to a call, and how long to wait for it."""
+        with self._lock:
+            responses = self.entries.get(key)
+            if not responses:
+                raise CassetteMissError(f"No {kind} call with key {key} on {self.path}")
+            index = min(self.replayed[key], len(responses) - 1)
+            self.replayed[key] += 1
+        response, seconds = responses[index]
+        return response, seconds * self.latency
+
+    async def play(
+        self, kind: str, request: Any, call: Callable[[], Awaitable[Any]]
+    ) -> Any:
+        """Record the JSON response of call, or replay the recorded one."""
+        key = self.key(kind, request)
+        if self.mode == "replay":
+            response, wait = self.replay(kind, key)
+            if wait > 0:
+                await asyncio.sleep(wait)
+            return response
+        start = time.perf_counter()
+        response = await call()
+        self.record(kind, key, response, time.perf_counter() - start)
+        return response
+
+
+def stable_prompt(prompt: str) -> Any:
+    """A chat model prompt without the fields that change from run to run.
+
+    LangChain passes the messages serialized to JSON. LangGraph gives each
+    message a random id, and a model's tool calls and responses carry ids,
+    timings and usage of their own, so after the first call of a run the raw
+    prompt would never be the same twice.
+    """
+    try:
+        messages = json.loads(prompt)
+    except ValueError:
+        return prompt
+    if not isinstance(messages, list):
+        return messages
+    for message in messages:
+        kwargs = message.get("kwargs") if isinstance(message, dict) else None
+        if not isinstance(kwargs, dict):
+            continue
+        for field in _RUN_SPECIFIC_FIELDS:
+            kwargs.pop(field, None)
+        calls = kwargs.get("tool_calls", []) + kwargs.get("invalid_tool_calls", [])
+        calls += kwargs.get("additional_kwargs", {}).get("tool_calls", [])
+        for call in calls:
+            call.pop("id", None)
+    return messages
+
+
+class CassetteLLMCache(BaseCache):
+    """A LangChain model cache that records chat model calls, or replays them.
+
+    LangChain looks a call up right before sending it and updates the cache
+    right after, so a recording times the call between the two.
+    """
+
+    def __init__(self, cassette: Cassette):
+        self.cassette = cassette
+        # key -> when the call being recorded was sent
+        self._started: dict[str, float] = {}
+
+    @staticmethod
+    def request(prompt: str, llm_string: str) -> dict[str, Any]:
+        return {"llm_string": llm_string, "prompt": stable_prompt(prompt)}
+
+    def lookup(self, prompt: str, llm_string: str) -> Sequence[Generation] | None:
+        """Replay the generations of a call, or note when it is sent."""
+        key = self.cassette.key("llm", self.request(prompt, llm_string))
+        if self.cassette.mode == "record":
+            self._started[key] = time.perf_counter()
+            return None
+        value, wait = self.cassette.replay("llm", key)
+        if wait > 0:
+            time.sleep(wait)
+        return [load(generation, allowed_objects="core") for generation in value]
+
+    async def alookup(
+        self, prompt: str, llm_string: str
+    ) -> Sequence[Generation] | None:
+        """Replay the generations of a call, waiting without blocking the loop."""
+        key = self.cassette.key("llm", self.request(prompt, llm_string))
+        if self.cassette.mode == "record":
+            self._started[key] = time.perf_counter()
+            return None
+        value, wait = self.cassette.replay("llm", key)
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return [load(generation, allowed_objects="core") for generation in value]
+
+    def update(
+        self, prompt: str, llm_string: str, return_val: Sequence[Generation]
+    ) -> None:
+        """Record the generations of a call, with their token usage."""
+        key = self.cassette.key("llm", self.request(prompt, llm_string))
+        started = self._started.pop(key, None)
+        seconds = time.perf_counter() - started if started is not None else 0.0
+        self.cassette.record(
+            "llm", key, [dumpd(generation) for generation in return_val], seconds
+        )
+
+    async def aupdate(
+        self, prompt: str, llm_string: str, return_val: Sequence[Generation]
+    ) -> None:
+        self.update(prompt, llm_string, return_val)
+
+    def clear(self, **kwargs: Any) -> None:
+        """Cassettes are only ever appended to."""
+
+
+cassette = Cassette(CASSETTE_PATH, CASSETTE_MODE) if CASSETTE_MODE else None
+
+
+def active() -> bool:
+    """Whether calls are being recorded to or replayed from a cassette."""
+    return cassette is not None
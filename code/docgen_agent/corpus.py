@@ -0,0 +1,105 @@
+"""The sources found while researching a report, kept as data until a prompt.
+
+search_tavily answers with the formatted text of its sources, and the tool
+nodes used to JSON-encode that text once more as the tool message. Every
+newline and quote was escaped, and each search's text stayed in the message
+history, read again by every later call. The tool nodes now add the sources
+to a ResearchCorpus in the graph state, answer the model with a short note,
+and each model call renders the corpus once, within a token budget, into
+its system prompt.
+
+Each source has an ID, such as S3, that prompts and notes refer to it by,
+and records the queries that found it. A page found again, or a near
+duplicate of one already in the corpus, adds its query to that source.
+"""
+
+from typing import Any, Iterable
+
+from pydantic import BaseModel
+
+from . import sources
+
+
+class Source(BaseModel):
+    id: str
+    # how prompts refer to the source, such as S3
+    url: str
+    title: str
+    content: str
+    raw_content: str | None = None
+    score: float = 0.0
+    # Tavily's relevance score, from 0 to 1
+    queries: list[str] = []
+    # the searches that found the source
+
+
+class ResearchCorpus(BaseModel):
+    sources: list[Source] = []
+
+    def add_responses(
+        self, responses: Iterable[dict[str, Any]]
+    ) -> tuple["ResearchCorpus", list[str]]:
+        """Add the results of Tavily search responses, each page once.
+
+        Returns the new corpus and the IDs of the sources the responses
+        found, whether new or already in the corpus.
+        """
+        added = [source.model_copy() for source in self.sources]
+        by_url = {sources.canonical_url(source.url): source for source in added}
+        near_duplicates = sources.NearDuplicates()
+        for source in added:
+            text = sources.source_text(
+                {"raw_content": source.raw_content, "content": source.content}
+            )
+            near_duplicates.match(text, source)
+
+        found: list[str] = []
+        for response in responses:
+            query = response.get("query", "")
+            for result in response["results"]:
+                url = sources.canonical_url(result["url"])
+                source = by_url.get(url)
+                if source is None:
+                    new = Source(
+                        id=f"S{len(added) + 1}",
+                        url=result["url"],
+                        title=result["title"],
+                        content=result["content"],
+                        raw_content=result.get("raw_content"),
+                        score=result.get("score") or 0.0,
+                    )
+                    source = near_duplicates.match(sources.source_text(result), new)
+                    if source is None:
+                        source = new
+                        added.append(source)
+                by_url.setdefault(url, source)
+                if query and query not in source.queries:
+                    source.queries = [*source.queries, query]
+                if source.id not in found:
+                    found.append(source.id)
+        return ResearchCorpus(sources=added), found
+
+    def render(self, max_tokens_per_source: int, max_tokens: int) -> str:
+        """The sources as text for a prompt, within about max_tokens tokens."""
+        include_raw_content = any(
+            source.raw_content is not None for source in self.sources
+        )
+        chunks = list(
+            sources.iter_formatted_sources(
+                (
+                    {
+                        "title": f"[{source.id}] {source.title}",
+                        "url": source.url,
+                        "content": source.content,
+                        "raw_content": source.raw_content,
+                        "score": source.score,
+                    }
+                    for source in self.sources
+                ),
+                max_tokens_per_source,
+                include_raw_content,
+                max_tokens,
+            )
+        )
+        chunks[-1] = chunks[-1].rstrip()
+        return "".join(chunks)
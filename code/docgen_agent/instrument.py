@@ -0,0 +1,30 @@
+"""Instrumentation of the graph nodes, for metrics, tracing and usage."""
+
+import functools
+import time
+from typing import Any, Callable
+
+from . import tracing, usage
+from .metrics import node_errors, node_seconds
+
+
+def instrument_node(graph: str, node: str, fn: Callable) -> Callable:
+    """Wrap an async graph node to record its latency, errors, span and usage."""
+    name = f"{graph}.{node}"
+
+    @functools.wraps(fn)
+    async def wrapper(state: Any, *args: Any, **kwargs: Any) -> Any:
+        # Section writers carry the index of their section in their state
+        index = getattr(state, "index", -1)
+        section = index if index >= 0 else None
+        start = time.perf_counter()
+        try:
+            with tracing.span(name, "node", section), usage.scope(name, section):
+                return await fn(state, *args, **kwargs)
+        except Exception:
+            node_errors.inc(graph, node)
+            raise
+        finally:
+            node_seconds.observe(time.perf_counter() - start, graph, node)
+
+    return wrapper
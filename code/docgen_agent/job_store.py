@@ -0,0 +1,235 @@
+"""Durable storage for report jobs.
+
+Jobs are recorded in a SQLite database under data/ as they progress: the
+request, status and timings, the report plan, each section as it is written,
+the finished report and its LLM usage. Finished reports can then be fetched
+again after a restart, and jobs that were interrupted can be queued again.
+
+Several processes may share the store, such as the workers of a WSGI
+server. Each unfinished job is owned by the process running it, under a
+lease that the process renews while it is alive. A job is only taken over,
+atomically, once it has no owner or its owner's lease has run out, so no
+job runs in two processes at once.
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any
+
+from .cache import DATA_DIR
+
+_LOGGER = logging.getLogger(__name__)
+
+JOB_STORE_RETENTION_DAYS = int(os.getenv("JOB_STORE_RETENTION_DAYS", "30"))
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "60"))
+
+_JOB_COLUMNS = (
+    "id",
+    "topic",
+    "report_structure",
+    "force_refresh",
+    "status",
+    "node",
+    "report",
+    "error",
+    "coalesced",
+    "usage",
+    "created_at",
+    "started_at",
+    "finished_at",
+)
+
+
+class JobStore:
+    """Record jobs, their plans and their sections in SQLite."""
+
+    def __init__(
+        self, path: str | None = None, lease_seconds: float = JOB_LEASE_SECONDS
+    ):
+        self.path = path or os.path.join(DATA_DIR, "jobs.sqlite")
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.lease_seconds = lease_seconds
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self._lock, self._db:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                " id TEXT PRIMARY KEY,"
+                " topic TEXT NOT NULL,"
+                " report_structure TEXT NOT NULL,"
+                " force_refresh INTEGER NOT NULL,"
+                " status TEXT NOT NULL,"
+                " node TEXT,"
+                " report TEXT,"
+                " error TEXT,"
+                " coalesced INTEGER NOT NULL,"
+                " usage TEXT,"
+                " created_at REAL NOT NULL,"
+                " started_at REAL,"
+                " finished_at REAL,"
+                " title TEXT,"
+                " owner TEXT,"
+                " lease_until REAL)"
+            )
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS sections ("
+                " job_id TEXT NOT NULL,"
+                " idx INTEGER NOT NULL,"
+                " name TEXT NOT NULL,"
+                " content TEXT NOT NULL,"
+                " PRIMARY KEY (job_id, idx))"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status)")
+            columns = {
+                column["name"]
+                for column in self._db.execute("PRAGMA table_info(jobs)").fetchall()
+            }
+            # Stores created before usage was recorded, or jobs were owned
+            for column, kind in (
+                ("usage", "TEXT"),
+                ("owner", "TEXT"),
+                ("lease_until", "REAL"),
+            ):
+                if column not in columns:
+                    self._db.execute(f"ALTER TABLE jobs ADD COLUMN {column} {kind}")
+
+    def save(self, job: Any, owner: str | None = None) -> bool:
+        """Insert or update the request, status and timings of a job.
+
+        With an owner, the job is saved as owned by it, with a fresh lease,
+        unless another owner holds a lease on it; returns whether it was
+        saved.
+        """
+        values = [getattr(job, column) for column in _JOB_COLUMNS]
+        if job.usage is not None:
+            values[_JOB_COLUMNS.index("usage")] = json.dumps(job.usage)
+        columns = _JOB_COLUMNS
+        updates = ", ".join(f"{column} = excluded.{column}" for column in columns)
+        condition = ""
+        parameters = []
+        if owner is not None:
+            now = time.time()
+            columns += ("owner", "lease_until")
+            values += [owner, now + self.lease_seconds]
+            updates += ", owner = excluded.owner, lease_until = excluded.lease_until"
+            condition = (
+                " WHERE jobs.owner IS NULL OR jobs.owner = excluded.owner"
+                " OR jobs.lease_until < ?"
+            )
+            parameters = [now]
+        placeholders = ", ".join("?" for _ in columns)
+        with self._lock, self._db:
+            saved = self._db.execute(
+                f"INSERT INTO jobs ({', '.join(columns)}) VALUES ({placeholders})"
+                f" ON CONFLICT (id) DO UPDATE SET {updates}{condition}",
+                values + parameters,
+            ).rowcount
+        return saved == 1
+
+    def save_plan(self, job_id: str, title: str, sections: list[str]) -> None:
+        """Record the report plan of a job, with empty sections."""
+        with self._lock, self._db:
+            self._db.execute("UPDATE jobs SET title = ? WHERE id = ?", (title, job_id))
+            self._db.execute("DELETE FROM sections WHERE job_id = ?", (job_id,))
+            self._db.executemany(
+                "INSERT INTO sections VALUES (?, ?, ?, '')",
+                [(job_id, index, name) for index, name in enumerate(sections)],
+            )
+
+    def save_section(self, job_id: str, index: int, name: str, content: str) -> None:
+        """Record a finished section of a job."""
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO sections VALUES (?, ?, ?, ?)",
+                (job_id, index, name, content),
+            )
+
+    def load(self, job_id: str) -> dict[str, Any] | None:
+        """Return a job's columns, plus its title and sections, or None."""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT * FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            sections = self._db.execute(
+                "SELECT name, content FROM sections WHERE job_id = ? ORDER BY idx",
+                (job_id,),
+            ).fetchall()
+        job = dict(row)
+        if job["usage"] is not None:
+            job["usage"] = json.loads(job["usage"])
+        job["sections"] = [dict(section) for section in sections]
+        return job
+
+    def unfinished(self) -> list[dict[str, Any]]:
+        """Return the queued or running jobs that no process owns, oldest first.
+
+        These are the jobs whose owner's lease has run out, such as the jobs
+        of a process that stopped.
+        """
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT id FROM jobs WHERE status IN ('queued', 'running')"
+                " AND (owner IS NULL OR lease_until < ?) ORDER BY created_at",
+                (time.time(),),
+            ).fetchall()
+        return [job for row in rows if (job := self.load(row["id"])) is not None]
+
+    def claim(self, job_id: str, owner: str) -> bool:
+        """Take over an unfinished job that no other process owns."""
+        now = time.time()
+        with self._lock, self._db:
+            claimed = self._db.execute(
+                "UPDATE jobs SET owner = ?, lease_until = ?"
+                " WHERE id = ? AND status IN ('queued', 'running')"
+                " AND (owner IS NULL OR owner = ? OR lease_until < ?)",
+                (owner, now + self.lease_seconds, job_id, owner, now),
+            ).rowcount
+        return claimed == 1
+
+    def cancel(self, job_id: str) -> bool:
+        """Mark an unfinished job that no process owns as cancelled.
+
+        Returns whether it was: a job another process holds a lease on is
+        left to that process.
+        """
+        now = time.time()
+        with self._lock, self._db:
+            cancelled = self._db.execute(
+                "UPDATE jobs SET status = 'cancelled', node = NULL, finished_at = ?"
+                " WHERE id = ? AND status IN ('queued', 'running')"
+                " AND (owner IS NULL OR lease_until < ?)",
+                (now, job_id, now),
+            ).rowcount
+        return cancelled == 1
+
+    def renew(self, owner: str) -> None:
+        """Extend the leases of the unfinished jobs owned by owner."""
+        with self._lock, self._db:
+            self._db.execute(
+                "UPDATE jobs SET lease_until = ?"
+                " WHERE owner = ? AND status IN ('queued', 'running')",
+                (time.time() + self.lease_seconds, owner),
+            )
+
+    def prune(self, retention_days: int = JOB_STORE_RETENTION_DAYS) -> None:
+        """Delete jobs that finished more than retention_days ago."""
+        cutoff = time.time() - retention_days * 24 * 3600
+        with self._lock, self._db:
+            self._db.execute(
+                "DELETE FROM sections WHERE job_id IN"
+                " (SELECT id FROM jobs WHERE finished_at < ?)",
+                (cutoff,),
+            )
+            deleted = self._db.execute(
+                "DELETE FROM jobs WHERE finished_at < ?", (cutoff,)
+            ).rowcount
+        if deleted:
+            _LOGGER.info("Deleted %d old jobs from the job store", deleted)
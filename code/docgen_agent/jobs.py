@@ -0,0 +1,470 @@
+"""Background job queue for the report generation workflow.
+
+A full research and authoring run takes several minutes, so callers submit
+a job, get its ID back right away and poll it for progress and the report.
+
+With a job store, every job this process runs is owned by it in the store
+(see docgen_agent.job_store). Recovery only takes over the unfinished jobs
+that no live process owns, so processes sharing a store never run the same
+job twice.
+"""
+
+import asyncio
+import logging
+import multiprocessing
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import Future, as_completed
+from dataclasses import dataclass, field
+from typing import Any, Iterable, Iterator
+
+from . import astream_run
+from .job_store import JobStore
+from .loop import submit
+from .metrics import Counter, Histogram
+from .report_cache import get_report
+from .workers import WorkerPool
+
+_LOGGER = logging.getLogger(__name__)
+
+REPORT_WORKERS = int(os.getenv("REPORT_WORKERS", "4"))
+MAX_QUEUED_JOBS = int(os.getenv("MAX_QUEUED_JOBS", "32"))
+JOB_RETENTION_SECONDS = int(os.getenv("JOB_RETENTION_SECONDS", "3600"))
+_DEFAULT_JOB_SECONDS = 300.0  # typical report duration before any has finished
+
+QUEUED = "queued"
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+jobs_finished = Counter(
+    "docgen_jobs_finished_total", "Jobs that finished, by status.", ("status",)
+)
+job_seconds = Histogram(
+    "docgen_job_duration_seconds", "Time from a job's start to its end."
+)
+
+
+class QueueFullError(RuntimeError):
+    """Raised when a job is submitted while the queue is at capacity."""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+        # seconds until a slot is likely to free up
+
+
+@dataclass
+class Job:
+    topic: str
+    report_structure: str
+    force_refresh: bool = False
+    id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    status: str = QUEUED
+    node: str | None = None
+    # the graph node currently executing
+    report: str | None = None
+    error: str | None = None
+    coalesced: bool = False
+    # whether the job shared an identical run that was already in flight
+    created_at: float = field(default_factory=time.time)
+    started_at: float | None = None
+    finished_at: float | None = None
+    events: list[dict[str, Any]] = field(default_factory=list)
+    # progress events, ending with a report, error or cancelled event
+    usage: dict[str, Any] | None = None
+    # the run's LLM tokens and cost, once it has finished
+    trace: list[dict[str, Any]] | None = field(default=None, repr=False)
+    # the run's Chrome trace events, once it has finished
+    _updated: threading.Condition = field(
+        default_factory=threading.Condition, repr=False
+    )
+    _future: Future | None = field(default=None, repr=False)
+
+    @property
+    def done(self) -> bool:
+        return self.status in (COMPLETED, FAILED, CANCELLED)
+
+    def add_event(self, event: dict[str, Any]) -> None:
+        """Record a progress event and wake up anyone waiting for it."""
+        with self._updated:
+            self.events.append(event)
+            self._updated.notify_all()
+
+    def wait_for_events(self, cursor: int, timeout: float) -> list[dict[str, Any]]:
+        """Return the events after cursor, waiting up to timeout for new ones."""
+        with self._updated:
+            self._updated.wait_for(lambda: len(self.events) > cursor, timeout)
+            return self.events[cursor:]
+
+    @classmethod
+    def from_stored(cls, stored: dict[str, Any]) -> "Job":
+        """Rebuild a job, and its progress events, from the job store."""
+        job = cls(
+            topic=stored["topic"],
+            report_structure=stored["report_structure"],
+            force_refresh=bool(stored["force_refresh"]),
+            id=stored["id"],
+            status=stored["status"],
+            node=stored["node"],
+            report=stored["report"],
+            error=stored["error"],
+            coalesced=bool(stored["coalesced"]),
+            usage=stored["usage"],
+            created_at=stored["created_at"],
+            started_at=stored["started_at"],
+            finished_at=stored["finished_at"],
+        )
+        if stored["title"] is not None:
+            sections = stored["sections"]
+            job.events.append(
+                {
+                    "event": "plan",
+                    "title": stored["title"],
+                    "sections": [section["name"] for section in sections],
+                }
+            )
+            job.events.extend(
+                {"event": "section", "index": index, **section}
+                for index, section in enumerate(sections)
+                if section["content"]
+            )
+        if job.report is not None:
+            job.events.append({"event": "report", "report": job.report})
+        elif job.error is not None:
+            job.events.append({"event": "error", "error": job.error})
+        elif job.status == CANCELLED:
+            job.events.append({"event": "cancelled"})
+        return job
+
+    def to_dict(self) -> dict[str, Any]:
+        """Describe the job without its (potentially large) report."""
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "node": self.node,
+            "topic": self.topic,
+            "error": self.error,
+            "coalesced": self.coalesced,
+            "usage": self.usage,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class JobQueue:
+    """Run report jobs on the shared event loop, a bounded number at a time.
+
+    With a worker pool, the reports are generated on its worker processes
+    and the pool's capacity bounds how many run at once. With a job store,
+    jobs are recorded as they progress and outlive the process.
+    """
+
+    def __init__(
+        self,
+        max_workers: int = REPORT_WORKERS,
+        max_queued: int = MAX_QUEUED_JOBS,
+        pool: WorkerPool | None = None,
+        store: JobStore | None = None,
+    ):
+        self.pool = pool
+        self.store = store
+        self.max_workers = pool.capacity if pool else max_workers
+        self.max_queued = max_queued
+        self._slots = asyncio.Semaphore(self.max_workers)
+        self._average_duration = _DEFAULT_JOB_SECONDS
+        self._jobs: dict[str, Job] = {}
+        self._lock = threading.Lock()
+        self._owner: tuple[int, str] | None = None
+        # the task renewing this process's leases, started with its first job
+        self._keeper: Future | None = None
+        # whether this process takes over the jobs of stopped ones
+        self._recovering = False
+
+    @property
+    def owner(self) -> str:
+        """Who this process is in the job store, unique to the process."""
+        # A forked child process needs an identity of its own
+        if self._owner is None or self._owner[0] != os.getpid():
+            owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+            self._owner = (os.getpid(), owner)
+            self._keeper = None
+        return self._owner[1]
+
+    @property
+    def capacity(self) -> int:
+        """How many jobs may be running or waiting for a slot at once."""
+        return self.max_workers + self.max_queued
+
+    def submit(
+        self, topic: str, report_structure: str, force_refresh: bool = False
+    ) -> Job:
+        """Queue a report for generation and return its job."""
+        (job,) = self.submit_many(
+            [
+                {
+                    "topic": topic,
+                    "report_structure": report_structure,
+                    "force_refresh": force_refresh,
+                }
+            ]
+        )
+        return job
+
+    def submit_many(self, requests: list[dict[str, Any]]) -> list[Job]:
+        """Queue reports for generation, all of them or none, and return the jobs.
+
+        Each request has a topic, a report_structure and optionally
+        force_refresh.
+        """
+        jobs = [
+            Job(
+                topic=request["topic"],
+                report_structure=request["report_structure"],
+                force_refresh=request.get("force_refresh", False),
+            )
+            for request in requests
+        ]
+        with self._lock:
+            self._prune()
+            pending = sum(1 for queued in self._jobs.values() if not queued.done)
+            if pending + len(jobs) > self.capacity:
+                raise QueueFullError(
+                    "Too many reports are queued.",
+                    self._retry_after(pending + len(jobs) - 1),
+                )
+            for job in jobs:
+                self._jobs[job.id] = job
+        self._keep_leases()
+        for job in jobs:
+            self._save(job)
+            job._future = submit(self._run(job))
+            _LOGGER.info("Queued job %s for topic: %s", job.id, job.topic)
+        return jobs
+
+    def as_completed(self, jobs: Iterable[Job]) -> Iterator[Job]:
+        """Yield the jobs as they finish, whether completed, failed or cancelled."""
+        futures = {job._future: job for job in jobs if job._future is not None}
+        for future in as_completed(futures):
+            yield futures[future]
+
+    def recover(self) -> list[Job]:
+        """Queue the unfinished jobs again that no live process owns.
+
+        They are claimed in the job store first, so a job is recovered by
+        one process only. This process then keeps its leases, and goes on
+        taking over the jobs of processes that stop. Worker processes
+        spawned by this one recover nothing.
+        """
+        if self.store is None or multiprocessing.parent_process() is not None:
+            return []
+        self.store.prune()
+        self._recovering = True
+        jobs = self._claim_unfinished()
+        self._keep_leases()
+        return jobs
+
+    def _claim_unfinished(self) -> list[Job]:
+        assert self.store is not None
+        jobs = []
+        for stored in self.store.unfinished():
+            if not self.store.claim(stored["id"], self.owner):
+                continue
+            job = Job(
+                topic=stored["topic"],
+                report_structure=stored["report_structure"],
+                force_refresh=bool(stored["force_refresh"]),
+                id=stored["id"],
+                created_at=stored["created_at"],
+            )
+            with self._lock:
+                self._jobs[job.id] = job
+            self._save(job)
+            job._future = submit(self._run(job))
+            jobs.append(job)
+        if jobs:
+            _LOGGER.info("Recovered %d unfinished jobs", len(jobs))
+        return jobs
+
+    def _keep_leases(self) -> None:
+        """Start renewing the leases of this process's jobs, if it has not yet."""
+        if self.store is None:
+            return
+        owner = self.owner
+        with self._lock:
+            if self._keeper is None or self._keeper.done():
+                self._keeper = submit(self._renew_leases(owner))
+
+    async def _renew_leases(self, owner: str) -> None:
+        """Renew this process's leases, and take over the jobs of stopped ones."""
+        assert self.store is not None
+        while True:
+            await asyncio.sleep(self.store.lease_seconds / 3)
+            try:
+                await asyncio.to_thread(self.store.renew, owner)
+                if self._recovering:
+                    await asyncio.to_thread(self._claim_unfinished)
+            except sqlite3.Error:
+                _LOGGER.warning("Failed to renew the job leases", exc_info=True)
+
+    def get(self, job_id: str) -> Job | None:
+        """Look up a job by its ID, falling back to the job store."""
+        job = self._jobs.get(job_id)
+        if job is None and self.store is not None:
+            stored = self.store.load(job_id)
+            if stored is not None:
+                job = Job.from_stored(stored)
+        return job
+
+    def cancel(self, job_id: str) -> Job | None:
+        """Cancel a job, stopping its searches and LLM calls, and return it.
+
+        A job sharing its run with identical jobs only detaches from it; the
+        run itself stops once every job on it has been cancelled. A job only
+        in the job store, left unfinished by a process that stopped, is
+        marked cancelled there. Returns None if nothing was cancelled: the
+        job is unknown, finished, or run by another live process.
+        """
+        job = self._jobs.get(job_id)
+        if job is not None:
+            if job.done or job._future is None or not job._future.cancel():
+                return None
+            return job
+        if self.store is None or not self.store.cancel(job_id):
+            return None
+        _LOGGER.info("Cancelled stored job %s", job_id)
+        return self.get(job_id)
+
+    def stats(self) -> dict[str, int]:
+        """How many jobs are waiting for a slot and how many are running."""
+        jobs = list(self._jobs.values())
+        return {
+            QUEUED: sum(1 for job in jobs if job.status == QUEUED),
+            RUNNING: sum(1 for job in jobs if job.status == RUNNING),
+        }
+
+    def _save(self, job: Job) -> None:
+        """Record the job's status in the store, if there is one."""
+        if self.store is None:
+            return
+        try:
+            saved = self.store.save(job, self.owner)
+        except sqlite3.Error:
+            _LOGGER.warning("Failed to save job %s", job.id, exc_info=True)
+            return
+        if not saved and not job.done and job._future is not None:
+            # This process stalled past its lease and another one took over
+            _LOGGER.warning("Job %s is now run by another process", job.id)
+            job._future.cancel()
+
+    def _retry_after(self, pending: int) -> float:
+        """Estimate when a slot frees up, from the recent job durations."""
+        backlog = pending - self.max_workers + 1
+        return self._average_duration * max(backlog, 1) / self.max_workers
+
+    def _prune(self) -> None:
+        """Forget finished jobs that are past their retention period."""
+        cutoff = time.time() - JOB_RETENTION_SECONDS
+        expired = [
+            job.id
+            for job in self._jobs.values()
+            if job.finished_at is not None and job.finished_at < cutoff
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    async def _run(self, job: Job) -> None:
+        try:
+            await self._admit(job)
+        except asyncio.CancelledError:
+            job.status = CANCELLED
+            job.node = None
+            job.finished_at = time.time()
+            job.add_event({"event": "cancelled"})
+            await asyncio.to_thread(self._save, job)
+            _LOGGER.info("Cancelled job %s", job.id)
+            raise
+        finally:
+            jobs_finished.inc(job.status)
+            if job.started_at is not None:
+                job_seconds.observe(job.finished_at - job.started_at)
+
+    async def _admit(self, job: Job) -> None:
+        cached = None
+        if not job.force_refresh:
+            # Looked up once, off the event loop, and handed down to the run
+            cached = await asyncio.to_thread(
+                get_report, job.topic, job.report_structure
+            )
+        if cached:
+            # Cached reports are replayed at once, without waiting for a slot
+            await self._generate(job, cached)
+            return
+        async with self._slots:
+            await self._generate(job, None)
+        if job.status == COMPLETED:
+            duration = job.finished_at - job.started_at
+            self._average_duration += 0.2 * (duration - self._average_duration)
+
+    async def _generate(self, job: Job, cached: dict[str, Any] | None) -> None:
+        job.status = RUNNING
+        job.started_at = time.time()
+        await asyncio.to_thread(self._save, job)
+        try:
+            await self._stream(job, cached)
+            if job.report is None:
+                raise RuntimeError("Failed to generate report")
+            job.status = COMPLETED
+            _LOGGER.info("Finished job %s", job.id)
+        except Exception as e:
+            _LOGGER.exception("Job %s failed", job.id)
+            job.error = str(e)
+            job.status = FAILED
+            job.add_event({"event": "error", "error": job.error})
+        finally:
+            job.node = None
+            job.finished_at = time.time()
+            await asyncio.to_thread(self._save, job)
+
+    async def _stream(self, job: Job, cached: dict[str, Any] | None) -> None:
+        async for event in astream_run(
+            job.topic,
+            job.report_structure,
+            cached,
+            generate=self.pool.astream if self.pool else None,
+        ):
+            if event["event"] == "node_started":
+                job.node = event["node"]
+                await asyncio.to_thread(self._save, job)
+            elif event["event"] == "coalesced":
+                job.coalesced = True
+            elif event["event"] == "report":
+                job.report = event["report"]
+            elif event["event"] == "usage":
+                job.usage = event["usage"]
+                continue
+            elif event["event"] == "trace":
+                job.trace = event["trace"]
+                continue
+            elif self.store is not None:
+                await asyncio.to_thread(self._store_progress, job, event)
+            job.add_event(event)
+
+    def _store_progress(self, job: Job, event: dict[str, Any]) -> None:
+        """Record the report plan and finished sections as they arrive."""
+        assert self.store is not None
+        try:
+            if event["event"] == "plan":
+                self.store.save_plan(job.id, event["title"], event["sections"])
+            elif event["event"] == "section":
+                self.store.save_section(
+                    job.id, event["index"], event["name"], event["content"]
+                )
+        except sqlite3.Error:
+            _LOGGER.warning("Failed to save progress of job %s", job.id, exc_info=True)
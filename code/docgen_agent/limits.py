@@ -0,0 +1,279 @@
+"""Global caps on concurrent LLM and Tavily calls.
+
+Every report fans out into many section writers, each making its own LLM
+calls and searches. The caps in this module are shared by every report on
+the event loop, so a burst of reports (a batch, say) queues for the model
+and the search API instead of overrunning their rate limits. Searches are
+also held to a rate, which backs off when Tavily answers 429, and are
+queued fairly between runs. With worker processes, each process has its own
+caps.
+"""
+
+import asyncio
+import itertools
+import logging
+import os
+import time
+from collections import deque
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from typing import Any, Iterator
+
+from langchain_core.runnables import Runnable, RunnableConfig
+from langchain_core.runnables.config import merge_configs
+
+from . import llm_cache, tracing, usage
+from .metrics import Callback, llm_errors, llm_seconds
+from .ratelimit import TokenBucket
+
+_LOGGER = logging.getLogger(__name__)
+
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", "8"))
+SEARCH_CONCURRENCY = int(os.getenv("SEARCH_CONCURRENCY", "8"))
+SEARCH_RATE_PER_SECOND = float(os.getenv("SEARCH_RATE_PER_SECOND", "5"))
+SEARCH_MIN_RATE_PER_SECOND = float(os.getenv("SEARCH_MIN_RATE_PER_SECOND", "0.2"))
+
+
+class CallLimit:
+    """Cap how many calls of one kind are in flight at a time.
+
+    Use it as an async context manager around each call.
+    """
+
+    def __init__(self, name: str, limit: int):
+        self.name = name
+        self.limit = limit
+        self.in_flight = 0
+        self.waiting = 0
+        self._semaphore = asyncio.Semaphore(limit)
+
+    async def __aenter__(self) -> None:
+        self.waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        self.in_flight += 1
+
+    async def __aexit__(self, *exc_info: Any) -> None:
+        self.in_flight -= 1
+        self._semaphore.release()
+
+    def stats(self) -> dict[str, Any]:
+        """How many calls are running and how many are waiting for a slot."""
+        return {
+            "name": self.name,
+            "limit": self.limit,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+        }
+
+
+_run_ids = itertools.count(1)
+_run: ContextVar[int | None] = ContextVar("search_run", default=None)
+
+
+@contextmanager
+def fair_queue() -> Iterator[None]:
+    """Queue the searches made within the block, and its tasks, as one run's."""
+    token = _run.set(next(_run_ids))
+    try:
+        yield
+    finally:
+        try:
+            _run.reset(token)
+        except ValueError:
+            # An abandoned async generator is closed in another context
+            pass
+
+
+class SearchScheduler:
+    """Cap concurrent searches and their rate, sharing them fairly between runs.
+
+    At most limit searches are in flight, and they start at no more than
+    rate per second. Searches waiting for a slot are queued per run (see
+    fair_queue) and the runs are served round robin, so one big report
+    cannot starve the others. Each 429 from Tavily halves the rate, down to
+    min_rate, and pauses every search for the Retry-After it asked for; each
+    successful search wins a little of the rate back.
+
+    Use it as an async context manager around each search, and report how
+    the search went with throttle() or recover().
+    """
+
+    def __init__(self, name: str, limit: int, rate: float, min_rate: float):
+        self.name = name
+        self.limit = limit
+        self.max_rate = rate
+        self.min_rate = min(min_rate, rate)
+        self.in_flight = 0
+        # the searches waiting for a slot, by run, in round robin order
+        self._queues: dict[int | None, deque[asyncio.Future]] = {}
+        self._bucket = TokenBucket(max(1.0, rate), rate)
+        self._paused_until = 0.0
+
+    @property
+    def rate(self) -> float:
+        return self._bucket.rate
+
+    @property
+    def waiting(self) -> int:
+        return sum(len(queue) for queue in self._queues.values())
+
+    async def __aenter__(self) -> None:
+        if self.in_flight < self.limit and not self._queues:
+            self.in_flight += 1
+        else:
+            await self._wait_for_slot()
+        try:
+            await self._pace()
+        except BaseException:
+            self._release()
+            raise
+
+    async def __aexit__(self, *exc_info: Any) -> None:
+        self._release()
+
+    async def _wait_for_slot(self) -> None:
+        run = _run.get()
+        slot = asyncio.get_running_loop().create_future()
+        self._queues.setdefault(run, deque()).append(slot)
+        try:
+            await slot
+        except asyncio.CancelledError:
+            if slot.done() and not slot.cancelled():
+                # Cancelled just after being handed a slot
+                self._release()
+            else:
+                queue = self._queues[run]
+                queue.remove(slot)
+                if not queue:
+                    del self._queues[run]
+            raise
+
+    def _release(self) -> None:
+        """Free a slot, handing it to the next run in turn."""
+        self.in_flight -= 1
+        while self.in_flight < self.limit and self._queues:
+            run, queue = next(iter(self._queues.items()))
+            del self._queues[run]
+            slot = queue.popleft()
+            if queue:
+                # The run goes to the back of the line
+                self._queues[run] = queue
+            self.in_flight += 1
+            slot.set_result(None)
+
+    async def _pace(self) -> None:
+        """Wait for the next start allowed by the rate and any pause."""
+        wait = self._bucket.reserve(float("inf"))
+        wait = max(wait, self._paused_until - time.monotonic())
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def throttle(self, retry_after: float | None = None) -> None:
+        """Slow down after Tavily rejected a search as over its rate limit."""
+        self._bucket.rate = max(self.min_rate, self._bucket.rate / 2)
+        if retry_after:
+            self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+        _LOGGER.warning(
+            "Tavily rate limited a search, slowing down to %.2f searches per second",
+            self._bucket.rate,
+        )
+
+    def recover(self) -> None:
+        """Speed back up after a successful search."""
+        if self._bucket.rate < self.max_rate:
+            self._bucket.rate = min(
+                self.max_rate, self._bucket.rate + self.max_rate / 20
+            )
+
+    def stats(self) -> dict[str, Any]:
+        """How many searches are running and waiting, and the current rate."""
+        return {
+            "name": self.name,
+            "limit": self.limit,
+            "rate": self.rate,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "runs_waiting": len(self._queues),
+        }
+
+
+llm_calls = CallLimit("llm", LLM_CONCURRENCY)
+search_calls = SearchScheduler(
+    "search", SEARCH_CONCURRENCY, SEARCH_RATE_PER_SECOND, SEARCH_MIN_RATE_PER_SECOND
+)
+_LIMITS = (llm_calls, search_calls)
+
+Callback(
+    "docgen_calls_in_flight",
+    "LLM and Tavily calls currently running.",
+    lambda: {(limit.name,): limit.in_flight for limit in _LIMITS},
+    ("kind",),
+)
+Callback(
+    "docgen_calls_waiting",
+    "LLM and Tavily calls waiting for a free slot.",
+    lambda: {(limit.name,): limit.waiting for limit in _LIMITS},
+    ("kind",),
+)
+Callback(
+    "docgen_search_rate",
+    "Searches per second currently allowed to start.",
+    lambda: search_calls.rate,
+)
+
+
+def model_name(model: Runnable) -> str:
+    """The name of the chat model behind a model, bound tools or structured output."""
+    # with_structured_output chains the model with a parser
+    model = getattr(model, "first", model)
+    for attribute in ("model", "model_name"):
+        name = getattr(model, attribute, None)
+        if isinstance(name, str):
+            return name
+    return type(model).__name__
+
+
+def _text_size(message: Any) -> int:
+    """The length of a message's text, whether a dict, message or object."""
+    if isinstance(message, dict):
+        return len(str(message.get("content", "")))
+    return len(str(getattr(message, "content", message)))
+
+
+async def ainvoke_llm(
+    model: Runnable, messages: Any, config: RunnableConfig, retry: bool = False
+) -> Any:
+    """Invoke a chat model within the cap on concurrent LLM calls.
+
+    The call's latency, span and token usage are recorded as well. A retry
+    goes to the model even if the response it retries is cached.
+    """
+    name = model_name(model)
+    handler = usage.UsageHandler()
+    config = merge_configs(config, {"callbacks": [handler]})
+    with (
+        llm_cache.refresh() if retry else nullcontext(),
+        tracing.span(
+            "llm", "llm", model=name, prompt_chars=sum(map(_text_size, messages))
+        ) as span,
+    ):
+        async with llm_calls:
+            start = time.perf_counter()
+            try:
+                response = await model.ainvoke(messages, config)
+            except Exception:
+                llm_errors.inc(name)
+                raise
+            finally:
+                llm_seconds.observe(time.perf_counter() - start, name)
+                if handler.usage.calls:
+                    usage.record(name, handler.usage)
+        if span is not None:
+            span.args["queued_ms"] = (start - span.start) * 1000
+            span.args["response_chars"] = _text_size(response)
+            span.args["prompt_tokens"] = handler.usage.prompt_tokens
+            span.args["completion_tokens"] = handler.usage.completion_tokens
+        return response
@@ -0,0 +1,134 @@
+"""Exact-match cache of chat model responses.
+
+The models run at temperature 0, so a call with the same model, parameters,
+bound tools and messages gets the same response. Re-running a report,
+retrying one that failed late in the pipeline or iterating on one prompt
+would otherwise pay for all of those calls again. LLMCache plugs into
+LangChain's model cache (pass cache=llm_cache to a chat model) and keeps
+responses in a TieredCache, in memory and in data/llm_cache.sqlite.
+
+Cached responses cost nothing, so they are stored without their token usage
+and marked as cached; usage.UsageHandler does not count them as calls.
+Empty responses, and ones with malformed tool calls, are not cached, and a
+call retried within refresh() goes to the model again and replaces what was
+cached: otherwise a retry would only get the response it retries back.
+Set LLM_CACHE_TTL=0 to turn the cache off. While a cassette records or
+replays the calls (see docgen_agent.cassette), the models use it instead.
+"""
+
+import hashlib
+import json
+import logging
+import os
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Iterator, Sequence
+
+from langchain_core.caches import BaseCache
+from langchain_core.load import dumpd, load
+from langchain_core.outputs import ChatGeneration, Generation
+
+from . import cassette
+from .cache import TieredCache
+
+_LOGGER = logging.getLogger(__name__)
+
+LLM_CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", str(7 * 24 * 3600)))
+LLM_CACHE_MEMORY_ITEMS = int(os.getenv("LLM_CACHE_MEMORY_ITEMS", "512"))
+LLM_CACHE_MAX_BYTES = int(os.getenv("LLM_CACHE_MAX_BYTES", str(256 * 1024**2)))
+
+
+class LLMCache(BaseCache):
+    """A LangChain model cache over a TieredCache.
+
+    LangChain looks responses up by the serialized messages (the prompt) and
+    a string of the model's parameters and call arguments, which include
+    any bound tools or structured output schema. Entries are keyed on a hash
+    of both, leaving out the message ids, timings and usage that change from
+    one run to the next.
+    """
+
+    def __init__(self, cache: TieredCache, ttl: float = LLM_CACHE_TTL):
+        self.cache = cache
+        self.ttl = ttl
+
+    @staticmethod
+    def key(prompt: str, llm_string: str) -> str:
+        prompt = json.dumps(cassette.stable_prompt(prompt), sort_keys=True)
+        return hashlib.sha256(f"{llm_string}\n{prompt}".encode()).hexdigest()
+
+    def lookup(self, prompt: str, llm_string: str) -> Sequence[Generation] | None:
+        """Return the cached generations of a call, if there are fresh ones."""
+        if _refreshing.get():
+            return None
+        value = self.cache.get(self.key(prompt, llm_string))
+        if value is None:
+            return None
+        _LOGGER.debug("LLM cache hit")
+        return [load(generation, allowed_objects="core") for generation in value]
+
+    def update(
+        self, prompt: str, llm_string: str, return_val: Sequence[Generation]
+    ) -> None:
+        """Cache the generations of a call, without their token usage."""
+        if not all(map(_usable, return_val)):
+            _LOGGER.debug("Not caching an empty or malformed LLM response")
+            return
+        self.cache.set(
+            self.key(prompt, llm_string),
+            [_cached(generation) for generation in return_val],
+            self.ttl,
+        )
+
+    def clear(self, **kwargs: Any) -> None:
+        """Drop every cached response."""
+        self.cache.clear()
+
+
+_refreshing: ContextVar[bool] = ContextVar("llm_cache_refreshing", default=False)
+
+
+@contextmanager
+def refresh() -> Iterator[None]:
+    """Send the calls of the block, and its tasks, to the model, not the cache."""
+    token = _refreshing.set(True)
+    try:
+        yield
+    finally:
+        _refreshing.reset(token)
+
+
+def _usable(generation: Generation) -> bool:
+    """Whether a generation is worth answering the same call with again."""
+    if not isinstance(generation, ChatGeneration):
+        return bool(generation.text)
+    message = generation.message
+    if getattr(message, "invalid_tool_calls", None):
+        return False
+    return bool(message.content or getattr(message, "tool_calls", None))
+
+
+def _cached(generation: Generation) -> dict[str, Any]:
+    """Serialize a generation, marking its message as a cached response."""
+    serialized = dumpd(generation)
+    message = serialized.get("kwargs", {}).get("message")
+    if message is not None:
+        message["kwargs"].pop("usage_metadata", None)
+        metadata = message["kwargs"].setdefault("response_metadata", {})
+        metadata["cached"] = True
+    return serialized
+
+
+llm_cache: BaseCache | None
+if cassette.cassette is not None:
+    llm_cache = cassette.CassetteLLMCache(cassette.cassette)
+elif LLM_CACHE_TTL > 0:
+    llm_cache = LLMCache(
+        TieredCache(
+            "llm_cache",
+            max_memory_items=LLM_CACHE_MEMORY_ITEMS,
+            max_disk_bytes=LLM_CACHE_MAX_BYTES,
+        )
+    )
+else:
+    llm_cache = None
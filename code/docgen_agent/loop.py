@@ -0,0 +1,86 @@
+"""A long-lived event loop for running reports from synchronous code.
+
+Creating an event loop per report (asyncio.run) throws away everything bound
+to the loop: the HTTP connection pool of the Tavily client, keep-alive
+connections, DNS caches and TLS sessions. The loop in this module runs on a
+dedicated daemon thread for the life of the process instead, and synchronous
+callers such as the Flask handlers hand coroutines to it.
+"""
+
+import asyncio
+import logging
+import os
+import threading
+from concurrent.futures import Future
+from typing import Any, Awaitable, Coroutine, TypeVar
+
+_LOGGER = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class BackgroundLoop:
+    """An asyncio event loop running forever on its own thread."""
+
+    def __init__(self, name: str = "report-loop"):
+        self.name = name
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._pid: int | None = None
+        self._lock = threading.Lock()
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        """The running loop, started on first use."""
+        with self._lock:
+            # A forked child process does not inherit the loop thread
+            if self._loop is None or self._pid != os.getpid():
+                self._start()
+            assert self._loop is not None
+            return self._loop
+
+    def _start(self) -> None:
+        loop = asyncio.new_event_loop()
+        started = threading.Event()
+
+        def run() -> None:
+            asyncio.set_event_loop(loop)
+            loop.call_soon(started.set)
+            loop.run_forever()
+
+        thread = threading.Thread(target=run, name=self.name, daemon=True)
+        thread.start()
+        started.wait()
+        self._loop = loop
+        self._pid = os.getpid()
+        _LOGGER.info("Started background event loop %s", self.name)
+
+    def submit(self, coro: Coroutine[Any, Any, T]) -> Future[T]:
+        """Schedule a coroutine on the loop from any thread."""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro: Coroutine[Any, Any, T]) -> T:
+        """Run a coroutine on the loop and wait for its result."""
+        return self.submit(coro).result()
+
+
+background_loop = BackgroundLoop()
+
+
+def submit(coro: Coroutine[Any, Any, T]) -> Future[T]:
+    """Schedule a coroutine on the shared background loop."""
+    return background_loop.submit(coro)
+
+
+async def gather(*aws: Awaitable[T]) -> list[T]:
+    """Like asyncio.gather, but cancel the others as soon as one fails.
+
+    Cancelling the caller cancels every awaitable as well, so nothing keeps
+    running, and spending quota, after the work it was part of has stopped.
+    """
+    tasks = [asyncio.ensure_future(aw) for aw in aws]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
@@ -0,0 +1,220 @@
+"""Metrics in the Prometheus text exposition format.
+
+Counters and histograms are recorded into per-thread shards, so recording a
+value never takes a lock or contends with other threads; the shards are only
+summed up when the metrics are rendered. Values that already live elsewhere,
+such as queue depths and cache hit counts, are read by callbacks at render
+time instead.
+
+With worker processes, each process records its own metrics and /metrics
+only shows those of the Flask process.
+"""
+
+import abc
+import bisect
+import math
+import threading
+from typing import Any, Callable, Iterator
+
+# Report nodes and LLM calls take seconds to minutes, searches around a second
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+Labels = tuple[str, ...]
+
+
+class _Metric(abc.ABC):
+    """A metric, with a name, help text and label names, in the registry."""
+
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames: Labels = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        _registry.append(self)
+
+    @abc.abstractmethod
+    def samples(self) -> Iterator[tuple[str, Labels, float]]:
+        """Yield the (suffix, label values, value) of every sample."""
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, labels, value in self.samples():
+            lines.append(f"{self.name}{suffix}{self._format_labels(labels)} {value:g}")
+        return "\n".join(lines)
+
+    def _format_labels(self, values: Labels) -> str:
+        pairs = [
+            f'{name}="{_escape(str(value))}"'
+            for name, value in zip(self.labelnames + ("le",), values)
+        ]
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _ShardedMetric(_Metric):
+    """A metric recorded into one shard per thread."""
+
+    def __init__(self, name: str, help: str, labelnames: Labels = ()):
+        super().__init__(name, help, labelnames)
+        self._local = threading.local()
+        self._shards: list[tuple[threading.Thread, dict[Labels, Any]]] = []
+        # shards of threads that have exited, folded together
+        self._retired: dict[Labels, Any] = {}
+        self._lock = threading.Lock()
+
+    def _shard(self) -> dict[Labels, Any]:
+        """The calling thread's shard; only this thread ever writes to it."""
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._local.shard = {}
+            # Registering a new thread is the only time a lock is taken
+            with self._lock:
+                self._shards.append((threading.current_thread(), shard))
+            return shard
+
+    @abc.abstractmethod
+    def _merge(self, into: dict[Labels, Any], shard: dict[Labels, Any]) -> None:
+        """Add the values of shard into into."""
+
+    def _collect(self) -> dict[Labels, Any]:
+        """Sum up every shard, retiring those of exited threads."""
+        with self._lock:
+            live = []
+            for thread, shard in self._shards:
+                if thread.is_alive():
+                    live.append((thread, shard))
+                else:
+                    self._merge(self._retired, shard)
+            self._shards = live
+            total: dict[Labels, Any] = {}
+            self._merge(total, self._retired)
+            for _, shard in live:
+                # Copy first, the owning thread may add labels meanwhile
+                self._merge(total, dict(shard))
+        return total
+
+
+class Counter(_ShardedMetric):
+    """A count that only goes up."""
+
+    kind = "counter"
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        shard = self._shard()
+        shard[labels] = shard.get(labels, 0) + amount
+
+    def _merge(self, into: dict[Labels, Any], shard: dict[Labels, Any]) -> None:
+        for labels, value in shard.items():
+            into[labels] = into.get(labels, 0) + value
+
+    def samples(self) -> Iterator[tuple[str, Labels, float]]:
+        for labels, value in sorted(self._collect().items()):
+            yield "", labels, value
+
+
+class Histogram(_ShardedMetric):
+    """A distribution of observed values, such as latencies in seconds."""
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labelnames: Labels = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, help, labelnames)
+        self.buckets = buckets
+
+    def observe(self, value: float, *labels: str) -> None:
+        shard = self._shard()
+        counts = shard.get(labels)
+        if counts is None:
+            # one count per bucket, then +Inf, then the sum of the values
+            counts = shard[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def _merge(self, into: dict[Labels, Any], shard: dict[Labels, Any]) -> None:
+        for labels, counts in shard.items():
+            merged = into.setdefault(labels, [0] * len(counts))
+            for index, count in enumerate(list(counts)):
+                merged[index] += count
+
+    def samples(self) -> Iterator[tuple[str, Labels, float]]:
+        for labels, counts in sorted(self._collect().items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                le = "+Inf" if bound == math.inf else f"{bound:g}"
+                yield "_bucket", labels + (le,), cumulative
+            yield "_sum", labels, counts[-1]
+            yield "_count", labels, cumulative
+
+
+class Callback(_Metric):
+    """A metric whose values are read from elsewhere when rendered.
+
+    The callback returns the value, or a dict of label values to values.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        callback: Callable[[], float | dict[Labels, float]],
+        labelnames: Labels = (),
+        kind: str = "gauge",
+    ):
+        super().__init__(name, help, labelnames)
+        self.callback = callback
+        self.kind = kind
+
+    def samples(self) -> Iterator[tuple[str, Labels, float]]:
+        values = self.callback()
+        if not isinstance(values, dict):
+            values = {(): values}
+        for labels, value in sorted(values.items()):
+            yield "", labels, value
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+_registry: list[_Metric] = []
+
+
+def render() -> str:
+    """Render every registered metric in the Prometheus text format."""
+    return "\n".join(metric.render() for metric in _registry) + "\n"
+
+
+node_seconds = Histogram(
+    "docgen_node_duration_seconds",
+    "Time spent in each LangGraph node.",
+    ("graph", "node"),
+)
+node_errors = Counter(
+    "docgen_node_errors_total",
+    "LangGraph node runs that raised an exception.",
+    ("graph", "node"),
+)
+llm_seconds = Histogram(
+    "docgen_llm_duration_seconds", "Latency of LLM calls.", ("model",)
+)
+llm_errors = Counter("docgen_llm_errors_total", "LLM calls that failed.", ("model",))
+llm_tokens = Counter(
+    "docgen_llm_tokens_total",
+    "LLM tokens used, by model and kind (prompt, completion, or cached prompt).",
+    ("model", "kind"),
+)
+llm_cost = Counter(
+    "docgen_llm_cost_dollars_total", "Cost of the LLM tokens used.", ("model",)
+)
+search_seconds = Histogram(
+    "docgen_search_duration_seconds", "Latency of Tavily searches."
+)
+search_errors = Counter("docgen_search_errors_total", "Tavily searches that failed.")
@@ -0,0 +1,135 @@
+"""Fold the search queries of a run into a budget of distinct searches.
+
+The queries the models write for one report overlap heavily: "X 2024
+benchmarks" and "benchmarks of X in 2024" ask for the same thing, and
+exact-match caching treats them as different searches. Queries are compared
+on their terms instead (case folded, stopwords dropped, plurals trimmed and
+order ignored). A query whose terms are at least QUERY_SIMILARITY (token
+Jaccard) alike to one already searched in the run is served by that search.
+
+Each run may also search for at most QUERY_BUDGET distinct queries. Past the
+budget, a query is served by the most alike earlier search, or dropped if
+none shares a term with it.
+"""
+
+import logging
+import os
+import re
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator
+
+from . import usage
+
+_LOGGER = logging.getLogger(__name__)
+
+QUERY_BUDGET = int(os.getenv("QUERY_BUDGET", "50"))
+QUERY_SIMILARITY = float(os.getenv("QUERY_SIMILARITY", "0.75"))
+
+_WORD = re.compile(r"\w+")
+_STOPWORDS = frozenset(
+    "a about after an and are as at be before between by can do does for from"
+    " how in into is it its more most of on or over than that the their this"
+    " to under vs versus was what when where which who why will with".split()
+)
+
+
+def query_terms(query: str) -> frozenset[str]:
+    """The terms of a query that say what it is about."""
+    terms = set()
+    for word in _WORD.findall(query.casefold()):
+        if word in _STOPWORDS:
+            continue
+        if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+            word = word[:-1]
+        terms.add(word)
+    return frozenset(terms)
+
+
+def normalize_query(query: str) -> str:
+    """A form of query that is the same for rephrasings with the same terms."""
+    terms = query_terms(query)
+    if not terms:
+        return " ".join(query.casefold().split())
+    return " ".join(sorted(terms))
+
+
+def jaccard(a: frozenset[str], b: frozenset[str]) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+class QueryPlanner:
+    """Choose the searches for the queries of one run."""
+
+    def __init__(
+        self, budget: int = QUERY_BUDGET, similarity: float = QUERY_SIMILARITY
+    ):
+        self.budget = budget
+        self.similarity = similarity
+        # the queries searched so far, with their terms
+        self.searches: list[tuple[str, frozenset[str]]] = []
+
+    def plan(self, queries: list[str]) -> list[str]:
+        """Return the distinct searches that serve queries, in order."""
+        searches: list[str] = []
+        for query in queries:
+            search = self._search_for(query)
+            if search is not None and search not in searches:
+                searches.append(search)
+        return searches
+
+    def _search_for(self, query: str) -> str | None:
+        terms = query_terms(query)
+        closest, similarity = None, 0.0
+        for search, search_terms in self.searches:
+            if search == query:
+                return search
+            score = jaccard(terms, search_terms)
+            if score > similarity:
+                closest, similarity = search, score
+
+        if closest is not None and similarity >= self.similarity:
+            _LOGGER.info("Merging query %r into %r", query, closest)
+            usage.record_search("merged")
+            return closest
+        if len(self.searches) < self.budget:
+            self.searches.append((query, terms))
+            return query
+
+        usage.record_search("over_budget")
+        if closest is None:
+            _LOGGER.info("Dropping query %r, the search budget is spent", query)
+        else:
+            _LOGGER.info(
+                "Serving query %r with %r, the search budget is spent", query, closest
+            )
+        return closest
+
+
+_planner: ContextVar[QueryPlanner | None] = ContextVar("query_planner", default=None)
+
+
+@contextmanager
+def plan_queries() -> Iterator[QueryPlanner]:
+    """Plan the searches made within the block, and its tasks, as one run's."""
+    planner = QueryPlanner()
+    token = _planner.set(planner)
+    try:
+        yield planner
+    finally:
+        try:
+            _planner.reset(token)
+        except ValueError:
+            # An abandoned async generator is closed in another context
+            pass
+
+
+def plan(queries: list[str]) -> list[str]:
+    """Return the searches for queries, planned with the run's earlier ones.
+
+    Outside of a run, only the duplicates among queries themselves merge.
+    """
+    planner = _planner.get() or QueryPlanner()
+    return planner.plan(queries)
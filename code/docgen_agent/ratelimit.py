@@ -0,0 +1,154 @@
+"""Per-client rate limiting for report requests.
+
+Each client gets a token bucket that holds up to a burst of requests and
+refills at a steady rate. A request that finds the bucket empty may wait in
+a short admission queue for its turn instead of being rejected outright.
+
+Clients are told apart by their X-API-Key header only if the key is listed
+in RATE_LIMIT_API_KEYS (comma separated), and otherwise by their address,
+so that a client cannot get a fresh bucket by sending a new key.
+"""
+
+import abc
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+_LOGGER = logging.getLogger(__name__)
+
+RATE_LIMITER = os.getenv("RATE_LIMITER", "token_bucket")
+RATE_LIMIT_BURST = int(os.getenv("RATE_LIMIT_BURST", "3"))
+RATE_LIMIT_PER_MINUTE = float(os.getenv("RATE_LIMIT_PER_MINUTE", "6"))
+RATE_LIMIT_QUEUE_SECONDS = float(os.getenv("RATE_LIMIT_QUEUE_SECONDS", "5"))
+RATE_LIMIT_MAX_WAITING = int(os.getenv("RATE_LIMIT_MAX_WAITING", "16"))
+RATE_LIMIT_MAX_CLIENTS = 10000
+RATE_LIMIT_API_KEYS = frozenset(
+    key.strip()
+    for key in os.getenv("RATE_LIMIT_API_KEYS", "").split(",")
+    if key.strip()
+)
+
+
+class RateLimiter(abc.ABC):
+    """Admission control for report requests, keyed by client."""
+
+    @abc.abstractmethod
+    def acquire(self, key: str, cost: int = 1) -> float:
+        """Admit a request from the client identified by key.
+
+        The request takes cost tokens, such as one per report of a batch.
+
+        Returns:
+            0 if the request was admitted, otherwise the number of seconds
+            the client should wait before retrying.
+        """
+
+
+class NoRateLimiter(RateLimiter):
+    """Admit every request."""
+
+    def acquire(self, key: str, cost: int = 1) -> float:
+        return 0
+
+
+class TokenBucket:
+    """A bucket of up to capacity tokens, refilled at rate tokens per second."""
+
+    def __init__(self, capacity: float, rate: float):
+        self.capacity = capacity
+        self.rate = rate
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def reserve(self, max_wait: float, cost: int = 1) -> float:
+        """Take cost tokens, borrowing against the refill if need be.
+
+        A cost above the capacity is let through once the bucket is full,
+        leaving it in debt until the refill has paid for the rest.
+
+        Returns:
+            How long the caller has to wait before using its token, or a
+            negative number (the time until a token is free) if that wait
+            would exceed max_wait and nothing was taken.
+        """
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+        wait = max(0.0, (min(cost, self.capacity) - self.tokens) / self.rate)
+        if wait > max_wait:
+            return -wait
+        # A negative balance queues the caller behind earlier borrowers
+        self.tokens -= cost
+        return wait
+
+    @property
+    def full(self) -> bool:
+        elapsed = time.monotonic() - self.updated
+        return self.tokens + elapsed * self.rate >= self.capacity
+
+
+class TokenBucketLimiter(RateLimiter):
+    """Limit each client to a burst of requests and a steady refill rate."""
+
+    def __init__(
+        self,
+        burst: int = RATE_LIMIT_BURST,
+        per_minute: float = RATE_LIMIT_PER_MINUTE,
+        queue_seconds: float = RATE_LIMIT_QUEUE_SECONDS,
+        max_waiting: int = RATE_LIMIT_MAX_WAITING,
+    ):
+        self.burst = burst
+        self.rate = per_minute / 60
+        self.queue_seconds = queue_seconds
+        self.max_waiting = max_waiting
+        self._buckets: OrderedDict[str, TokenBucket] = OrderedDict()
+        self._waiting = 0
+        self._lock = threading.Lock()
+
+    def acquire(self, key: str, cost: int = 1) -> float:
+        with self._lock:
+            bucket = self._bucket(key)
+            max_wait = self.queue_seconds
+            if self._waiting >= self.max_waiting:
+                # The admission queue is full, only admit without waiting
+                max_wait = 0
+            wait = bucket.reserve(max_wait, cost)
+            if wait < 0:
+                return -wait
+            if wait > 0:
+                self._waiting += 1
+
+        if wait > 0:
+            _LOGGER.info("Queueing request from %s for %.1f seconds", key, wait)
+            time.sleep(wait)
+            with self._lock:
+                self._waiting -= 1
+        return 0
+
+    def _bucket(self, key: str) -> TokenBucket:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(self.burst, self.rate)
+            self._evict()
+        self._buckets.move_to_end(key)
+        return bucket
+
+    def _evict(self) -> None:
+        """Drop idle clients once too many are tracked."""
+        while len(self._buckets) > RATE_LIMIT_MAX_CLIENTS:
+            key, bucket = next(iter(self._buckets.items()))
+            if not bucket.full:
+                break
+            del self._buckets[key]
+
+
+def create_rate_limiter(name: str = RATE_LIMITER) -> RateLimiter:
+    """Create the rate limiter selected by name ("token_bucket" or "none")."""
+    if name == "none":
+        return NoRateLimiter()
+    if name == "token_bucket":
+        return TokenBucketLimiter()
+    raise ValueError(f"Unknown rate limiter: {name}")
@@ -0,0 +1,80 @@
+"""Cache of finished reports, keyed on the normalized request.
+
+Resubmitting the same topic with the same report structure would otherwise
+pay for the whole pipeline again: the planner, every section writer and all
+of their searches.
+"""
+
+import hashlib
+import json
+import os
+import re
+from typing import Any
+
+from . import agent, cassette, query_planner, sources, tools
+from .cache import TieredCache
+
+REPORT_CACHE_TTL = int(os.getenv("REPORT_CACHE_TTL", str(7 * 24 * 3600)))
+REPORT_CACHE_NEWS_TTL = int(os.getenv("REPORT_CACHE_NEWS_TTL", str(3 * 3600)))
+REPORT_CACHE_MEMORY_ITEMS = int(os.getenv("REPORT_CACHE_MEMORY_ITEMS", "64"))
+REPORT_CACHE_MAX_BYTES = int(os.getenv("REPORT_CACHE_MAX_BYTES", str(64 * 1024**2)))
+
+# Topics about current events go stale much faster than evergreen ones
+_NEWS_PATTERN = re.compile(
+    r"\b(news|latest|today|tonight|yesterday|this (week|month)|breaking|"
+    r"current|recent|upcoming|live|update[sd]?)\b",
+    re.IGNORECASE,
+)
+
+report_cache = TieredCache(
+    "report_cache",
+    max_memory_items=REPORT_CACHE_MEMORY_ITEMS,
+    max_disk_bytes=REPORT_CACHE_MAX_BYTES,
+)
+
+
+def _normalize(text: str) -> str:
+    """Collapse case and whitespace, which do not change the report."""
+    return " ".join(text.casefold().split())
+
+
+def report_key(topic: str, report_structure: str) -> str:
+    """Hash a report request, along with every setting that shapes its output."""
+    request = {
+        "topic": _normalize(topic).rstrip(".?!"),
+        "report_structure": _normalize(report_structure),
+        "model": agent.llm.model,
+        "queries_per_section": agent._QUERIES_PER_SECTION,
+        "max_results": tools.MAX_RESULTS,
+        "include_raw_content": tools.INCLUDE_RAW_CONTENT,
+        "max_tokens_per_source": tools.MAX_TOKENS_PER_SOURCE,
+        "max_tokens_per_search": tools.MAX_TOKENS_PER_SEARCH,
+        "corpus_max_tokens": tools.CORPUS_MAX_TOKENS,
+        "search_days": tools.SEARCH_DAYS,
+        "query_budget": query_planner.QUERY_BUDGET,
+        "query_similarity": query_planner.QUERY_SIMILARITY,
+        "source_similarity": sources.SOURCE_SIMILARITY,
+    }
+    encoded = json.dumps(request, sort_keys=True).encode()
+    return hashlib.sha256(encoded).hexdigest()
+
+
+def report_ttl(topic: str) -> int:
+    """How long a report on topic stays fresh, in seconds."""
+    if _NEWS_PATTERN.search(topic):
+        return REPORT_CACHE_NEWS_TTL
+    return REPORT_CACHE_TTL
+
+
+def get_report(topic: str, report_structure: str) -> dict[str, Any] | None:
+    """Return the cached report for the request, if there is a fresh one."""
+    if cassette.active():
+        return None
+    return report_cache.get(report_key(topic, report_structure))
+
+
+def set_report(topic: str, report_structure: str, report: dict[str, Any]) -> None:
+    """Cache a finished report, given as its title, sections and document."""
+    if cassette.active():
+        return
+    report_cache.set(report_key(topic, report_structure), report, report_ttl(topic))
@@ -1,4 +1,3 @@
-import json
 import logging
 from typing import Annotated, Any, Sequence
 
@@ -9,12 +8,16 @@ from langgraph.graph.message import add_messages
 from pydantic import BaseModel
 
 from . import tools
+from .corpus import ResearchCorpus
+from .instrument import instrument_node
+from .limits import ainvoke_llm
+from .llm_cache import llm_cache
 from .prompts import research_prompt
 
 _LOGGER = logging.getLogger(__name__)
 _MAX_LLM_RETRIES = 3
 
-llm = ChatNVIDIA(model="meta/llama-3.3-70b-instruct", temperature=0)
+llm = ChatNVIDIA(model="meta/llama-3.3-70b-instruct", temperature=0, cache=llm_cache)
 llm_with_tools = llm.bind_tools([tools.search_tavily])
 
 
@@ -24,25 +27,32 @@ class ResearcherState(BaseModel):
     number_of_queries: int = 5
     # how many searches should be done per topic?
     messages: Annotated[Sequence[Any], add_messages] = []
-    # a chat log of the research results
+    # a chat log of the research
+    corpus: ResearchCorpus = ResearchCorpus()
+    # the sources found by the research
 
 
 async def tool_node(state: ResearcherState):
     _LOGGER.info("Executing tool calls.")
     outputs = []
+    corpus = state.corpus
     for tool_call in state.messages[-1].tool_calls:
         _LOGGER.info("Executing tool call: %s", tool_call["name"])
-        tool = getattr(tools, tool_call["name"])
-        tool_result = await tool.ainvoke(tool_call["args"])
+        if tool_call["name"] == tools.search_tavily.name:
+            # The sources go in the state, the model is told which were found
+            corpus, content = await tools.search_corpus(corpus, tool_call["args"])
+        else:
+            tool = getattr(tools, tool_call["name"])
+            content = str(await tool.ainvoke(tool_call["args"]))
         outputs.append(
             {
                 "role": "tool",
-                "content": json.dumps(tool_result),
+                "content": content,
                 "name": tool_call["name"],
                 "tool_call_id": tool_call["id"],
             }
         )
-    return {"messages": outputs}
+    return {"messages": outputs, "corpus": corpus}
 
 
 async def call_model(
@@ -50,13 +60,16 @@ async def call_model(
     config: RunnableConfig,
 ) -> dict[str, Any]:
     _LOGGER.info("Calling model.")
-    system_prompt = research_prompt.format(
-        topic=state.topic, number_of_queries=state.number_of_queries
+    system_prompt = tools.with_sources(
+        research_prompt.format(
+            topic=state.topic, number_of_queries=state.number_of_queries
+        ),
+        state.corpus,
     )
 
     for count in range(_MAX_LLM_RETRIES):
         messages = [{"role": "system", "content": system_prompt}] + list(state.messages)
-        response = await llm_with_tools.ainvoke(messages, config)
+        response = await ainvoke_llm(llm_with_tools, messages, config, retry=count > 0)
 
         if response:
             return {"messages": [response]}
@@ -77,8 +90,8 @@ def has_tool_calls(state: ResearcherState) -> bool:
 
 workflow = StateGraph(ResearcherState)
 
-workflow.add_node("agent", call_model)
-workflow.add_node("tools", tool_node)
+workflow.add_node("agent", instrument_node("researcher", "agent", call_model))
+workflow.add_node("tools", instrument_node("researcher", "tools", tool_node))
 
 workflow.add_edge(START, "agent")
 workflow.add_conditional_edges(
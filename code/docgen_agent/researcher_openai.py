@@ -14,6 +14,8 @@ from langgraph.graph.message import add_messages
 from pydantic import BaseModel
 
 from . import tools
+from .instrument import instrument_node
+from .llm_cache import llm_cache
 from .prompts import researcher_instructions
 
 _LOGGER = logging.getLogger(__name__)
@@ -26,6 +28,7 @@ llm = ChatOpenAI(
     model="gpt-4o-mini",  # Using GPT-4o-mini for cost efficiency
     temperature=0,
     api_key=os.getenv("OPENAI_API_KEY"),
+    cache=llm_cache,
 )
 
 
@@ -52,7 +55,7 @@ async def research_model(state: ResearcherState, config: RunnableConfig):
     search_results = []
     for query in research_queries:
         try:
-            result = await tools.search_tavily([query])
+            result = await tools.search_tavily.ainvoke({"queries": [query]})
             search_results.append(result)
         except Exception as e:
             _LOGGER.warning(f"Search failed for query '{query}': {e}")
@@ -74,7 +77,9 @@ async def research_model(state: ResearcherState, config: RunnableConfig):
 workflow = StateGraph(ResearcherState)
 
 # Add nodes
-workflow.add_node("researcher", research_model)
+workflow.add_node(
+    "researcher", instrument_node("researcher", "researcher", research_model)
+)
 
 # Add edges
 workflow.add_edge(START, "researcher")
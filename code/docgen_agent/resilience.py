@@ -0,0 +1,164 @@
+"""Retries and circuit breaking for calls to flaky external services.
+
+retry() re-runs a failed call after an exponentially growing, fully
+jittered delay, so that callers that failed together do not retry together.
+A CircuitBreaker counts consecutive failures of a service, guarding each
+call right before it is made. Once too many have failed it opens, and calls
+fail fast with CircuitOpenError instead of waiting on a service that is
+down. After reset_seconds it lets one trial
+call through, and closes again if that call succeeds.
+"""
+
+import asyncio
+import logging
+import random
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Iterator, TypeVar
+
+from .metrics import Callback
+
+_LOGGER = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a service whose circuit breaker is open."""
+
+
+class CircuitBreaker:
+    """Fail fast while a service keeps failing."""
+
+    def __init__(self, name: str, failure_threshold: int, reset_seconds: float):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        # consecutive failures
+        self.opened_at: float | None = None
+        self._trial = False
+        _breakers.append(self)
+
+    @property
+    def state(self) -> str:
+        """closed, open or half_open (waiting on a trial call)."""
+        if self.opened_at is None:
+            return "closed"
+        if self._trial or time.monotonic() - self.opened_at >= self.reset_seconds:
+            return "half_open"
+        return "open"
+
+    def check(self) -> bool:
+        """Raise CircuitOpenError unless a call may go through now.
+
+        Returns whether the call is the trial call of a half open circuit.
+        """
+        state = self.state
+        if state == "closed":
+            return False
+        if state == "half_open" and not self._trial:
+            _LOGGER.info("Trying %s again", self.name)
+            self._trial = True
+            return True
+        raise CircuitOpenError(f"{self.name} is failing, not calling it for now")
+
+    @contextmanager
+    def guard(self, outage: Callable[[BaseException], bool]) -> Iterator[None]:
+        """Check the circuit before the call in the block, then record its outcome.
+
+        Errors for which outage returns true count as failures of the service;
+        any other outcome shows that it is up.
+        """
+        trial = self.check()
+        try:
+            yield
+        except asyncio.CancelledError:
+            if trial:
+                self.cancel_trial()
+            raise
+        except Exception as e:
+            if outage(e):
+                self.record_failure()
+            else:
+                self.record_success()
+            raise
+        else:
+            self.record_success()
+
+    def record_success(self) -> None:
+        if self.opened_at is not None:
+            _LOGGER.info("%s recovered, closing its circuit", self.name)
+        self.failures = 0
+        self.opened_at = None
+        self._trial = False
+
+    def cancel_trial(self) -> None:
+        """Let another call try, as a cancelled trial call tells nothing."""
+        self._trial = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self._trial or self.failures >= self.failure_threshold:
+            if self.opened_at is None or self._trial:
+                _LOGGER.warning(
+                    "%s failed %d times in a row, opening its circuit",
+                    self.name,
+                    self.failures,
+                )
+            self.opened_at = time.monotonic()
+            self._trial = False
+
+
+@dataclass
+class RetryPolicy:
+    attempts: int = 3
+    # including the first
+    base_delay: float = 0.5
+    # seconds before the first retry, doubled for each one after
+    max_delay: float = 8.0
+
+    def delay(self, retry: int) -> float:
+        """A fully jittered delay before the given retry, counting from 0."""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2**retry))
+
+
+async def retry(
+    fn: Callable[[], Awaitable[T]],
+    policy: RetryPolicy,
+    retryable: Callable[[BaseException], bool],
+    retry_after: Callable[[BaseException], float | None] = lambda error: None,
+) -> T:
+    """Await fn(), calling it again after retryable errors.
+
+    Other errors, and the last one, are raised. retry_after may read a
+    minimum delay from an error, such as its Retry-After.
+    """
+    attempt = 0
+    while True:
+        try:
+            return await fn()
+        except Exception as e:
+            attempt += 1
+            if not retryable(e) or attempt == policy.attempts:
+                raise
+            delay = max(policy.delay(attempt - 1), retry_after(e) or 0)
+            _LOGGER.info(
+                "Retrying in %.1f seconds after %s (attempt %d of %d)",
+                delay,
+                type(e).__name__,
+                attempt,
+                policy.attempts,
+            )
+            await asyncio.sleep(delay)
+
+
+_breakers: list[CircuitBreaker] = []
+
+Callback(
+    "docgen_circuit_open",
+    "Whether a circuit breaker is failing calls fast (1) or not (0).",
+    lambda: {(breaker.name,): int(breaker.state == "open") for breaker in _breakers},
+    ("name",),
+)
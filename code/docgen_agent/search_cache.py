@@ -0,0 +1,137 @@
+"""Cache of Tavily search results, keyed on the normalized query.
+
+Sections of one report, and reports on related topics, often run the same
+query minutes apart. Each search takes a large share of a section's time and
+costs Tavily credits, so results are kept in a TieredCache, in memory and in
+data/search_cache.sqlite. Section writers run in parallel and their queries
+overlap, so identical searches that miss the cache at the same time share
+one request as well. Queries are normalized by query_planner, so
+rephrasings with the same terms share their results too.
+
+News results go stale within hours, general and finance ones far more
+slowly, so each topic has its own TTL. With SEARCH_CACHE_STALE_SECONDS, an
+expired result is still served for that long while a fresh one is fetched
+in the background.
+"""
+
+import asyncio
+import contextvars
+import hashlib
+import json
+import logging
+import os
+from typing import Any, Awaitable, Callable
+
+from . import cassette, usage
+from .cache import TieredCache
+from .query_planner import normalize_query
+from .singleflight import SingleFlight
+
+_LOGGER = logging.getLogger(__name__)
+
+SEARCH_CACHE_TTL = int(os.getenv("SEARCH_CACHE_TTL", str(24 * 3600)))
+SEARCH_CACHE_FINANCE_TTL = int(os.getenv("SEARCH_CACHE_FINANCE_TTL", str(6 * 3600)))
+SEARCH_CACHE_NEWS_TTL = int(os.getenv("SEARCH_CACHE_NEWS_TTL", "3600"))
+SEARCH_CACHE_STALE_SECONDS = int(os.getenv("SEARCH_CACHE_STALE_SECONDS", "0"))
+SEARCH_CACHE_MEMORY_ITEMS = int(os.getenv("SEARCH_CACHE_MEMORY_ITEMS", "1024"))
+SEARCH_CACHE_MAX_BYTES = int(os.getenv("SEARCH_CACHE_MAX_BYTES", str(128 * 1024**2)))
+
+_TTLS = {
+    "general": SEARCH_CACHE_TTL,
+    "finance": SEARCH_CACHE_FINANCE_TTL,
+    "news": SEARCH_CACHE_NEWS_TTL,
+}
+
+search_cache = TieredCache(
+    "search_cache",
+    max_memory_items=SEARCH_CACHE_MEMORY_ITEMS,
+    max_disk_bytes=SEARCH_CACHE_MAX_BYTES,
+    stale_seconds=SEARCH_CACHE_STALE_SECONDS,
+)
+
+search_flights = SingleFlight("search")
+
+# Background refreshes of stale results, by key
+_refreshing: dict[str, asyncio.Task] = {}
+
+
+def search_key(
+    query: str,
+    topic: str,
+    max_results: int,
+    include_raw_content: bool,
+    days: int | None,
+) -> str:
+    """Hash a search, along with every parameter that shapes its results."""
+    search = {
+        "query": normalize_query(query),
+        "topic": topic,
+        "max_results": max_results,
+        "include_raw_content": include_raw_content,
+        "days": days,
+    }
+    encoded = json.dumps(search, sort_keys=True).encode()
+    return hashlib.sha256(encoded).hexdigest()
+
+
+def search_ttl(topic: str) -> int:
+    """How long the results of a search on topic stay fresh, in seconds."""
+    return _TTLS.get(topic, SEARCH_CACHE_TTL)
+
+
+async def cached_search(
+    search: Callable[..., Awaitable[dict[str, Any]]], query: str, **kwargs: Any
+) -> dict[str, Any]:
+    """Return the cached results of search(query, **kwargs), else run it.
+
+    If an identical search is already running, its results are shared
+    instead. kwargs must hold the topic, max_results, include_raw_content
+    and days of the search.
+    """
+    key = search_key(query, **kwargs)
+    ttl = search_ttl(kwargs["topic"])
+    # A cassette records, or replays, every search
+    entry = None
+    if not cassette.active():
+        # The disk tier reads SQLite and decompresses, off the event loop
+        entry = await asyncio.to_thread(search_cache.lookup, key)
+    if entry is not None:
+        usage.record_search("cached")
+        if entry.expired:
+            _revalidate(key, ttl, search, query, kwargs)
+        return entry.value
+
+    async def fetch() -> dict[str, Any]:
+        response = await search(query, **kwargs)
+        if not cassette.active():
+            await asyncio.to_thread(search_cache.set, key, response, ttl)
+        return response
+
+    usage.record_search("coalesced" if search_flights.in_flight(key) else "calls")
+    return await search_flights.do(key, fetch)
+
+
+def _revalidate(
+    key: str,
+    ttl: int,
+    search: Callable[..., Awaitable[dict[str, Any]]],
+    query: str,
+    kwargs: dict[str, Any],
+) -> None:
+    """Fetch fresh results for a stale entry in the background, once."""
+    if key in _refreshing:
+        return
+
+    async def refresh() -> None:
+        try:
+            response = await search(query, **kwargs)
+            await asyncio.to_thread(search_cache.set, key, response, ttl)
+        except Exception:
+            _LOGGER.warning("Failed to refresh search: %s", query, exc_info=True)
+        finally:
+            del _refreshing[key]
+
+    _LOGGER.info("Serving stale results while refreshing search: %s", query)
+    # A fresh context, so the refresh is not traced as part of the run that
+    # found the results stale
+    _refreshing[key] = asyncio.create_task(refresh(), context=contextvars.Context())
@@ -0,0 +1,163 @@
+"""Coalesce concurrent identical calls into one in-flight call.
+
+The first caller for a key starts the work; callers that arrive with the same
+key while it is running attach to it and get the same result, or the same
+error. The shared work is only cancelled once every caller has gone away.
+"""
+
+import asyncio
+import logging
+from typing import Any, AsyncIterator, Awaitable, Callable, TypeVar
+
+from .metrics import Callback
+
+_LOGGER = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class _Flight:
+    """The shared work for one key and the callers waiting on it."""
+
+    def __init__(self) -> None:
+        self.task: asyncio.Future[Any] | None = None
+        self.waiters = 0
+        # Streams are recorded so late joiners can catch up
+        self.items: list[Any] = []
+        self.finished = False
+        self.error: BaseException | None = None
+        self.changed = asyncio.Event()
+
+    def notify(self) -> None:
+        self.changed.set()
+        self.changed = asyncio.Event()
+
+    def leave(self) -> None:
+        self.waiters -= 1
+        if self.waiters == 0 and self.task is not None and not self.task.done():
+            self.task.cancel()
+
+
+class SingleFlight:
+    """Share in-flight calls between concurrent callers with the same key.
+
+    Only use this from a single event loop.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.calls = 0
+        # calls that started new work
+        self.coalesced = 0
+        # calls that attached to work already in flight
+        self._flights: dict[str, _Flight] = {}
+        _groups.append(self)
+
+    def in_flight(self, key: str) -> bool:
+        """Whether a call for key is running."""
+        return key in self._flights
+
+    def _join(self, key: str) -> tuple[_Flight, bool]:
+        flight = self._flights.get(key)
+        leader = flight is None
+        if flight is None:
+            flight = self._flights[key] = _Flight()
+            self.calls += 1
+        else:
+            self.coalesced += 1
+            _LOGGER.info("Coalescing %s call with the one in flight", self.name)
+        flight.waiters += 1
+        return flight, leader
+
+    def _forget(self, key: str, flight: _Flight) -> None:
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[T]]) -> T:
+        """Await fn(), or the call already in flight for key."""
+        flight, leader = self._join(key)
+        if leader:
+            flight.task = asyncio.ensure_future(fn())
+            flight.task.add_done_callback(lambda _: self._forget(key, flight))
+        assert flight.task is not None
+        try:
+            return await asyncio.shield(flight.task)
+        finally:
+            flight.leave()
+
+    async def stream(
+        self, key: str, fn: Callable[[], AsyncIterator[T]]
+    ) -> AsyncIterator[T]:
+        """Iterate fn(), or the stream already in flight for key.
+
+        Callers that join late first receive every item produced so far.
+        """
+        flight, leader = self._join(key)
+        if leader:
+
+            async def pump() -> None:
+                try:
+                    async for item in fn():
+                        flight.items.append(item)
+                        flight.notify()
+                except BaseException as e:
+                    flight.error = e
+                    raise
+                finally:
+                    flight.finished = True
+                    self._forget(key, flight)
+                    flight.notify()
+
+            flight.task = asyncio.ensure_future(pump())
+            # The error is delivered to every caller, not to the task's waiter
+            flight.task.add_done_callback(
+                lambda task: task.cancelled() or task.exception()
+            )
+
+        try:
+            cursor = 0
+            while True:
+                if cursor < len(flight.items):
+                    cursor += 1
+                    yield flight.items[cursor - 1]
+                elif flight.finished:
+                    if flight.error is not None:
+                        raise flight.error
+                    return
+                else:
+                    await flight.changed.wait()
+        finally:
+            flight.leave()
+
+    def stats(self) -> dict[str, Any]:
+        """How many calls started work and how many were coalesced."""
+        return {
+            "name": self.name,
+            "calls": self.calls,
+            "coalesced": self.coalesced,
+            "in_flight": len(self._flights),
+        }
+
+
+_groups: list[SingleFlight] = []
+
+Callback(
+    "docgen_singleflight_calls_total",
+    "Calls that started new work.",
+    lambda: {(group.name,): group.calls for group in _groups},
+    ("name",),
+    kind="counter",
+)
+Callback(
+    "docgen_singleflight_coalesced_total",
+    "Calls that attached to identical work already in flight.",
+    lambda: {(group.name,): group.coalesced for group in _groups},
+    ("name",),
+    kind="counter",
+)
+Callback(
+    "docgen_singleflight_in_flight",
+    "Distinct calls currently in flight.",
+    lambda: {(group.name,): len(group._flights) for group in _groups},
+    ("name",),
+)
@@ -0,0 +1,412 @@
+"""Deduplicate the sources of Tavily search responses and format them for a model.
+
+Responses to overlapping queries return the same pages under different URLs:
+with and without tracking parameters, www. or a trailing slash, over http
+and https. Sources are deduplicated on their canonical URL, so each page is
+only shown (and paid for in tokens) once.
+
+Syndicated copies of a story or press release still come back from many
+domains. Each source's text is sketched with one-permutation MinHash over
+word shingles, and a source whose estimated Jaccard similarity to one kept
+before it is at least SOURCE_SIMILARITY is dropped as a near duplicate.
+Candidates are found with locality-sensitive hashing on bands of the
+sketch, so the sources are compared in about linear time.
+
+The formatted text is built chunk by chunk, one per source, so it can be
+streamed or joined in linear time. Raw content is cut to a number of tokens
+per source, and the whole text can be held to a token budget shared by the
+sources in proportion to their relevance (see docgen_agent.tokens). Without
+a budget, raw content is cut at an estimate of 4 characters per token, and
+nothing is tokenized.
+"""
+
+import logging
+import os
+import re
+import zlib
+from functools import lru_cache
+from typing import Any, Iterable, Iterator
+
+from . import tokens
+
+_LOGGER = logging.getLogger(__name__)
+
+SOURCE_SIMILARITY = float(os.getenv("SOURCE_SIMILARITY", "0.6"))
+
+_SHINGLE_WORDS = 3
+_SKETCH_BINS = 64
+_BAND_ROWS = 4
+# The start of a long page tells its copies apart, at a bounded cost
+_SKETCH_CHARS = 8000
+_WORD = re.compile(r"\w+")
+_MARKER = " [truncated]"
+_MARKER_TOKENS = 3
+# Without a token budget, raw content is cut at an estimate of its tokens
+_CHARS_PER_TOKEN = 4
+_ESTIMATED_MARKER = "... [truncated]"
+# Tavily scores relevance from 0 to 1; sources without a score still get a share
+_MIN_WEIGHT = 0.05
+
+_TRACKING_PARAMS = frozenset(
+    {
+        "fbclid",
+        "gclid",
+        "dclid",
+        "msclkid",
+        "yclid",
+        "igshid",
+        "mc_cid",
+        "mc_eid",
+        "_hsenc",
+        "_hsmi",
+        "ref_src",
+    }
+)
+
+
+@lru_cache(maxsize=4096)
+def canonical_url(url: str) -> str:
+    """The form of url shared by the variants that serve the same page.
+
+    The scheme becomes https; the host is lower cased, without www. or a
+    default port; tracking parameters (utm_* and the like) and the fragment
+    are dropped, the other parameters sorted, and a trailing slash removed.
+    Anything but an http or https URL is returned as is. Canonical URLs are
+    cached, as the same pages turn up in many searches of a report.
+    """
+    # Plain string operations, as this runs for every result of every search
+    scheme, separator, rest = url.strip().partition("://")
+    if not separator or scheme.lower() not in ("http", "https"):
+        return url
+    rest = rest.partition("#")[0]
+    rest, _, query = rest.partition("?")
+    host, slash, path = rest.partition("/")
+    host = host.rpartition("@")[2].lower()
+    if host.startswith("www."):
+        host = host[4:]
+    name, colon, port = host.rpartition(":")
+    if colon and port in ("", "80", "443"):
+        host = name
+    if not host:
+        return url
+
+    canonical = f"https://{host}{slash}{path}".rstrip("/")
+    if query:
+        params = sorted(
+            param
+            for param in query.split("&")
+            if param and not _is_tracking(param.partition("=")[0])
+        )
+        if params:
+            canonical += "?" + "&".join(params)
+    return canonical
+
+
+def _is_tracking(name: str) -> bool:
+    return name.startswith("utm_") or name in _TRACKING_PARAMS
+
+
+def _results(search_response: Any) -> Iterator[dict[str, Any]]:
+    """The results of a search response, or of a list of responses."""
+    if isinstance(search_response, dict):
+        yield from search_response["results"]
+    elif isinstance(search_response, list):
+        for response in search_response:
+            if isinstance(response, dict) and "results" in response:
+                yield from response["results"]
+            else:
+                yield from response
+    else:
+        raise ValueError(
+            "Input must be either a dict with 'results' or a list of search results"
+        )
+
+
+Sketch = tuple[int | None, ...]
+
+
+@lru_cache(maxsize=4096)
+def sketch(text: str) -> Sketch | None:
+    """The one-permutation MinHash sketch of the word shingles of text.
+
+    Each shingle is hashed once; the hash picks one of _SKETCH_BINS bins, and
+    each bin keeps the smallest hash it got (None if it got none). Returns
+    None for text without words. Sketches are cached, as the same sources
+    turn up in many searches of a report.
+    """
+    # Hashing the words once and each shingle as a tuple of their hashes is
+    # cheaper than hashing the text of every shingle, and as stable
+    hashes = [zlib.crc32(word.encode()) for word in _WORD.findall(text.casefold())]
+    if not hashes:
+        return None
+    width = min(_SHINGLE_WORDS, len(hashes))
+    shingles = zip(*(hashes[i:] for i in range(width)))
+    bins: list[int | None] = [None] * _SKETCH_BINS
+    for shingle in shingles:
+        value = hash(shingle) & 0xFFFFFFFFFFFFFFFF
+        index = value % _SKETCH_BINS
+        current = bins[index]
+        if current is None or value < current:
+            bins[index] = value
+    return tuple(bins)
+
+
+def similarity(a: Sketch, b: Sketch) -> float:
+    """Estimate the Jaccard similarity of the shingles behind two sketches."""
+    filled = same = 0
+    for x, y in zip(a, b):
+        if x is None and y is None:
+            continue
+        filled += 1
+        if x == y:
+            same += 1
+    return same / filled if filled else 0.0
+
+
+def source_text(source: dict[str, Any]) -> str:
+    """The text of a search result that near duplicates are found on."""
+    return (source.get("raw_content") or source.get("content") or "")[:_SKETCH_CHARS]
+
+
+class NearDuplicates:
+    """Recognize texts that are near duplicates of ones seen before."""
+
+    def __init__(self, threshold: float = SOURCE_SIMILARITY):
+        self.threshold = threshold
+        self.sketches: list[Sketch] = []
+        # what each sketch's text was remembered under
+        self.keys: list[Any] = []
+        # (band, rows) -> the indexes of the sketches with those rows
+        self.bands: dict[tuple[int, Sketch], list[int]] = {}
+
+    def seen(self, text: str) -> bool:
+        """Whether text is a near duplicate of one seen before, else remember it."""
+        return self.match(text, True) is not None
+
+    def match(self, text: str, key: Any) -> Any:
+        """The key of the first text seen before that text nearly duplicates.
+
+        If there is none, text is remembered under key and None returned.
+        """
+        if self.threshold > 1:
+            return None
+        text_sketch = sketch(text)
+        if text_sketch is None:
+            return None
+        bands = []
+        candidates: set[int] = set()
+        for start in range(0, _SKETCH_BINS, _BAND_ROWS):
+            rows = text_sketch[start : start + _BAND_ROWS]
+            if all(row is None for row in rows):
+                continue
+            band = (start, rows)
+            bands.append(band)
+            candidates.update(self.bands.get(band, ()))
+        for candidate in sorted(candidates):
+            if similarity(text_sketch, self.sketches[candidate]) >= self.threshold:
+                return self.keys[candidate]
+
+        index = len(self.sketches)
+        self.sketches.append(text_sketch)
+        self.keys.append(key)
+        for band in bands:
+            self.bands.setdefault(band, []).append(index)
+        return None
+
+
+def unique_sources(
+    search_response: Any, threshold: float = SOURCE_SIMILARITY
+) -> Iterator[dict[str, Any]]:
+    """The results of search_response, without repeats of the same page.
+
+    The first result for each canonical URL is kept, and of those, results
+    whose text is at least threshold alike to a kept one are dropped. A
+    threshold above 1 keeps near duplicates.
+    """
+    seen: set[str] = set()
+    near_duplicates = NearDuplicates(threshold) if threshold <= 1 else None
+    for source in _results(search_response):
+        url = canonical_url(source["url"])
+        if url in seen:
+            continue
+        seen.add(url)
+        if near_duplicates is not None and near_duplicates.seen(source_text(source)):
+            _LOGGER.debug("Dropping %s, a near duplicate of another source", url)
+            continue
+        yield source
+
+
+def _chunk(
+    source: dict[str, Any], content: str, raw_content: str | None, limit: int
+) -> str:
+    """The text of one source, with raw content unless raw_content is None."""
+    chunk = (
+        f"Source {source['title']}:\n===\n"
+        f"URL: {source['url']}\n===\n"
+        f"Most relevant content from source: {content}\n===\n"
+    )
+    if raw_content is None:
+        return chunk
+    return f"{chunk}Full source content limited to {limit} tokens: {raw_content}\n\n"
+
+
+def _raw_content(source: dict[str, Any]) -> str:
+    raw_content = source.get("raw_content") or ""
+    if not raw_content:
+        _LOGGER.debug("No raw_content found for source %s", source["url"])
+    return raw_content
+
+
+def _estimated_chunks(
+    sources: Iterable[dict[str, Any]],
+    max_tokens_per_source: int,
+    include_raw_content: bool,
+) -> Iterator[str]:
+    """The chunks of sources, with raw content cut at an estimate of its tokens."""
+    limit = max_tokens_per_source * _CHARS_PER_TOKEN
+    for source in sources:
+        raw_content = None
+        if include_raw_content:
+            raw_content = _raw_content(source)
+            if len(raw_content) > limit:
+                raw_content = raw_content[:limit] + _ESTIMATED_MARKER
+        yield _chunk(source, source["content"], raw_content, max_tokens_per_source)
+
+
+def _cut(text: str, max_tokens: int) -> str:
+    """Text within max_tokens, marked if it had to be cut."""
+    if tokens.count_tokens(text) <= max_tokens:
+        return text
+    cut = tokens.truncate(text, max_tokens - _MARKER_TOKENS)
+    return cut + _MARKER if cut else ""
+
+
+def _share(needs: list[int], weights: list[float], budget: int) -> list[int]:
+    """Split budget in proportion to weights, passing on what needs leave over."""
+    shares = [0] * len(needs)
+    waiting = [i for i, need in enumerate(needs) if need > 0]
+    while waiting and budget > 0:
+        total = sum(weights[i] for i in waiting)
+        met = [i for i in waiting if needs[i] <= budget * weights[i] / total]
+        if not met:
+            for i in waiting:
+                shares[i] = int(budget * weights[i] / total)
+            break
+        for i in met:
+            shares[i] = needs[i]
+            budget -= needs[i]
+        waiting = [i for i in waiting if i not in met]
+    return shares
+
+
+def iter_formatted_sources(
+    sources: Iterable[dict[str, Any]],
+    max_tokens_per_source: int,
+    include_raw_content: bool = True,
+    max_tokens: int | None = None,
+) -> Iterator[str]:
+    """Format sources for a model, yielding a heading and then one chunk each.
+
+    With max_tokens, the text is kept within about that many tokens: raw
+    content is limited to max_tokens_per_source tokens, each source's title
+    and URL are shown, and its content and raw content share what is left in
+    proportion to its relevance score. The least relevant sources are left
+    out if even their titles and URLs do not fit. Cuts fall after a sentence
+    where one is near.
+
+    Without max_tokens there is no budget to hold, so nothing is tokenized:
+    raw content is cut at _CHARS_PER_TOKEN characters per token and marked
+    "... [truncated]".
+    """
+    heading = "Sources:\n\n"
+    yield heading
+    if max_tokens is None:
+        yield from _estimated_chunks(
+            sources, max_tokens_per_source, include_raw_content
+        )
+        return
+
+    sources = list(sources)
+    texts = []
+    for source in sources:
+        raw_content = None
+        if include_raw_content:
+            raw_content = _raw_content(source)
+            raw_content = _cut(raw_content, max_tokens_per_source)
+        texts.append((source["content"], raw_content))
+
+    budget = max_tokens - tokens.count_tokens(heading)
+    weights = [max(source.get("score") or 0.0, _MIN_WEIGHT) for source in sources]
+    # The tokens of each source's text without its content
+    empty_raw_content = "" if include_raw_content else None
+    frames = [
+        tokens.count_tokens(
+            _chunk(source, "", empty_raw_content, max_tokens_per_source)
+        )
+        for source in sources
+    ]
+    shown = set()
+    for i in sorted(range(len(sources)), key=lambda i: -weights[i]):
+        if frames[i] <= budget:
+            shown.add(i)
+            budget -= frames[i]
+    if len(shown) < len(sources):
+        _LOGGER.debug(
+            "Leaving out %d sources to fit %d tokens",
+            len(sources) - len(shown),
+            max_tokens,
+        )
+
+    needs = [
+        (
+            tokens.count_tokens(content) + tokens.count_tokens(raw_content or "")
+            if i in shown
+            else 0
+        )
+        for i, (content, raw_content) in enumerate(texts)
+    ]
+    shares = _share(needs, weights, budget)
+    for i, source in enumerate(sources):
+        if i not in shown:
+            continue
+        content, raw_content = texts[i]
+        content = _cut(content, shares[i])
+        if raw_content is not None:
+            raw_content = _cut(raw_content, shares[i] - tokens.count_tokens(content))
+        if not content and not raw_content:
+            continue
+        yield _chunk(source, content, raw_content, max_tokens_per_source)
+
+
+def format_sources(
+    search_response: Any,
+    max_tokens_per_source: int,
+    include_raw_content: bool = True,
+    threshold: float = SOURCE_SIMILARITY,
+    max_tokens: int | None = None,
+) -> str:
+    """Deduplicate and format a search response, or a list of them, for a model.
+
+    Args:
+        search_response: Either:
+            - A dict with a 'results' key containing a list of search results
+            - A list of dicts, each containing search results
+        max_tokens_per_source: How many tokens of raw content to keep per source.
+        include_raw_content: Whether to include each source's raw content.
+        threshold: How alike two sources' texts must be to keep only one.
+        max_tokens: About how many tokens the whole text may take, if limited.
+
+    Returns:
+        str: Formatted string with deduplicated sources
+    """
+    chunks = list(
+        iter_formatted_sources(
+            unique_sources(search_response, threshold),
+            max_tokens_per_source,
+            include_raw_content,
+            max_tokens,
+        )
+    )
+    # Trimming the last chunk rather than the whole text saves copying it
+    chunks[-1] = chunks[-1].rstrip()
+    return "".join(chunks)
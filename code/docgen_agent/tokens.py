@@ -0,0 +1,183 @@
+"""Count and cut text in the tokens of the models' tokenizer.
+
+Token budgets are enforced with the BPE of the model that reads the text:
+Llama 3's for meta/llama-3.3-70b-instruct and o200k_base for gpt-4o-mini.
+Both ship with the package in docgen_agent/tokenizers and are loaded with
+tiktoken from there, so nothing is downloaded. TOKENIZER_MODEL (default
+meta/llama-3.3-70b-instruct) is the model counted for, and a run can count
+for another one within for_model(). Where no BPE can be loaded (tiktoken is
+missing, or the model has none), text is counted at 4 characters per token
+instead.
+
+The same sources are counted and cut again for every section that finds
+them, so counts and cuts are cached on the text and the encoding.
+"""
+
+import logging
+import os
+import re
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import cache, lru_cache
+from typing import Any, Iterator
+
+_LOGGER = logging.getLogger(__name__)
+
+TOKENIZER_MODEL = os.getenv("TOKENIZER_MODEL", "meta/llama-3.3-70b-instruct")
+TOKEN_CACHE_ITEMS = int(os.getenv("TOKEN_CACHE_ITEMS", "4096"))
+
+TOKENIZER_DIR = os.path.join(os.path.dirname(__file__), "tokenizers")
+# A model name fragment -> the encoding of the models it names
+_MODEL_ENCODINGS = (("llama-3", "llama3"), ("gpt-4o", "o200k_base"))
+# Encoding -> its split pattern, special tokens and the SHA-256 of its BPE file
+_ENCODINGS = {
+    "llama3": (
+        r"(?i:'s|'t|'re|'ve|'m|'ll|'d)|[^\r\n\p{L}\p{N}]?\p{L}+|\p{N}{1,3}"
+        r"| ?[^\s\p{L}\p{N}]+[\r\n]*|\s*[\r\n]+|\s+(?!\S)|\s+",
+        {"<|begin_of_text|>": 128000, "<|end_of_text|>": 128001},
+        "82e9d31979e92ab929cd544440f129d9ecd797b69e327f80f17e1c50d5551b55",
+    ),
+    "o200k_base": (
+        "|".join(
+            [
+                r"[^\r\n\p{L}\p{N}]?[\p{Lu}\p{Lt}\p{Lm}\p{Lo}\p{M}]*"
+                r"[\p{Ll}\p{Lm}\p{Lo}\p{M}]+(?i:'s|'t|'re|'ve|'m|'ll|'d)?",
+                r"[^\r\n\p{L}\p{N}]?[\p{Lu}\p{Lt}\p{Lm}\p{Lo}\p{M}]+"
+                r"[\p{Ll}\p{Lm}\p{Lo}\p{M}]*(?i:'s|'t|'re|'ve|'m|'ll|'d)?",
+                r"\p{N}{1,3}",
+                r" ?[^\s\p{L}\p{N}]+[\r\n/]*",
+                r"\s*[\r\n]+",
+                r"\s+(?!\S)",
+                r"\s+",
+            ]
+        ),
+        {"<|endoftext|>": 199999, "<|endofprompt|>": 200018},
+        "446a9538cb6c348e3516120d7c08b09f57c36495e2acfffe59a5bf8b0cfb1a2d",
+    ),
+}
+
+_CHARS_PER_TOKEN = 4
+# The end of a sentence: its punctuation, any closing quotes or brackets, and
+# the whitespace after them
+_SENTENCE_END = re.compile(r"[.!?。][\"'”’)\]]*\s+")
+
+
+def encoding_name(model: str) -> str | None:
+    """The name of the encoding of model, or None if none is bundled."""
+    for fragment, name in _MODEL_ENCODINGS:
+        if fragment in model.lower():
+            return name
+    return None
+
+
+# The name of the encoding tokens are counted in, looked up once per run
+_encoding_name: ContextVar[str | None] = ContextVar(
+    "tokenizer_encoding", default=encoding_name(TOKENIZER_MODEL)
+)
+
+
+@contextmanager
+def for_model(model: str) -> Iterator[None]:
+    """Count the tokens of the block, and its tasks, in model's encoding."""
+    token = _encoding_name.set(encoding_name(model))
+    try:
+        yield
+    finally:
+        try:
+            _encoding_name.reset(token)
+        except ValueError:
+            # An abandoned async generator is closed in another context
+            pass
+
+
+@cache
+def _load(name: str | None) -> Any:
+    """The encoding called name, or None if it cannot be loaded."""
+    if name is None:
+        return None
+    try:
+        import tiktoken
+        from tiktoken.load import load_tiktoken_bpe
+
+        pat_str, special_tokens, sha256 = _ENCODINGS[name]
+        return tiktoken.Encoding(
+            name,
+            pat_str=pat_str,
+            mergeable_ranks=load_tiktoken_bpe(
+                os.path.join(TOKENIZER_DIR, f"{name}.tiktoken"), sha256
+            ),
+            special_tokens=special_tokens,
+        )
+    except Exception as e:
+        _LOGGER.warning(
+            "Failed to load the %s tokenizer, estimating tokens from characters: %r",
+            name,
+            e,
+        )
+        return None
+
+
+def _encoding() -> Any:
+    """The tokenizer of the model being counted for, or None."""
+    return _load(_encoding_name.get())
+
+
+def exact() -> bool:
+    """Whether tokens are counted with the tokenizer rather than estimated."""
+    return _encoding() is not None
+
+
+def count_tokens(text: str) -> int:
+    """The number of tokens in text."""
+    return _count_tokens(text, _encoding_name.get())
+
+
+@lru_cache(maxsize=TOKEN_CACHE_ITEMS)
+def _count_tokens(text: str, name: str | None) -> int:
+    encoding = _load(name)
+    if encoding is None:
+        return -(-len(text) // _CHARS_PER_TOKEN)
+    return len(encoding.encode_ordinary(text))
+
+
+def truncate(text: str, max_tokens: int) -> str:
+    """The longest start of text within max_tokens, cut after a sentence.
+
+    If no sentence ends in the second half of what fits, the cut falls
+    after a word instead. Text that fits is returned whole.
+    """
+    return _truncate(text, max_tokens, _encoding_name.get())
+
+
+@lru_cache(maxsize=TOKEN_CACHE_ITEMS)
+def _truncate(text: str, max_tokens: int, name: str | None) -> str:
+    if max_tokens <= 0:
+        return ""
+    encoding = _load(name)
+    if encoding is None:
+        if len(text) <= max_tokens * _CHARS_PER_TOKEN:
+            return text
+        head = text[: max_tokens * _CHARS_PER_TOKEN]
+    else:
+        tokens = encoding.encode_ordinary(text)
+        if len(tokens) <= max_tokens:
+            return text
+        # A token split in the middle of a character decodes with a
+        # replacement character, which the cut below drops
+        head = encoding.decode(tokens[:max_tokens])
+
+    sentence_end = None
+    for sentence_end in _SENTENCE_END.finditer(head):
+        pass
+    if sentence_end is not None and sentence_end.start() >= len(head) // 2:
+        return head[: sentence_end.end()].rstrip()
+    words = head.rsplit(None, 1)
+    if len(words) == 2:
+        return words[0].rstrip()
+    return ""
+
+
+def clear_cache() -> None:
+    """Forget the cached counts and cuts."""
+    _count_tokens.cache_clear()
+    _truncate.cache_clear()
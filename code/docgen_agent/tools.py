@@ -3,78 +3,192 @@
 import asyncio
 import logging
 import os
-from typing import Literal
+import time
+from typing import Any, Literal
 
+import httpx
 from langchain_core.tools import tool
-from tavily import AsyncTavilyClient
+from tavily import AsyncTavilyClient, UsageLimitExceededError
+from tavily.errors import TimeoutError as TavilyTimeoutError
+
+from . import cassette, query_planner, tracing
+from .corpus import ResearchCorpus
+from .limits import search_calls
+from .metrics import search_errors, search_seconds
+from .resilience import CircuitBreaker, RetryPolicy, retry
+from .search_cache import cached_search
+from .sources import format_sources
 
 _LOGGER = logging.getLogger(__name__)
 
-tavily_client = AsyncTavilyClient(api_key=os.getenv("TAVILY_API_KEY"))
+
+async def _raise_rate_limited(response: httpx.Response) -> None:
+    """Raise a 429 with its response, before Tavily's client sees it.
+
+    AsyncTavilyClient turns a 429 into a UsageLimitExceededError that drops
+    the Retry-After header.
+    """
+    if response.status_code == 429:
+        await response.aread()
+        response.raise_for_status()
+
+
+def create_tavily_client(
+    api_key: str | None = None, api_base_url: str | None = None
+) -> AsyncTavilyClient:
+    """A Tavily client whose rate-limited searches keep their Retry-After."""
+    return AsyncTavilyClient(
+        api_key=api_key,
+        api_base_url=api_base_url,
+        client=httpx.AsyncClient(
+            base_url=api_base_url or "https://api.tavily.com",
+            event_hooks={"response": [_raise_rate_limited]},
+        ),
+    )
+
+
+tavily_client = create_tavily_client(os.getenv("TAVILY_API_KEY"))
 INCLUDE_RAW_CONTENT = False
 MAX_TOKENS_PER_SOURCE = 1000
+MAX_TOKENS_PER_SEARCH = int(os.getenv("MAX_TOKENS_PER_SEARCH", "8000"))
+CORPUS_MAX_TOKENS = int(os.getenv("CORPUS_MAX_TOKENS", "16000"))
 MAX_RESULTS = 5
 SEARCH_DAYS = 30
+SEARCH_TIMEOUT_SECONDS = float(os.getenv("SEARCH_TIMEOUT_SECONDS", "20"))
+SEARCH_ATTEMPTS = int(os.getenv("SEARCH_ATTEMPTS", "3"))
+SEARCH_BREAKER_FAILURES = int(os.getenv("SEARCH_BREAKER_FAILURES", "5"))
+SEARCH_BREAKER_RESET_SECONDS = float(os.getenv("SEARCH_BREAKER_RESET_SECONDS", "30"))
+
+_RETRY_POLICY = RetryPolicy(attempts=SEARCH_ATTEMPTS, base_delay=0.5, max_delay=8)
+tavily_breaker = CircuitBreaker(
+    "tavily", SEARCH_BREAKER_FAILURES, SEARCH_BREAKER_RESET_SECONDS
+)
+
+
+def _rate_limited(error: Exception) -> float | None:
+    """If error is a 429 from Tavily, the seconds it asked us to wait (or 0)."""
+    if isinstance(error, UsageLimitExceededError):
+        return getattr(error, "retry_after_seconds", None) or 0
+    if isinstance(error, httpx.HTTPStatusError) and error.response.status_code == 429:
+        try:
+            return float(error.response.headers.get("Retry-After", 0))
+        except ValueError:
+            # Retry-After may also be an HTTP date
+            return 0
+    return None
+
+
+def _retryable(error: BaseException) -> bool:
+    """Whether a failed search may succeed if tried again."""
+    if isinstance(error, (TimeoutError, TavilyTimeoutError, httpx.TransportError)):
+        return True
+    if _rate_limited(error) is not None:
+        return True
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code >= 500
+    return False
+
+
+def _outage(error: BaseException) -> bool:
+    """Whether a failed search suggests that Tavily is down, not just busy."""
+    return _retryable(error) and _rate_limited(error) is None
+
+
+async def _tavily_search(query: str, **kwargs) -> dict:
+    """Send one search to Tavily, or to the cassette if one is in use."""
+    if cassette.cassette is None:
+        return await tavily_client.search(query, **kwargs)
+    return await cassette.cassette.play(
+        "tavily",
+        {"query": query, **kwargs},
+        lambda: tavily_client.search(query, **kwargs),
+    )
 
 
-def _deduplicate_and_format_sources(
-    search_response, max_tokens_per_source, include_raw_content=True
-):
-    """
-    Takes either a single search response or list of responses from Tavily API and formats them.
-    Limits the raw_content to approximately max_tokens_per_source.
-    include_raw_content specifies whether to include the raw_content from Tavily in the formatted string.
+async def _search(query: str, **kwargs) -> dict:
+    """Run one Tavily search within the cap on concurrent searches."""
+    with tracing.span("search", "search", query=query) as span:
+        async with search_calls:
+            start = time.perf_counter()
+            try:
+                with tavily_breaker.guard(_outage):
+                    response = await asyncio.wait_for(
+                        _tavily_search(query, **kwargs), SEARCH_TIMEOUT_SECONDS
+                    )
+            except Exception as e:
+                search_errors.inc()
+                retry_after = _rate_limited(e)
+                if retry_after is not None:
+                    search_calls.throttle(retry_after)
+                raise
+            finally:
+                search_seconds.observe(time.perf_counter() - start)
+            search_calls.recover()
+        if span is not None:
+            results = response.get("results", [])
+            span.args["queued_ms"] = (start - span.start) * 1000
+            span.args["results"] = len(results)
+            span.args["response_chars"] = sum(
+                len(result.get("content") or "") + len(result.get("raw_content") or "")
+                for result in results
+            )
+        return response
 
-    Args:
-        search_response: Either:
-            - A dict with a 'results' key containing a list of search results
-            - A list of dicts, each containing search results
 
-    Returns:
-        str: Formatted string with deduplicated sources
+async def _search_with_retries(query: str, **kwargs) -> dict:
+    """Run one Tavily search, retrying it if it may succeed the next time."""
+    return await retry(
+        lambda: _search(query, **kwargs), _RETRY_POLICY, _retryable, _rate_limited
+    )
+
+
+async def _run_searches(
+    queries: list[str], topic: str
+) -> tuple[list[dict[str, Any]], str]:
+    """Search for queries, returning the responses and a note for the model.
+
+    The note says if the search budget is spent or some searches failed.
     """
-    # Convert input to list of results
-    if isinstance(search_response, dict):
-        sources_list = search_response["results"]
-    elif isinstance(search_response, list):
-        sources_list = []
-        for response in search_response:
-            if isinstance(response, dict) and "results" in response:
-                sources_list.extend(response["results"])
-            else:
-                sources_list.extend(response)
-    else:
-        raise ValueError(
-            "Input must be either a dict with 'results' or a list of search results"
-        )
+    days = None
+    if topic == "news":
+        days = SEARCH_DAYS
 
-    # Deduplicate by URL
-    unique_sources = {}
-    for source in sources_list:
-        if source["url"] not in unique_sources:
-            unique_sources[source["url"]] = source
-
-    # Format output
-    formatted_text = "Sources:\n\n"
-    for i, source in enumerate(unique_sources.values(), 1):
-        formatted_text += f"Source {source['title']}:\n===\n"
-        formatted_text += f"URL: {source['url']}\n===\n"
-        formatted_text += (
-            f"Most relevant content from source: {source['content']}\n===\n"
+    searches = query_planner.plan(queries)
+    search_jobs = []
+    for query in searches:
+        _LOGGER.info("Searching for query: %s", query)
+        search_jobs.append(
+            asyncio.create_task(
+                cached_search(
+                    _search_with_retries,
+                    query,
+                    max_results=MAX_RESULTS,
+                    include_raw_content=INCLUDE_RAW_CONTENT,
+                    topic=topic,
+                    days=days,
+                )
+            )
         )
-        if include_raw_content:
-            # Using rough estimate of 4 characters per token
-            char_limit = max_tokens_per_source * 4
-            # Handle None raw_content
-            raw_content = source.get("raw_content", "")
-            if raw_content is None:
-                raw_content = ""
-                print(f"Warning: No raw_content found for source {source['url']}")
-            if len(raw_content) > char_limit:
-                raw_content = raw_content[:char_limit] + "... [truncated]"
-            formatted_text += f"Full source content limited to {max_tokens_per_source} tokens: {raw_content}\n\n"
 
-    return formatted_text.strip()
+    # A failed query leaves the others' results to work with
+    outcomes = await asyncio.gather(*search_jobs, return_exceptions=True)
+    search_docs = []
+    failed = []
+    for query, outcome in zip(searches, outcomes):
+        if isinstance(outcome, Exception):
+            _LOGGER.warning("Search failed for query %s: %r", query, outcome)
+            failed.append(query)
+        elif isinstance(outcome, BaseException):
+            raise outcome
+        else:
+            search_docs.append(outcome)
+
+    note = ""
+    if not searches:
+        note += "\n\nThe search budget of this report is spent."
+    if failed:
+        note += "\n\nThese searches failed: " + "; ".join(failed)
+    return search_docs, note
 
 
 @tool(parse_docstring=True)
@@ -95,32 +209,44 @@ async def search_tavily(
         A string of the search results.
     """
     _LOGGER.info("Searching the web using the Tavily API")
-
-    days = None
-    if topic == "news":
-        days = SEARCH_DAYS
-
-    search_jobs = []
-    for query in queries:
-        _LOGGER.info("Searching for query: %s", query)
-        search_jobs.append(
-            asyncio.create_task(
-                tavily_client.search(
-                    query,
-                    max_results=MAX_RESULTS,
-                    include_raw_content=INCLUDE_RAW_CONTENT,
-                    topic=topic,
-                    days=days,  # type: ignore[arg-type]
-                )
-            )
-        )
-
-    search_docs = await asyncio.gather(*search_jobs)
-
-    formatted_search_docs = _deduplicate_and_format_sources(
+    search_docs, note = await _run_searches(queries, topic)
+    formatted_search_docs = format_sources(
         search_docs,
         max_tokens_per_source=MAX_TOKENS_PER_SOURCE,
         include_raw_content=INCLUDE_RAW_CONTENT,
+        max_tokens=MAX_TOKENS_PER_SEARCH,
     )
+    formatted_search_docs += note
     _LOGGER.debug("Search results: %s", formatted_search_docs)
     return formatted_search_docs
+
+
+async def search_corpus(
+    corpus: ResearchCorpus, tool_args: dict[str, Any]
+) -> tuple[ResearchCorpus, str]:
+    """Run a search_tavily tool call, adding the sources it finds to corpus.
+
+    Returns the new corpus and the tool message for the model, which names
+    the sources found rather than repeating them.
+    """
+    args = search_tavily.args_schema.model_validate(tool_args)
+    _LOGGER.info("Searching the web using the Tavily API")
+    search_docs, note = await _run_searches(args.queries, args.topic)
+    updated, found = corpus.add_responses(search_docs)
+    new = len(updated.sources) - len(corpus.sources)
+    if found:
+        message = (
+            f"Found {len(found)} sources ({new} new): {', '.join(found)}."
+            " They are listed under Sources in the system prompt."
+        )
+    else:
+        message = "Found no sources."
+    return updated, message + note
+
+
+def with_sources(system_prompt: str, corpus: ResearchCorpus) -> str:
+    """The system prompt, followed by the sources of corpus if it has any."""
+    if not corpus.sources:
+        return system_prompt
+    rendered = corpus.render(MAX_TOKENS_PER_SOURCE, CORPUS_MAX_TOKENS)
+    return f"{system_prompt}\n\n{rendered}"
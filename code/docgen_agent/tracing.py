@@ -0,0 +1,145 @@
+"""Per-run tracing of graph nodes, LLM calls and searches.
+
+A trace is started for each report run. While it is active, span() records
+the start, end and parent of each piece of work, along with the section it
+belongs to and a few sizes, such as the length of a prompt and its response.
+The current span is kept in a context variable, so the tasks LangGraph and
+the search tool create inherit it as their parent. Finished traces are
+exported in the Chrome trace event format, which chrome://tracing and
+Perfetto show as a flame chart.
+
+Outside of a run, span() does nothing.
+"""
+
+import itertools
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar, Token
+from dataclasses import dataclass, field
+from typing import Any, Iterator
+
+_span_ids = itertools.count(1)
+
+
+@dataclass
+class Span:
+    name: str
+    category: str
+    # run, node, section, llm or search
+    parent_id: int | None = None
+    section: int | None = None
+    # the index of the report section the work is for, if any
+    args: dict[str, Any] = field(default_factory=dict)
+    # sizes and other details, shown when the span is selected
+    id: int = field(default_factory=lambda: next(_span_ids))
+    start: float = field(default_factory=time.perf_counter)
+    end: float | None = None
+
+
+class Trace:
+    """The spans recorded during one report run."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.origin = time.perf_counter()
+        self.spans: list[Span] = []
+
+    def to_chrome(self, pid: int = 1) -> list[dict[str, Any]]:
+        """Export the spans as Chrome trace events.
+
+        Concurrent spans are spread over as many rows (threads, in the trace
+        viewer) as it takes for the spans on each row to nest properly.
+        """
+        events: list[dict[str, Any]] = [
+            {"ph": "M", "name": "process_name", "pid": pid, "args": {"name": self.name}}
+        ]
+        # the end times of the open spans on each row, innermost last
+        rows: list[list[float]] = []
+        spans = [span for span in self.spans if span.end is not None]
+        for span in sorted(spans, key=lambda span: (span.start, -span.end)):
+            for tid, row in enumerate(rows):
+                while row and row[-1] <= span.start:
+                    row.pop()
+                if not row or span.end <= row[-1]:
+                    break
+            else:
+                tid, row = len(rows), []
+                rows.append(row)
+            row.append(span.end)
+            args = {"span_id": span.id, "parent_id": span.parent_id, **span.args}
+            if span.section is not None:
+                args["section"] = span.section
+            events.append(
+                {
+                    "ph": "X",
+                    "name": span.name,
+                    "cat": span.category,
+                    "pid": pid,
+                    "tid": tid,
+                    "ts": (span.start - self.origin) * 1e6,
+                    "dur": (span.end - span.start) * 1e6,
+                    "args": args,
+                }
+            )
+        return events
+
+
+_trace: ContextVar[Trace | None] = ContextVar("trace", default=None)
+_span: ContextVar[Span | None] = ContextVar("span", default=None)
+
+
+@contextmanager
+def trace(name: str) -> Iterator[Trace]:
+    """Record the spans of the work done within the block, and its tasks."""
+    run = Trace(name)
+    trace_token = _trace.set(run)
+    try:
+        with span(name, "run"):
+            yield run
+    finally:
+        _reset(_trace, trace_token)
+
+
+@contextmanager
+def span(
+    name: str, category: str, section: int | None = None, **args: Any
+) -> Iterator[Span | None]:
+    """Record the block as a span of the current trace, if there is one.
+
+    The span is a child of the current span and, unless section is given,
+    belongs to the same section. The yielded span's args can be added to,
+    for example with the size of a response.
+    """
+    run = _trace.get()
+    if run is None:
+        yield None
+        return
+
+    parent = _span.get()
+    if section is None and parent is not None:
+        section = parent.section
+    current = Span(
+        name=name,
+        category=category,
+        parent_id=parent.id if parent else None,
+        section=section,
+        args=args,
+    )
+    token = _span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.args["error"] = type(e).__name__
+        raise
+    finally:
+        current.end = time.perf_counter()
+        _reset(_span, token)
+        run.spans.append(current)
+
+
+def _reset(var: ContextVar, token: Token) -> None:
+    try:
+        var.reset(token)
+    except ValueError:
+        # An abandoned async generator is closed in another context
+        pass
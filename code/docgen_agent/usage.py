@@ -0,0 +1,208 @@
+"""Token and cost accounting for report runs.
+
+Every LLM call made through limits.ainvoke_llm reports the prompt,
+completion and cached prompt tokens from its response metadata. Within a
+run, the usage is rolled up in total, per graph node, per report section and
+per model, and priced with LLM_PRICES. The run's Tavily searches are
+counted too: those sent, those served from the search cache and those
+coalesced with an identical search already in flight, along with the
+queries merged into another's search or past the query budget (see
+docgen_agent.query_planner).
+
+LLM_PRICES is a JSON object mapping model names to their prices in dollars
+per million tokens, for example:
+  {"gpt-4o-mini": {"input": 0.15, "cached_input": 0.075, "output": 0.6}}
+Models without a price count tokens but no cost.
+"""
+
+import json
+import os
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import asdict, dataclass
+from typing import Any, Iterator
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+
+from .metrics import llm_cost, llm_tokens
+
+_DEFAULT_PRICES = {
+    "gpt-4o-mini": {"input": 0.15, "cached_input": 0.075, "output": 0.6},
+}
+LLM_PRICES: dict[str, dict[str, float]] = {
+    **_DEFAULT_PRICES,
+    **json.loads(os.getenv("LLM_PRICES", "{}")),
+}
+
+
+@dataclass
+class Usage:
+    calls: int = 0
+    prompt_tokens: int = 0
+    # including the cached ones
+    completion_tokens: int = 0
+    cached_tokens: int = 0
+    # prompt tokens served from the provider's prompt cache
+    cost: float = 0.0
+    # in dollars
+
+    def add(self, other: "Usage") -> None:
+        self.calls += other.calls
+        self.prompt_tokens += other.prompt_tokens
+        self.completion_tokens += other.completion_tokens
+        self.cached_tokens += other.cached_tokens
+        self.cost += other.cost
+
+
+@dataclass
+class SearchUsage:
+    calls: int = 0
+    # searches sent to Tavily
+    cached: int = 0
+    # searches served from the search cache
+    coalesced: int = 0
+    # searches that shared an identical search in flight
+    merged: int = 0
+    # queries served by a search for a near-duplicate query
+    over_budget: int = 0
+    # queries that came after the run's query budget was spent
+
+
+def price(model: str, usage: Usage) -> float:
+    """What the tokens of usage cost on model, in dollars."""
+    prices = LLM_PRICES.get(model)
+    if prices is None:
+        return 0.0
+    uncached = usage.prompt_tokens - usage.cached_tokens
+    return (
+        uncached * prices.get("input", 0)
+        + usage.cached_tokens * prices.get("cached_input", prices.get("input", 0))
+        + usage.completion_tokens * prices.get("output", 0)
+    ) / 1e6
+
+
+class UsageLedger:
+    """The LLM usage of one run, in total and per node, section and model.
+
+    Along with the run's searches.
+    """
+
+    def __init__(self) -> None:
+        self.total = Usage()
+        self.nodes: dict[str, Usage] = {}
+        self.sections: dict[int, Usage] = {}
+        self.models: dict[str, Usage] = {}
+        self.searches = SearchUsage()
+
+    def record(
+        self, usage: Usage, model: str, node: str | None, section: int | None
+    ) -> None:
+        self.total.add(usage)
+        self.models.setdefault(model, Usage()).add(usage)
+        if node is not None:
+            self.nodes.setdefault(node, Usage()).add(usage)
+        if section is not None:
+            self.sections.setdefault(section, Usage()).add(usage)
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "total": asdict(self.total),
+            "nodes": {node: asdict(usage) for node, usage in self.nodes.items()},
+            "sections": {
+                str(section): asdict(usage)
+                for section, usage in sorted(self.sections.items())
+            },
+            "models": {model: asdict(usage) for model, usage in self.models.items()},
+            "searches": asdict(self.searches),
+        }
+
+
+_ledger: ContextVar[UsageLedger | None] = ContextVar("usage_ledger", default=None)
+_scope: ContextVar[tuple[str | None, int | None]] = ContextVar(
+    "usage_scope", default=(None, None)
+)
+
+
+@contextmanager
+def track() -> Iterator[UsageLedger]:
+    """Account the LLM usage of the work done within the block, and its tasks."""
+    ledger = UsageLedger()
+    token = _ledger.set(ledger)
+    try:
+        yield ledger
+    finally:
+        try:
+            _ledger.reset(token)
+        except ValueError:
+            # An abandoned async generator is closed in another context
+            pass
+
+
+@contextmanager
+def scope(node: str, section: int | None) -> Iterator[None]:
+    """Attribute the usage within the block to a node and section."""
+    if section is None:
+        section = _scope.get()[1]
+    token = _scope.set((node, section))
+    try:
+        yield
+    finally:
+        _scope.reset(token)
+
+
+def record(model: str, usage: Usage) -> None:
+    """Price and account one LLM call's usage in the current run and metrics."""
+    usage.cost = price(model, usage)
+    llm_tokens.inc(model, "prompt", amount=usage.prompt_tokens)
+    llm_tokens.inc(model, "completion", amount=usage.completion_tokens)
+    llm_tokens.inc(model, "cached", amount=usage.cached_tokens)
+    llm_cost.inc(model, amount=usage.cost)
+    ledger = _ledger.get()
+    if ledger is not None:
+        ledger.record(usage, model, *_scope.get())
+
+
+def record_search(outcome: str) -> None:
+    """Count a search of the current run as calls, cached or coalesced."""
+    ledger = _ledger.get()
+    if ledger is not None:
+        setattr(ledger.searches, outcome, getattr(ledger.searches, outcome) + 1)
+
+
+class UsageHandler(BaseCallbackHandler):
+    """Collect the token usage reported by the chat models of one call."""
+
+    run_inline = True
+
+    def __init__(self) -> None:
+        self.usage = Usage()
+
+    def on_llm_end(self, response: LLMResult, **kwargs: Any) -> None:
+        self.usage.add(_usage_of(response))
+
+
+def _usage_of(response: LLMResult) -> Usage:
+    """Read the usage from the messages' metadata, else from the LLM output.
+
+    Responses served from the LLM cache (see docgen_agent.llm_cache) are not
+    counted.
+    """
+    usage = Usage()
+    for generations in response.generations:
+        for generation in generations:
+            message = getattr(generation, "message", None)
+            if getattr(message, "response_metadata", {}).get("cached"):
+                continue
+            usage.calls = 1
+            metadata = getattr(message, "usage_metadata", None)
+            if metadata:
+                usage.prompt_tokens += metadata.get("input_tokens", 0)
+                usage.completion_tokens += metadata.get("output_tokens", 0)
+                details = metadata.get("input_token_details") or {}
+                usage.cached_tokens += details.get("cache_read") or 0
+    if usage.calls and not usage.prompt_tokens and response.llm_output:
+        token_usage = response.llm_output.get("token_usage") or {}
+        usage.prompt_tokens = token_usage.get("prompt_tokens", 0)
+        usage.completion_tokens = token_usage.get("completion_tokens", 0)
+    return usage
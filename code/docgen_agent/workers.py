@@ -0,0 +1,220 @@
+"""A pool of worker processes for running the report graph.
+
+Within one process, every report competes for the same GIL: validating the
+growing message lists, formatting search results and encoding JSON. In
+worker-pool mode each report runs in one of several worker processes
+instead. Each worker has its own event loop and runs up to a fixed number of
+reports at a time, and streams the progress events of each back to the
+parent process.
+"""
+
+import asyncio
+import logging
+import multiprocessing
+import os
+import threading
+import uuid
+from multiprocessing.connection import Connection, wait
+from typing import Any, AsyncIterator
+
+_LOGGER = logging.getLogger(__name__)
+
+REPORT_WORKER_PROCESSES = int(os.getenv("REPORT_WORKER_PROCESSES", "0"))
+REPORT_WORKER_CONCURRENCY = int(os.getenv("REPORT_WORKER_CONCURRENCY", "2"))
+_POLL_INTERVAL = 1.0  # seconds between checks for replaced workers
+
+# Messages to the workers, tagged with the request they belong to
+_RUN = "run"
+_CANCEL = "cancel"
+# Messages from the workers, tagged the same way
+_EVENT = "event"
+_FAILED = "failed"
+_FINISHED = "finished"
+
+
+class WorkerError(RuntimeError):
+    """Raised when a report fails in, or with, its worker process."""
+
+
+def _worker_main(tasks: Connection, results: Connection, concurrency: int) -> None:
+    """Entry point of a worker process."""
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(_serve(tasks, results, concurrency))
+
+
+async def _serve(tasks: Connection, results: Connection, concurrency: int) -> None:
+    from . import _generate
+
+    loop = asyncio.get_running_loop()
+    slots = asyncio.Semaphore(concurrency)
+    running: dict[str, asyncio.Future] = {}
+
+    async def run(request_id: str, topic: str, report_structure: str) -> None:
+        async with slots:
+            try:
+                async for event in _generate(topic, report_structure):
+                    results.send((request_id, _EVENT, event))
+            except Exception as e:
+                _LOGGER.exception("Report %s failed", request_id)
+                results.send((request_id, _FAILED, str(e)))
+            else:
+                results.send((request_id, _FINISHED, None))
+
+    while True:
+        try:
+            kind, request_id, *args = await loop.run_in_executor(None, tasks.recv)
+        except EOFError:
+            # The parent process has gone away
+            return
+        if kind == _CANCEL:
+            future = running.get(request_id)
+            if future is not None:
+                _LOGGER.info("Cancelling report %s", request_id)
+                future.cancel()
+            continue
+        future = running[request_id] = asyncio.ensure_future(run(request_id, *args))
+        future.add_done_callback(
+            lambda _, request_id=request_id: running.pop(request_id)
+        )
+
+
+class _Worker:
+    """A worker process, its pipes and the requests it is running."""
+
+    def __init__(self, process, tasks: Connection, results: Connection):
+        self.process = process
+        self.tasks = tasks
+        self.results = results
+        self.active: set[str] = set()
+
+
+class WorkerPool:
+    """Run reports on worker processes, each with its own event loop."""
+
+    def __init__(
+        self,
+        processes: int = REPORT_WORKER_PROCESSES,
+        concurrency: int = REPORT_WORKER_CONCURRENCY,
+    ):
+        self.processes = processes
+        self.concurrency = concurrency
+        # Spawn rather than fork, the parent is running threads
+        self._context = multiprocessing.get_context("spawn")
+        self._workers: list[_Worker] = []
+        self._streams: dict[str, tuple[asyncio.AbstractEventLoop, asyncio.Queue]] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def capacity(self) -> int:
+        """How many reports the pool runs at the same time."""
+        return self.processes * self.concurrency
+
+    def _start(self) -> None:
+        """Start the workers on first use."""
+        with self._lock:
+            if self._workers:
+                return
+            self._workers = [self._spawn(index) for index in range(self.processes)]
+        threading.Thread(
+            target=self._dispatch, name="report-pool-dispatch", daemon=True
+        ).start()
+
+    def _spawn(self, index: int) -> _Worker:
+        task_reader, task_writer = self._context.Pipe(duplex=False)
+        result_reader, result_writer = self._context.Pipe(duplex=False)
+        process = self._context.Process(
+            target=_worker_main,
+            args=(task_reader, result_writer, self.concurrency),
+            name=f"report-worker-{index}",
+            daemon=True,
+        )
+        process.start()
+        # Only the worker holds these ends, so its exit shows up as EOF
+        task_reader.close()
+        result_writer.close()
+        _LOGGER.info("Started report worker %d (pid %d)", index, process.pid)
+        return _Worker(process, task_writer, result_reader)
+
+    async def astream(
+        self, topic: str, report_structure: str
+    ) -> AsyncIterator[dict[str, Any]]:
+        """Run the report graph on a worker, yielding its progress events."""
+        self._start()
+        request_id = uuid.uuid4().hex
+        events: asyncio.Queue = asyncio.Queue()
+        with self._lock:
+            self._streams[request_id] = (asyncio.get_running_loop(), events)
+            worker = min(self._workers, key=lambda worker: len(worker.active))
+            worker.active.add(request_id)
+            worker.tasks.send((_RUN, request_id, topic, report_structure))
+        kind = None
+        try:
+            while True:
+                kind, payload = await events.get()
+                if kind == _EVENT:
+                    yield payload
+                elif kind == _FAILED:
+                    raise WorkerError(payload)
+                elif kind == _FINISHED:
+                    return
+        finally:
+            with self._lock:
+                self._streams.pop(request_id, None)
+                if kind not in (_FAILED, _FINISHED):
+                    # The caller stopped listening, so stop the report too
+                    self._cancel(worker, request_id)
+                worker.active.discard(request_id)
+
+    def _cancel(self, worker: _Worker, request_id: str) -> None:
+        """Ask a worker to cancel a report; call with the lock held."""
+        try:
+            worker.tasks.send((_CANCEL, request_id))
+        except OSError:
+            # The worker is gone, and the report with it
+            pass
+
+    def _deliver(self, request_id: str, kind: str, payload: Any) -> None:
+        with self._lock:
+            stream = self._streams.get(request_id)
+        if stream is not None:
+            loop, events = stream
+            loop.call_soon_threadsafe(events.put_nowait, (kind, payload))
+
+    def _dispatch(self) -> None:
+        """Route worker messages to their streams and replace dead workers."""
+        while True:
+            with self._lock:
+                workers = {worker.results: worker for worker in self._workers}
+            for results in wait(list(workers), timeout=_POLL_INTERVAL):
+                worker = workers[results]
+                try:
+                    request_id, kind, payload = results.recv()
+                except EOFError:
+                    self._replace(worker)
+                    continue
+                self._deliver(request_id, kind, payload)
+
+    def _replace(self, worker: _Worker) -> None:
+        """Fail the requests of a worker that exited and start a new one."""
+        worker.process.join()
+        index = self._workers.index(worker)
+        _LOGGER.error(
+            "Report worker %d exited with code %s", index, worker.process.exitcode
+        )
+        for request_id in list(worker.active):
+            self._deliver(request_id, _FAILED, "The report worker exited.")
+        worker.tasks.close()
+        worker.results.close()
+        replacement = self._spawn(index)
+        with self._lock:
+            self._workers[index] = replacement
+
+
+def create_worker_pool() -> WorkerPool | None:
+    """Create the worker pool if REPORT_WORKER_PROCESSES enables it."""
+    if REPORT_WORKER_PROCESSES <= 0:
+        return None
+    if multiprocessing.parent_process() is not None:
+        # Spawned workers re-import the main module, they must not nest pools
+        return None
+    return WorkerPool()
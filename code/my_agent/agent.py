@@ -14,6 +14,8 @@ from langgraph.graph import END, START, StateGraph
 from langgraph.graph.message import add_messages
 from pydantic import BaseModel
 
+from docgen_agent.llm_cache import llm_cache
+
 from . import tools
 from .prompts import agent_prompt
 
@@ -21,7 +23,7 @@ _LOGGER = logging.getLogger(__name__)
 _MAX_LLM_RETRIES = 3
 
 # Initialize the LLM
-llm = ChatNVIDIA(model="meta/llama-3.3-70b-instruct", temperature=0)
+llm = ChatNVIDIA(model="meta/llama-3.3-70b-instruct", temperature=0, cache=llm_cache)
 llm_with_tools = llm.bind_tools([tools.search_tavily])  # Add your tools here
 
 
@@ -0,0 +1,9 @@
+import os
+import tempfile
+
+# Caches and job stores stay out of the way in a scratch directory, and
+# nothing is sent to LangSmith
+os.environ["DOCGEN_DATA_DIR"] = tempfile.mkdtemp(prefix="docgen-tests-")
+os.environ["LANGSMITH_TRACING"] = "false"
+os.environ.setdefault("NVIDIA_API_KEY", "fake")
+os.environ.setdefault("TAVILY_API_KEY", "fake")
@@ -0,0 +1,77 @@
+"""Validation of report and batch requests by the Flask app."""
+
+import pytest
+
+import app as docgen_app
+from docgen_agent.jobs import CANCELLED, Job
+from docgen_agent.ratelimit import NoRateLimiter
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(docgen_app, "rate_limiter", NoRateLimiter())
+    monkeypatch.setattr(docgen_app, "_jobs_recovered", True)
+    return docgen_app.app.test_client()
+
+
+@pytest.mark.parametrize(
+    "body",
+    [
+        ["not", "an", "object"],
+        {"topic": 5, "report_structure": "Intro"},
+        {"topic": "Topic", "report_structure": ["Intro"]},
+        {"topic": "Topic", "report_structure": "Intro", "force_refresh": "no"},
+        {"topic": "  ", "report_structure": "Intro"},
+    ],
+)
+def test_malformed_report_requests_are_rejected(client, body):
+    response = client.post("/generate", json=body)
+
+    assert response.status_code == 400
+    assert "error" in response.get_json()
+
+
+@pytest.mark.parametrize(
+    "body",
+    [
+        ["not", "an", "object"],
+        {"reports": "not a list"},
+        {"reports": []},
+        {"reports": [{"topic": 5, "report_structure": "Intro"}]},
+        {"reports": [["not", "an", "object"]]},
+    ],
+)
+def test_malformed_batches_are_rejected(client, body):
+    response = client.post("/batch", json=body)
+
+    assert response.status_code == 400
+    assert "error" in response.get_json()
+
+
+def test_batches_larger_than_the_job_queue_are_rejected_for_good(client):
+    report = {"topic": "Topic", "report_structure": "Intro"}
+    reports = [report] * (docgen_app.job_queue.capacity + 1)
+
+    response = client.post("/batch", json={"reports": reports})
+
+    # Not 503: retrying could never admit the batch
+    assert response.status_code == 400
+    assert "Retry-After" not in response.headers
+
+
+def test_cancelling_jobs_only_in_the_job_store(client):
+    store = docgen_app.job_queue.store
+    orphaned = Job(topic="Topic", report_structure="Intro")
+    store.save(orphaned)
+    owned = Job(topic="Topic", report_structure="Intro")
+    store.save(owned, "another process")
+
+    response = client.delete(f"/jobs/{orphaned.id}")
+    assert response.status_code == 200
+    assert response.get_json()["status"] == CANCELLED
+    assert client.delete(f"/jobs/{orphaned.id}").status_code == 409
+
+    # Nothing was cancelled: the job runs on in its process
+    assert client.delete(f"/jobs/{owned.id}").status_code == 409
+    assert store.load(owned.id)["status"] == "queued"
+    assert client.delete("/jobs/unknown").status_code == 404
@@ -0,0 +1,73 @@
+"""Recording a whole report to a cassette, then replaying it offline.
+
+The report graphs run with a FakeChatModel and a local FakeTavily while the
+cassette records, then again from the cassette alone: with Tavily down and
+a model that fails on any call that was not recorded.
+"""
+
+import pytest
+from fake_llm import FakeChatModel
+from fake_tavily import FakeTavily
+
+from docgen_agent import agent, async_write_report, author, cassette, researcher, tools
+from docgen_agent.loop import submit
+
+TOPIC = "Cassette topic"
+STRUCTURE = "An introduction, a body and a conclusion."
+
+
+def _install(model: FakeChatModel) -> None:
+    """Replace the LLMs of the report graphs with model."""
+    with_tools = model.bind_tools([tools.search_tavily])
+    agent.llm = model
+    researcher.llm = model
+    researcher.llm_with_tools = with_tools
+    author.llm = model
+    author.llm_with_tools = with_tools
+
+
+@pytest.fixture
+def fake(monkeypatch):
+    server = FakeTavily().start()
+    monkeypatch.setattr(
+        tools, "tavily_client", tools.create_tavily_client("fake", server.url)
+    )
+    for module, name in [
+        (agent, "llm"),
+        (researcher, "llm"),
+        (researcher, "llm_with_tools"),
+        (author, "llm"),
+        (author, "llm_with_tools"),
+    ]:
+        monkeypatch.setattr(module, name, getattr(module, name))
+    yield server
+    server.stop()
+
+
+def _write(monkeypatch, tape: cassette.Cassette, model: FakeChatModel) -> dict:
+    monkeypatch.setattr(cassette, "cassette", tape)
+    _install(model.model_copy(update={"cache": cassette.CassetteLLMCache(tape)}))
+    result = submit(async_write_report(TOPIC, STRUCTURE)).result()
+    assert result is not None
+    return result
+
+
+def test_replay_reproduces_a_recorded_report(fake, monkeypatch, tmp_path):
+    path = str(tmp_path / "cassette.jsonl")
+    model = FakeChatModel(sections=4, tool_rounds=2, ttft=0.001, ttft_sigma=0)
+
+    recorded = _write(monkeypatch, cassette.Cassette(path, "record"), model)
+    assert fake.requests > 0
+
+    fake.configure(down=True)
+    # A different seed would write different text if the model were called
+    replayed = _write(
+        monkeypatch,
+        cassette.Cassette(path, "replay"),
+        model.model_copy(update={"seed": 1}),
+    )
+
+    assert replayed["report"] == recorded["report"]
+    assert replayed["sections"] == recorded["sections"]
+    # Every search was served from the cassette
+    assert fake.requests == 0
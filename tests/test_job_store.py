@@ -0,0 +1,75 @@
+"""Ownership of unfinished jobs shared by several processes' job queues."""
+
+import time
+
+import pytest
+
+from docgen_agent.job_store import JobStore
+from docgen_agent.jobs import COMPLETED, Job
+
+
+@pytest.fixture
+def store(tmp_path):
+    return JobStore(str(tmp_path / "jobs.sqlite"), lease_seconds=0.2)
+
+
+def test_a_new_job_is_owned_by_the_process_that_saved_it(store):
+    job = Job(topic="topic", report_structure="structure")
+    assert store.save(job, "first")
+
+    assert store.unfinished() == []
+    assert not store.claim(job.id, "second")
+    # Nor may another process overwrite it
+    assert not store.save(job, "second")
+    assert store.save(job, "first")
+
+
+def test_an_unfinished_job_is_claimed_once(store):
+    job = Job(topic="topic", report_structure="structure")
+    store.save(job)
+
+    assert [stored["id"] for stored in store.unfinished()] == [job.id]
+    assert store.claim(job.id, "first")
+    assert not store.claim(job.id, "second")
+    assert store.unfinished() == []
+
+
+def test_renewed_leases_keep_jobs_and_lapsed_ones_release_them(store):
+    job = Job(topic="topic", report_structure="structure")
+    store.save(job, "first")
+
+    time.sleep(0.15)
+    store.renew("first")
+    time.sleep(0.1)
+    assert not store.claim(job.id, "second")
+
+    time.sleep(0.2)
+    assert [stored["id"] for stored in store.unfinished()] == [job.id]
+    assert store.claim(job.id, "second")
+
+
+def test_finished_jobs_are_not_claimed(store):
+    job = Job(topic="topic", report_structure="structure")
+    store.save(job)
+    job.status = COMPLETED
+    store.save(job)
+
+    assert store.unfinished() == []
+    assert not store.claim(job.id, "first")
+
+
+def test_only_jobs_no_live_process_owns_are_cancelled(store):
+    owned = Job(topic="topic", report_structure="structure")
+    store.save(owned, "first")
+    orphaned = Job(topic="topic", report_structure="structure")
+    store.save(orphaned)
+
+    assert not store.cancel(owned.id)
+    assert store.cancel(orphaned.id)
+    assert store.load(orphaned.id)["status"] == "cancelled"
+    # Nor is a cancelled job recovered, or cancelled twice
+    assert store.unfinished() == []
+    assert not store.cancel(orphaned.id)
+
+    time.sleep(0.25)
+    assert store.cancel(owned.id)
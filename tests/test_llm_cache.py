@@ -0,0 +1,94 @@
+"""What the chat model cache keeps, and how retries get past it."""
+
+from typing import Any
+
+import pytest
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from pydantic import BaseModel
+
+from docgen_agent.cache import TieredCache
+from docgen_agent.limits import ainvoke_llm
+from docgen_agent.llm_cache import LLMCache
+from docgen_agent.loop import submit
+
+
+class Plan(BaseModel):
+    title: str
+
+
+class ScriptedModel(BaseChatModel):
+    """Answer with the next of its scripted messages."""
+
+    answers: list[AIMessage]
+    calls: int = 0
+
+    @property
+    def _llm_type(self) -> str:
+        return "scripted"
+
+    def _generate(
+        self,
+        messages: list[BaseMessage],
+        stop: Any = None,
+        run_manager: Any = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        answer = self.answers[min(self.calls, len(self.answers) - 1)]
+        self.calls += 1
+        return ChatResult(generations=[ChatGeneration(message=answer)])
+
+
+def _plan_call(title: str) -> AIMessage:
+    return AIMessage(
+        content="",
+        tool_calls=[{"name": "Plan", "args": {"title": title}, "id": "call-1"}],
+    )
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return LLMCache(TieredCache("llm_cache", path=str(tmp_path / "llm.sqlite")))
+
+
+def invoke(model: Any, retry: bool = False) -> Any:
+    messages = [{"role": "user", "content": "Plan a report."}]
+    return submit(ainvoke_llm(model, messages, {}, retry=retry)).result()
+
+
+def test_empty_responses_are_not_cached(cache):
+    model = ScriptedModel(answers=[AIMessage(""), AIMessage("An answer.")], cache=cache)
+
+    assert invoke(model).content == ""
+    assert invoke(model).content == "An answer."
+    assert invoke(model).content == "An answer."
+    assert model.calls == 2
+
+
+def test_a_retry_replaces_a_cached_response_that_failed_to_parse(cache):
+    model = ScriptedModel(
+        answers=[
+            AIMessage(
+                content="", tool_calls=[{"name": "Other", "args": {}, "id": "1"}]
+            ),
+            _plan_call("A plan"),
+        ],
+        cache=cache,
+    )
+    structured = model | (
+        lambda message: (
+            Plan(**message.tool_calls[0]["args"])
+            if message.tool_calls and message.tool_calls[0]["name"] == "Plan"
+            else None
+        )
+    )
+
+    assert invoke(structured) is None
+    assert invoke(structured) is None
+    assert model.calls == 1
+
+    assert invoke(structured, retry=True) == Plan(title="A plan")
+    # The fresh response replaced the one that failed
+    assert invoke(structured) == Plan(title="A plan")
+    assert model.calls == 2
@@ -0,0 +1,183 @@
+"""Retries, circuit breaking and rate limiting of Tavily searches.
+
+The search path of docgen_agent.tools runs against a local FakeTavily that
+answers each test's searches with the faults it is configured for.
+"""
+
+import itertools
+import time
+
+import httpx
+import pytest
+from fake_tavily import FakeTavily
+
+from docgen_agent import tools
+from docgen_agent.limits import SearchScheduler
+from docgen_agent.loop import submit
+from docgen_agent.resilience import CircuitBreaker, CircuitOpenError, RetryPolicy
+
+_queries = itertools.count()
+
+
+@pytest.fixture(scope="module")
+def server():
+    fake = FakeTavily().start()
+    yield fake
+    fake.stop()
+
+
+@pytest.fixture
+def fake(server, monkeypatch):
+    """The fake Tavily, healthy, behind a fresh scheduler and breaker."""
+    server.configure()
+    monkeypatch.setattr(
+        tools, "tavily_client", tools.create_tavily_client("fake", server.url)
+    )
+    monkeypatch.setattr(tools, "search_calls", SearchScheduler("search", 8, 200, 1))
+    monkeypatch.setattr(tools, "tavily_breaker", CircuitBreaker("tavily", 3, 0.2))
+    monkeypatch.setattr(
+        tools, "_RETRY_POLICY", RetryPolicy(attempts=3, base_delay=0.01, max_delay=0.05)
+    )
+    monkeypatch.setattr(tools, "SEARCH_TIMEOUT_SECONDS", 0.2)
+    return server
+
+
+def search(query: str | None = None) -> dict:
+    """Run one search, with retries, for a query no other test has used.
+
+    Searches run on the shared event loop, as in the app: the Tavily client
+    keeps its connections from one search to the next.
+    """
+    query = query or f"query {next(_queries)}"
+    return submit(
+        tools._search_with_retries(
+            query,
+            max_results=5,
+            include_raw_content=False,
+            topic="general",
+            days=None,
+        )
+    ).result()
+
+
+def test_healthy_search_sends_one_request(fake):
+    response = search()
+
+    assert len(response["results"]) == 5
+    assert fake.requests == 1
+    assert tools.tavily_breaker.state == "closed"
+
+
+def test_server_errors_are_retried(fake):
+    fake.configure(script=[500, 503])
+
+    response = search()
+
+    assert len(response["results"]) == 5
+    assert fake.requests == 3
+    assert fake.responses == {500: 1, 503: 1, 200: 1}
+    # The success shows Tavily is up again
+    assert tools.tavily_breaker.failures == 0
+
+
+def test_search_fails_after_its_attempts(fake):
+    fake.configure(failing="broken")
+
+    with pytest.raises(httpx.HTTPStatusError):
+        search(f"broken {next(_queries)}")
+
+    assert fake.requests == 3
+    assert tools.tavily_breaker.failures == 3
+
+
+def test_client_errors_are_not_retried(fake):
+    fake.configure(script=[400])
+
+    with pytest.raises(Exception):
+        search()
+
+    assert fake.requests == 1
+    assert tools.tavily_breaker.failures == 0
+
+
+def test_hanging_search_is_timed_out_and_retried(fake):
+    fake.configure(hang_rate=1.0, hang_seconds=0.5)
+
+    start = time.perf_counter()
+    with pytest.raises(TimeoutError):
+        search()
+
+    assert fake.requests == 3
+    # Each attempt gave up after SEARCH_TIMEOUT_SECONDS, not hang_seconds
+    assert time.perf_counter() - start < 3 * 0.5
+
+
+def test_rate_limit_honours_retry_after_and_slows_down(fake):
+    fake.configure(script=[429])
+    fake.retry_after = 1
+
+    start = time.perf_counter()
+    response = search()
+
+    assert len(response["results"]) == 5
+    assert fake.requests == 2
+    assert time.perf_counter() - start >= 1
+    assert tools.search_calls.rate < tools.search_calls.max_rate
+    # A busy Tavily is not a failing one
+    assert tools.tavily_breaker.failures == 0
+    assert tools.tavily_breaker.state == "closed"
+
+
+def test_breaker_opens_during_outage_and_fails_fast(fake):
+    fake.configure(down=True)
+
+    with pytest.raises(httpx.HTTPStatusError):
+        search()
+    assert tools.tavily_breaker.state == "open"
+    assert fake.requests == 3
+
+    with pytest.raises(CircuitOpenError):
+        search()
+    # The open circuit kept the search from reaching Tavily
+    assert fake.requests == 3
+
+
+def test_breaker_closes_after_a_successful_trial(fake):
+    fake.configure(down=True)
+    with pytest.raises(httpx.HTTPStatusError):
+        search()
+    assert tools.tavily_breaker.state == "open"
+
+    fake.configure()
+    time.sleep(tools.tavily_breaker.reset_seconds)
+    assert tools.tavily_breaker.state == "half_open"
+
+    search()
+    assert fake.requests == 1
+    assert tools.tavily_breaker.state == "closed"
+
+
+def test_breaker_opens_again_after_a_failed_trial(fake):
+    fake.configure(down=True)
+    with pytest.raises(httpx.HTTPStatusError):
+        search()
+
+    fake.configure(down=True)
+    time.sleep(tools.tavily_breaker.reset_seconds)
+    with pytest.raises((httpx.HTTPStatusError, CircuitOpenError)):
+        search()
+
+    # Only the trial reached Tavily before the circuit opened again
+    assert fake.requests == 1
+    assert tools.tavily_breaker.state == "open"
+
+
+def test_partial_failure_returns_the_other_results(fake):
+    fake.configure(failing="broken")
+    run = next(_queries)
+    queries = [f"partial {run} a", f"partial {run} broken", f"partial {run} c"]
+
+    text = submit(tools.search_tavily.ainvoke({"queries": queries})).result()
+
+    assert text.count("URL: ") == 10
+    assert f"These searches failed: {queries[1]}" in text
@@ -0,0 +1,50 @@
+"""Counting tokens with the tokenizers bundled for each model."""
+
+import socket
+
+import pytest
+
+from docgen_agent import tokens
+
+TEXT = "Grid-scale batteries shifted 1234 MWh of solar output into the evening."
+
+
+@pytest.fixture
+def offline(monkeypatch):
+    """Fail any attempt to open a network connection."""
+
+    def connect(*args, **kwargs):
+        raise AssertionError("the tokenizer tried to reach the network")
+
+    monkeypatch.setattr(socket, "create_connection", connect)
+    monkeypatch.setattr(socket.socket, "connect", connect)
+    tokens._load.cache_clear()
+    tokens.clear_cache()
+
+
+@pytest.mark.parametrize(
+    "model, encoding",
+    [("meta/llama-3.3-70b-instruct", "llama3"), ("gpt-4o-mini", "o200k_base")],
+)
+def test_models_count_in_their_bundled_encoding(offline, model, encoding):
+    with tokens.for_model(model):
+        assert tokens.exact()
+        assert tokens._encoding().name == encoding
+        count = tokens.count_tokens(TEXT)
+
+    assert 0 < count < len(TEXT) / 2
+
+
+def test_encodings_differ_between_models(offline):
+    with tokens.for_model("meta/llama-3.3-70b-instruct"):
+        llama = tokens._encoding().encode_ordinary(TEXT)
+    with tokens.for_model("gpt-4o-mini"):
+        gpt = tokens._encoding().encode_ordinary(TEXT)
+
+    assert llama != gpt
+
+
+def test_unknown_models_are_estimated(offline):
+    with tokens.for_model("some/other-model"):
+        assert not tokens.exact()
+        assert tokens.count_tokens("x" * 40) == 10